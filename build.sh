@@ -14,6 +14,9 @@ python manage.py collectstatic --no-input
 # Run migrations
 python manage.py migrate
 
+# Create the cache table (used when CACHE_URL is db://)
+python manage.py createcachetable
+
 # Load fixtures if they exist
 if [ -f "mercadocesar/fixtures/admin_user.json" ]; then
     python manage.py loaddata mercadocesar/fixtures/admin_user.json
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Produto, Estoque, Armazem, ItemCarrinho, Pedido, ItemPedido
+from .models import Produto, Estoque, Armazem, ItemCarrinho, Pedido, ItemPedido, ReservaEstoque, EstoqueMinimo, PrevisaoDemanda
 
 admin.site.register(Produto)
 admin.site.register(Estoque)
@@ -22,4 +22,18 @@ class PedidoAdmin(admin.ModelAdmin):
 class ItemPedidoAdmin(admin.ModelAdmin):
     list_display = ('pedido', 'produto', 'quantidade', 'preco_unitario')
 
+@admin.register(ReservaEstoque)
+class ReservaEstoqueAdmin(admin.ModelAdmin):
+    list_display = ('carrinho', 'produto', 'quantidade', 'expira_em')
+    list_filter = ('expira_em',)
 
+@admin.register(EstoqueMinimo)
+class EstoqueMinimoAdmin(admin.ModelAdmin):
+    list_display = ('produto', 'categoria', 'quantidade_minima')
+    search_fields = ('produto__codigo', 'produto__nome', 'categoria')
+    raw_id_fields = ('produto',)
+
+@admin.register(PrevisaoDemanda)
+class PrevisaoDemandaAdmin(admin.ModelAdmin):
+    list_display = ('produto', 'demanda_suavizada', 'media_movel', 'ponto_pedido', 'quantidade_sugerida', 'calculado_em')
+    readonly_fields = ('calculado_em',)
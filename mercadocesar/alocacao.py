@@ -0,0 +1,191 @@
+"""
+Alocação de estoque entre armazéns.
+
+Dado um pedido {produto_id: quantidade}, decide de quais linhas de Estoque sai
+cada unidade. Todas as linhas candidatas do pedido são lidas numa única consulta
+e entregues à estratégia de uma vez, o que permite estratégias que olham o pedido
+inteiro (como usar o menor número de armazéns). O plano não altera o banco: quem
+debita é estoque.baixar_estoque, e o comando simular_alocacao compara estratégias
+sem efeito colateral.
+
+Estratégias disponíveis (ESTRATEGIA_ALOCACAO_ESTOQUE escolhe a padrão):
+    maior_estoque   armazéns com mais unidades primeiro
+    menos_armazens  cobre o pedido com o menor número de armazéns
+    mais_proximo    armazéns com CEP mais próximo do destino (loja de retirada)
+    fifo            unidades repostas há mais tempo primeiro
+"""
+import re
+from collections import defaultdict
+
+from django.conf import settings
+
+from .models import Estoque
+
+ESTRATEGIA_PADRAO = 'maior_estoque'
+
+
+def distribuir(estoques, quantidade):
+    """Divide a quantidade entre os estoques na ordem dada, como lista de (estoque, unidades)"""
+    retiradas = []
+    restante = quantidade
+    for estoque in estoques:
+        if restante <= 0:
+            break
+        unidades = min(estoque.quantidade, restante)
+        retiradas.append((estoque, unidades))
+        restante -= unidades
+    return retiradas
+
+
+def _numero_cep(cep):
+    digitos = re.sub(r'[^0-9]', '', cep or '')
+    return int(digitos) if len(digitos) == 8 else None
+
+
+class PlanoAlocacao:
+    """Resultado da alocação: retiradas por produto e produtos sem estoque suficiente"""
+
+    def __init__(self, retiradas, faltas):
+        self.retiradas = retiradas  # {produto_id: [(estoque, unidades)]}
+        self.faltas = faltas        # [(produto_id, disponivel, solicitado)]
+
+    @property
+    def armazens(self):
+        return {estoque.armazem_id for linhas in self.retiradas.values() for estoque, _ in linhas}
+
+    @property
+    def debitos(self):
+        """{estoque_id: unidades} a debitar"""
+        return {estoque.id: unidades for linhas in self.retiradas.values() for estoque, unidades in linhas}
+
+
+class EstrategiaAlocacao:
+    """Base das estratégias: ordena os estoques de cada produto por 'chave'"""
+
+    nome = None
+    descricao = ''
+
+    def chave(self, estoque, cep_destino):
+        """Ordem de uso dos estoques; por padrão, armazéns com mais unidades primeiro"""
+        return (-estoque.quantidade, estoque.id)
+
+    def alocar(self, candidatos, quantidades, cep_destino=None):
+        """{produto_id: [(estoque, unidades)]} para quantidades já conferidas"""
+        return {
+            produto_id: distribuir(
+                sorted(candidatos[produto_id], key=lambda e: self.chave(e, cep_destino)), solicitado
+            )
+            for produto_id, solicitado in quantidades.items()
+        }
+
+
+class MaiorEstoque(EstrategiaAlocacao):
+    nome = 'maior_estoque'
+    descricao = 'Armazéns com mais unidades primeiro'
+
+
+class Fifo(EstrategiaAlocacao):
+    nome = 'fifo'
+    descricao = 'Unidades repostas há mais tempo primeiro'
+
+    def chave(self, estoque, cep_destino):
+        return (estoque.reabastecido_em, estoque.id)
+
+
+class MaisProximo(EstrategiaAlocacao):
+    nome = 'mais_proximo'
+    descricao = 'Armazéns com CEP mais próximo do destino'
+
+    def chave(self, estoque, cep_destino):
+        # CEPs numericamente próximos ficam na mesma região; sem CEP vai para o fim
+        origem = _numero_cep(estoque.armazem.cep)
+        destino = _numero_cep(cep_destino)
+        distancia = abs(origem - destino) if origem is not None and destino is not None else float('inf')
+        return (distancia, -estoque.quantidade, estoque.id)
+
+
+class MenosArmazens(EstrategiaAlocacao):
+    nome = 'menos_armazens'
+    descricao = 'Menor número de armazéns para o pedido inteiro'
+
+    def alocar(self, candidatos, quantidades, cep_destino=None):
+        # Cobertura gulosa: a cada passo usa o armazém que atende mais unidades restantes
+        restante = dict(quantidades)
+        por_armazem = defaultdict(dict)
+        for produto_id in quantidades:
+            for estoque in candidatos[produto_id]:
+                por_armazem[estoque.armazem_id][produto_id] = estoque
+
+        def cobertura(armazem_id):
+            return sum(min(e.quantidade, restante[p]) for p, e in por_armazem[armazem_id].items())
+
+        retiradas = {produto_id: [] for produto_id in quantidades}
+        while por_armazem and any(restante.values()):
+            melhor = max(por_armazem, key=lambda a: (cobertura(a), -a))
+            if cobertura(melhor) == 0:
+                break
+            for produto_id, estoque in por_armazem.pop(melhor).items():
+                unidades = min(estoque.quantidade, restante[produto_id])
+                if unidades:
+                    retiradas[produto_id].append((estoque, unidades))
+                    restante[produto_id] -= unidades
+        return retiradas
+
+
+ESTRATEGIAS = {estrategia.nome: estrategia for estrategia in (MaiorEstoque(), MenosArmazens(), MaisProximo(), Fifo())}
+
+
+def obter_estrategia(nome=None):
+    """Estratégia pelo nome, ou a configurada em ESTRATEGIA_ALOCACAO_ESTOQUE"""
+    nome = nome or getattr(settings, 'ESTRATEGIA_ALOCACAO_ESTOQUE', ESTRATEGIA_PADRAO)
+    try:
+        return ESTRATEGIAS[nome]
+    except KeyError:
+        raise ValueError(f"Estratégia de alocação desconhecida: {nome}") from None
+
+
+def carregar_candidatos(produto_ids, travar=False, excluir_armazem=None, somente_armazem=None):
+    """Linhas de Estoque com unidades dos produtos, em uma consulta, agrupadas por produto"""
+    estoques = Estoque.objects.filter(produto_id__in=produto_ids, quantidade__gt=0).select_related('armazem')
+    if excluir_armazem is not None:
+        estoques = estoques.exclude(armazem_id=excluir_armazem)
+    if somente_armazem is not None:
+        estoques = estoques.filter(armazem_id=somente_armazem)
+    if travar:
+        # Ordem fixa das travas evita deadlock entre pedidos simultâneos
+        estoques = estoques.select_for_update(of=('self',))
+    candidatos = defaultdict(list)
+    for estoque in estoques.order_by('id'):
+        candidatos[estoque.produto_id].append(estoque)
+    return candidatos
+
+
+def planejar_alocacao(quantidades, estrategia=None, cep_destino=None, candidatos=None, travar=False,
+                      excluir_armazem=None, somente_armazem=None, reservados=None):
+    """
+    Plano de retirada para {produto_id: quantidade} segundo a estratégia.
+
+    Produtos cuja soma de unidades em todos os armazéns, descontadas as unidades
+    em 'reservados' ({produto_id: unidades} reservadas por outros), não basta
+    ficam em 'faltas' e não recebem retiradas.
+    """
+    reservados = reservados or {}
+    estrategia = estrategia if isinstance(estrategia, EstrategiaAlocacao) else obter_estrategia(estrategia)
+    quantidades = {produto_id: qtd for produto_id, qtd in quantidades.items() if qtd > 0}
+    if candidatos is None:
+        candidatos = carregar_candidatos(
+            quantidades, travar=travar, excluir_armazem=excluir_armazem, somente_armazem=somente_armazem
+        )
+
+    faltas = []
+    atendiveis = {}
+    for produto_id, solicitado in quantidades.items():
+        disponivel = sum(e.quantidade for e in candidatos.get(produto_id, ()))
+        disponivel = max(disponivel - reservados.get(produto_id, 0), 0)
+        if disponivel < solicitado:
+            faltas.append((produto_id, disponivel, solicitado))
+        else:
+            atendiveis[produto_id] = solicitado
+
+    retiradas = estrategia.alocar(candidatos, atendiveis, cep_destino) if atendiveis else {}
+    return PlanoAlocacao(retiradas, faltas)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MercadocesarConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mercadocesar'
+
+    def ready(self):
+        from . import signals  # noqa: F401
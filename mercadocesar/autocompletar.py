@@ -0,0 +1,249 @@
+"""
+Sugestões de busca enquanto o usuário digita.
+
+Mantém em memória, por processo, listas ordenadas de chaves (palavras de nome,
+código e categoria sem acentos) consultadas por prefixo com bisect, sem acessar
+o banco a cada tecla. Os produtos são ordenados pelas unidades vendidas
+(VendaProduto). Prefixos que casam com muitas chaves têm os mais vendidos
+pré-calculados; nos demais o intervalo de chaves, pequeno, é percorrido inteiro.
+"""
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+
+from .indice_busca import normalizar
+from .indices_memoria import ReconstrucaoIndice
+
+TIPO_CATEGORIA = 'categoria'
+TIPO_PRODUTO = 'produto'
+
+# Idade máxima do índice, em segundos, antes de recarregar produtos e vendas do banco
+IDADE_MAXIMA_INDICE = 300
+
+# Prefixos que casam com mais chaves que isto têm os mais vendidos pré-calculados
+TAMANHO_INTERVALO_PRECALCULADO = 256
+
+# Produtos guardados por prefixo pré-calculado
+MELHORES_POR_PREFIXO = 32
+
+# Maior que qualquer caractere: (prefixo + _FIM,) vem depois de todas as chaves com o prefixo
+_FIM = '\U0010ffff'
+
+_PALAVRA = re.compile(r'\w+')
+
+
+def chaves_produto(produto):
+    """Chaves de busca de um produto: cada palavra do nome em diante e o código"""
+    palavras = _PALAVRA.findall(normalizar(produto.nome))
+    chaves = {' '.join(palavras[i:]) for i in range(len(palavras))}
+    chaves.add(' '.join(_PALAVRA.findall(normalizar(produto.codigo))))
+    return chaves
+
+
+def chave_categoria(categoria):
+    return ' '.join(_PALAVRA.findall(normalizar(categoria)))
+
+
+class IndicePrefixos:
+    """
+    Listas ordenadas de (chave, id, texto) dos produtos e (chave, texto) das
+    categorias, consultadas por prefixo, e os mais vendidos dos prefixos com
+    intervalos grandes como listas ordenadas de (-vendas, texto, id).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas = []
+        self._entradas_produto = {}
+        self._categorias = []
+        self._produtos_categoria = Counter()
+        self._categoria_produto = {}
+        self._melhores = {}
+        self._vendas = {}
+        self.construido_em = None
+
+    def _ordem(self, produto_id, texto):
+        return (-self._vendas.get(produto_id, 0), texto, produto_id)
+
+    def _melhores_do_intervalo(self, prefixo, limite):
+        """Os 'limite' produtos mais vendidos entre todas as chaves que começam com o prefixo"""
+        produtos = {}
+        posicao = bisect_left(self._entradas, (prefixo,))
+        while posicao < len(self._entradas) and self._entradas[posicao][0].startswith(prefixo):
+            _, produto_id, texto = self._entradas[posicao]
+            produtos[produto_id] = texto
+            posicao += 1
+        return heapq.nsmallest(limite, (self._ordem(produto_id, texto) for produto_id, texto in produtos.items()))
+
+    def _precalcular(self, inicio, fim, tamanho, melhores):
+        """
+        Mais vendidos de self._entradas[inicio:fim], intervalo cujas chaves
+        compartilham os primeiros 'tamanho - 1' caracteres. Grava em 'melhores'
+        os de cada prefixo de 'tamanho' caracteres com intervalo grande,
+        calculados a partir dos prefixos seguintes, de baixo para cima.
+        """
+        itens = {}
+        posicao = inicio
+        while posicao < fim:
+            chave, produto_id, texto = self._entradas[posicao]
+            if len(chave) < tamanho:
+                itens[produto_id] = self._ordem(produto_id, texto)
+                posicao += 1
+                continue
+            prefixo = chave[:tamanho]
+            final = bisect_left(self._entradas, (prefixo + _FIM,), posicao, fim)
+            if final - posicao > TAMANHO_INTERVALO_PRECALCULADO:
+                melhores[prefixo] = self._precalcular(posicao, final, tamanho + 1, melhores)
+                itens.update((item[2], item) for item in melhores[prefixo])
+            else:
+                itens.update(
+                    (produto_id, self._ordem(produto_id, texto)) for _, produto_id, texto in self._entradas[posicao:final]
+                )
+            posicao = final
+        return heapq.nsmallest(MELHORES_POR_PREFIXO, itens.values())
+
+    def _prefixos_precalculados(self, chaves):
+        """Prefixos das chaves que têm mais vendidos pré-calculados"""
+        prefixos = set()
+        for chave in chaves:
+            for tamanho in range(1, len(chave) + 1):
+                # Prefixos pré-calculados são aninhados: se este não for, os seguintes também não são
+                if chave[:tamanho] not in self._melhores:
+                    break
+                prefixos.add(chave[:tamanho])
+        return prefixos
+
+    def _adicionar(self, produto):
+        chaves = chaves_produto(produto)
+        entradas = [(chave, produto.id, produto.nome) for chave in chaves]
+        for entrada in entradas:
+            insort(self._entradas, entrada)
+        self._entradas_produto[produto.id] = entradas
+
+        item = self._ordem(produto.id, produto.nome)
+        for prefixo in self._prefixos_precalculados(chaves):
+            melhores = self._melhores[prefixo]
+            insort(melhores, item)
+            del melhores[MELHORES_POR_PREFIXO:]
+
+        categoria = produto.categoria
+        self._categoria_produto[produto.id] = categoria
+        if self._produtos_categoria[categoria] == 0:
+            insort(self._categorias, (chave_categoria(categoria), categoria))
+        self._produtos_categoria[categoria] += 1
+
+    def _remover_entrada(self, lista, entrada):
+        posicao = bisect_left(lista, entrada)
+        if posicao < len(lista) and lista[posicao] == entrada:
+            del lista[posicao]
+
+    def _remover(self, produto_id):
+        entradas = self._entradas_produto.pop(produto_id, ())
+        for entrada in entradas:
+            self._remover_entrada(self._entradas, entrada)
+
+        if entradas:
+            item = self._ordem(produto_id, entradas[0][2])
+            for prefixo in self._prefixos_precalculados([chave for chave, _, _ in entradas]):
+                melhores = self._melhores[prefixo]
+                if item not in melhores:
+                    continue
+                melhores.remove(item)
+                # Lista cheia que perdeu um produto: o próximo mais vendido pode ter ficado fora dela
+                if len(melhores) == MELHORES_POR_PREFIXO - 1:
+                    melhores[:] = self._melhores_do_intervalo(prefixo, MELHORES_POR_PREFIXO)
+                if not melhores:
+                    del self._melhores[prefixo]
+
+        categoria = self._categoria_produto.pop(produto_id, None)
+        if categoria is not None:
+            self._produtos_categoria[categoria] -= 1
+            if self._produtos_categoria[categoria] <= 0:
+                del self._produtos_categoria[categoria]
+                self._remover_entrada(self._categorias, (chave_categoria(categoria), categoria))
+
+    def construir(self, produtos, vendas):
+        """Reconstrói o índice a partir dos produtos e de {produto_id: unidades vendidas}"""
+        novo = IndicePrefixos()
+        novo._vendas = dict(vendas)
+        for produto in produtos:
+            novo._entradas_produto[produto.id] = [
+                (chave, produto.id, produto.nome) for chave in chaves_produto(produto)
+            ]
+            novo._entradas.extend(novo._entradas_produto[produto.id])
+            novo._categoria_produto[produto.id] = produto.categoria
+            novo._produtos_categoria[produto.categoria] += 1
+        novo._entradas.sort()
+        novo._categorias = sorted(
+            (chave_categoria(categoria), categoria) for categoria in novo._produtos_categoria
+        )
+        novo._precalcular(0, len(novo._entradas), 1, novo._melhores)
+
+        with self._lock:
+            self._entradas = novo._entradas
+            self._entradas_produto = novo._entradas_produto
+            self._categorias = novo._categorias
+            self._produtos_categoria = novo._produtos_categoria
+            self._categoria_produto = novo._categoria_produto
+            self._melhores = novo._melhores
+            self._vendas = novo._vendas
+            self.construido_em = time.monotonic()
+
+    def atualizar(self, produto):
+        with self._lock:
+            self._remover(produto.id)
+            self._adicionar(produto)
+
+    def remover(self, produto_id):
+        with self._lock:
+            self._remover(produto_id)
+
+    def sugerir(self, prefixo, limite=8):
+        """Até 'limite' sugestões para o prefixo: categorias primeiro, depois os mais vendidos"""
+        prefixo = ' '.join(_PALAVRA.findall(normalizar(prefixo)))
+        if not prefixo:
+            return []
+
+        categorias = []
+        with self._lock:
+            posicao = bisect_left(self._categorias, (prefixo,))
+            while posicao < len(self._categorias) and self._categorias[posicao][0].startswith(prefixo):
+                categorias.append(self._categorias[posicao][1])
+                posicao += 1
+            if prefixo in self._melhores and limite <= MELHORES_POR_PREFIXO:
+                mais_vendidos = self._melhores[prefixo][:limite]
+            else:
+                mais_vendidos = self._melhores_do_intervalo(prefixo, limite)
+
+        sugestoes = [{'texto': texto, 'tipo': TIPO_CATEGORIA} for texto in categorias]
+        sugestoes += [{'texto': texto, 'tipo': TIPO_PRODUTO, 'id': produto_id} for _, texto, produto_id in mais_vendidos]
+        return sugestoes[:limite]
+
+
+def carregar_indice_prefixos(indice):
+    from .models import Produto, VendaProduto
+
+    indice.construir(
+        Produto.objects.only('id', 'nome', 'codigo', 'categoria').iterator(chunk_size=2000),
+        VendaProduto.objects.values_list('produto_id', 'total_vendido'),
+    )
+
+
+_reconstrucao = ReconstrucaoIndice(IndicePrefixos(), carregar_indice_prefixos, IDADE_MAXIMA_INDICE)
+
+
+def obter_indice_prefixos():
+    """Índice do processo atual, construído na primeira chamada e renovado quando antigo"""
+    return _reconstrucao.obter()
+
+
+def indice_prefixos_construido():
+    """Índice do processo atual, ou None se ainda não foi construído"""
+    return _reconstrucao.construido()
+
+
+def aquecer_indice_prefixos():
+    _reconstrucao.aquecer()
@@ -0,0 +1,125 @@
+"""Consultas de busca de produtos usadas pela página de busca e pela API JSON"""
+import base64
+import json
+
+from django.db.models import Count, Q
+from .indice_busca import buscar_produtos, pagina_por_relevancia
+from .models import Produto
+
+TAMANHO_PAGINA_BUSCA = 24
+LIMITE_MAXIMO_BUSCA = 60
+
+
+# Ordenação da listagem: por categoria sem termo, por relevância com termo
+ORDEM_CATALOGO = ('categoria', 'id')
+ORDEM_RELEVANCIA = ('relevancia', 'id')
+
+# Tipo do primeiro valor do cursor em cada ordenação
+TIPOS_CURSOR = {ORDEM_CATALOGO: str, ORDEM_RELEVANCIA: float}
+
+
+def codificar_cursor(produto, ordem):
+    """Gera o cursor opaco que aponta para depois do produto informado"""
+    bruto = json.dumps([getattr(produto, campo) for campo in ordem]).encode()
+    return base64.urlsafe_b64encode(bruto).decode()
+
+
+def decodificar_cursor(cursor, ordem=ORDEM_CATALOGO):
+    """
+    Retorna os valores de ordenação do cursor, ou None se o cursor for inválido.
+
+    O primeiro valor precisa ter o tipo do campo de ordenação e o segundo ser
+    um id inteiro, já que ambos vão direto para o filtro da consulta.
+    """
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(valores, list) or len(valores) != 2:
+        return None
+    valor, produto_id = valores
+    # bool é subclasse de int, mas não é um valor de ordenação válido
+    if type(produto_id) is not int or type(valor) is not TIPOS_CURSOR[ordem]:
+        return None
+    return valores
+
+
+def filtrar_por_termo(produtos, termo):
+    """Filtra pelo índice de busca textual, mantendo a ordem do queryset"""
+    termo = (termo or '').strip()
+    if not termo:
+        return produtos
+    return buscar_produtos(termo, produtos)
+
+
+def facetas_categorias(termo=''):
+    """Quantidade de produtos por categoria para o termo buscado"""
+    produtos = filtrar_por_termo(Produto.objects.all(), termo)
+    return list(
+        produtos.order_by().values('categoria').annotate(total=Count('id')).order_by('categoria')
+    )
+
+
+def pagina_relevancia(termo, categoria, posicao, limite):
+    """Produtos de uma página da busca por termo, com a relevância vinda do índice"""
+    filtrados = Produto.objects.all()
+    if categoria:
+        filtrados = filtrados.filter(categoria__iexact=categoria)
+
+    resultados = pagina_por_relevancia(termo, filtrados, posicao, limite)
+    por_id = Produto.objects.com_disponibilidade().in_bulk([produto_id for produto_id, _ in resultados])
+    pagina = []
+    for produto_id, relevancia in resultados:
+        # Produto removido entre a consulta ao índice e a leitura
+        if produto_id not in por_id:
+            continue
+        produto = por_id[produto_id]
+        produto.relevancia = relevancia
+        pagina.append(produto)
+    return pagina
+
+
+def pagina_produtos(termo='', categoria='', cursor=None, limite=TAMANHO_PAGINA_BUSCA):
+    """
+    Busca uma página do catálogo usando paginação por chave.
+
+    Sem termo a chave é (categoria, id); com termo é (relevancia, id), paginada
+    dentro da consulta ao índice de busca.
+    Retorna (produtos, proximo_cursor); proximo_cursor é None na última página.
+    """
+    limite = max(1, min(limite, LIMITE_MAXIMO_BUSCA))
+    termo = (termo or '').strip()
+    ordem = ORDEM_RELEVANCIA if termo else ORDEM_CATALOGO
+    posicao = decodificar_cursor(cursor, ordem) if cursor else None
+
+    # Busca um item a mais para saber se existe próxima página
+    if termo:
+        pagina = pagina_relevancia(termo, categoria, posicao, limite + 1)
+    else:
+        produtos = Produto.objects.com_disponibilidade().order_by(*ORDEM_CATALOGO)
+        if categoria:
+            produtos = produtos.filter(categoria__iexact=categoria)
+        if posicao:
+            categoria_cursor, id_cursor = posicao
+            produtos = produtos.filter(
+                Q(categoria__gt=categoria_cursor) | Q(categoria=categoria_cursor, id__gt=id_cursor)
+            )
+        pagina = list(produtos[:limite + 1])
+
+    proximo_cursor = codificar_cursor(pagina[limite - 1], ordem) if len(pagina) > limite else None
+    return pagina[:limite], proximo_cursor
+
+
+def produto_para_dict(produto):
+    """Representação JSON de um produto anotado por Produto.objects.com_disponibilidade()"""
+    return {
+        'id': produto.id,
+        'nome': produto.nome,
+        'codigo': produto.codigo,
+        'descricao': produto.descricao,
+        'categoria': produto.categoria,
+        'preco': str(produto.preco),
+        'estoque': produto.estoque_livre,
+        'disponivel': produto.disponivel,
+        'imagem': produto.imagem.url if produto.imagem else None,
+    }
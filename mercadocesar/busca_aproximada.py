@@ -0,0 +1,152 @@
+"""
+Busca tolerante a erros de digitação ("pesi" -> "pepsi").
+
+Mantém em memória, por processo, um índice invertido de trigramas sobre as
+palavras de nome e descrição dos produtos. O índice é construído na subida do
+processo web (ou na primeira consulta), atualizado pelos sinais de Produto e
+reconstruído periodicamente em segundo plano para incorporar alterações feitas
+por outros processos.
+"""
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from .indice_busca import normalizar
+from .indices_memoria import ReconstrucaoIndice
+
+_PALAVRA = re.compile(r'\w+')
+
+# Similaridade mínima (Jaccard entre trigramas) para sugerir uma palavra
+SIMILARIDADE_MINIMA = 0.3
+
+# Idade máxima do índice, em segundos, antes de reconstruir a partir do banco
+IDADE_MAXIMA_INDICE = 300
+
+
+def trigramas(palavra):
+    """Conjunto de trigramas da palavra, com espaços marcando início e fim"""
+    texto = f'  {palavra} '
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def palavras_do_texto(texto):
+    """Palavras normalizadas do texto que entram no índice"""
+    return {p for p in _PALAVRA.findall(normalizar(texto)) if len(p) >= 3 and not p.isdigit()}
+
+
+class IndiceTrigramas:
+    """Índice invertido trigrama -> palavras, com contagem de produtos por palavra"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._palavras_produto = {}
+        self._produtos_por_palavra = Counter()
+        self._trigramas = defaultdict(set)
+        self._trigramas_palavra = {}
+        self.construido_em = None
+
+    def _adicionar_palavras(self, produto_id, palavras):
+        self._palavras_produto[produto_id] = palavras
+        for palavra in palavras:
+            if self._produtos_por_palavra[palavra] == 0:
+                grams = trigramas(palavra)
+                self._trigramas_palavra[palavra] = grams
+                for gram in grams:
+                    self._trigramas[gram].add(palavra)
+            self._produtos_por_palavra[palavra] += 1
+
+    def _remover_palavras(self, produto_id):
+        for palavra in self._palavras_produto.pop(produto_id, ()):
+            self._produtos_por_palavra[palavra] -= 1
+            if self._produtos_por_palavra[palavra] <= 0:
+                del self._produtos_por_palavra[palavra]
+                for gram in self._trigramas_palavra.pop(palavra):
+                    self._trigramas[gram].discard(palavra)
+                    if not self._trigramas[gram]:
+                        del self._trigramas[gram]
+
+    def construir(self, produtos):
+        """Reconstrói o índice a partir de tuplas (id, nome, descricao)"""
+        novo = IndiceTrigramas()
+        for produto_id, nome, descricao in produtos:
+            novo._adicionar_palavras(produto_id, palavras_do_texto(f'{nome} {descricao}'))
+        with self._lock:
+            self._palavras_produto = novo._palavras_produto
+            self._produtos_por_palavra = novo._produtos_por_palavra
+            self._trigramas = novo._trigramas
+            self._trigramas_palavra = novo._trigramas_palavra
+            self.construido_em = time.monotonic()
+
+    def atualizar(self, produto):
+        with self._lock:
+            self._remover_palavras(produto.id)
+            self._adicionar_palavras(produto.id, palavras_do_texto(f'{produto.nome} {produto.descricao}'))
+
+    def remover(self, produto_id):
+        with self._lock:
+            self._remover_palavras(produto_id)
+
+    def contem(self, palavra):
+        return palavra in self._produtos_por_palavra
+
+    def semelhantes(self, palavra, limite=5):
+        """Palavras do índice mais parecidas, como lista de (palavra, similaridade)"""
+        grams = trigramas(palavra)
+        with self._lock:
+            comuns = Counter()
+            for gram in grams:
+                comuns.update(self._trigramas.get(gram, ()))
+            resultados = []
+            for candidata, em_comum in comuns.items():
+                total = len(grams) + len(self._trigramas_palavra[candidata]) - em_comum
+                similaridade = em_comum / total
+                if similaridade >= SIMILARIDADE_MINIMA:
+                    resultados.append((candidata, similaridade, self._produtos_por_palavra[candidata]))
+        # Empates favorecem palavras presentes em mais produtos
+        resultados.sort(key=lambda r: (-r[1], -r[2], r[0]))
+        return [(candidata, similaridade) for candidata, similaridade, _ in resultados[:limite]]
+
+    def sugerir(self, termo):
+        """Termo corrigido palavra a palavra, ou None se não houver correção"""
+        palavras = _PALAVRA.findall(normalizar(termo))
+        corrigidas = []
+        for palavra in palavras:
+            if len(palavra) < 3 or palavra.isdigit() or self.contem(palavra):
+                corrigidas.append(palavra)
+                continue
+            semelhantes = self.semelhantes(palavra, limite=1)
+            corrigidas.append(semelhantes[0][0] if semelhantes else palavra)
+        if corrigidas == palavras:
+            return None
+        return ' '.join(corrigidas)
+
+
+def carregar_indice_aproximado(indice):
+    from .models import Produto
+    indice.construir(Produto.objects.values_list('id', 'nome', 'descricao').iterator(chunk_size=2000))
+
+
+_reconstrucao = ReconstrucaoIndice(IndiceTrigramas(), carregar_indice_aproximado, IDADE_MAXIMA_INDICE)
+
+
+def obter_indice_aproximado():
+    """Índice do processo atual, construído na primeira chamada e renovado quando antigo"""
+    return _reconstrucao.obter()
+
+
+def indice_aproximado_construido():
+    """Índice do processo atual, ou None se ainda não foi construído"""
+    return _reconstrucao.construido()
+
+
+def aquecer_indice_aproximado():
+    _reconstrucao.aquecer()
+
+
+def sugerir_termo(termo):
+    """Sugestão de "você quis dizer" para um termo de busca"""
+    termo = (termo or '').strip()
+    if not termo:
+        return None
+    return obter_indice_aproximado().sugerir(termo)
@@ -0,0 +1,71 @@
+"""
+Leitura de valores caros do cache compartilhado, com proteção contra estouro.
+
+Quando uma chave popular expira, todos os workers que a leem ao mesmo tempo
+recalculariam o valor juntos. Aqui cada valor guarda o instante em que fica
+velho e continua no cache por mais um tempo: o primeiro worker que o encontra
+velho pega uma trava (cache.add) e recalcula, enquanto os demais seguem servindo
+o valor anterior. Um pouco antes de ficar velho o recálculo também pode ser
+antecipado, com probabilidade crescente, para espalhar os recálculos no tempo.
+"""
+import math
+import random
+import time
+
+from django.core.cache import cache
+
+from .cache_versoes import ler_com_versoes
+
+# Tempo máximo, em segundos, que um worker segura a trava de recálculo
+TEMPO_TRAVA = 30
+
+# Quanto tempo o valor velho continua disponível, em múltiplos do timeout
+FATOR_SOBREVIDA = 2
+
+# Intensidade da antecipação (1 é o recomendado pelo algoritmo XFetch)
+BETA_ANTECIPACAO = 1.0
+
+
+def _deve_antecipar(duracao_calculo, expira_em, agora):
+    """Sorteia se o valor deve ser recalculado antes de ficar velho"""
+    return agora - duracao_calculo * BETA_ANTECIPACAO * math.log(random.random() or 1e-12) >= expira_em
+
+
+def _calcular_e_guardar(chave, calcular, timeout, versoes):
+    inicio = time.monotonic()
+    valor = calcular()
+    duracao = time.monotonic() - inicio
+    cache.set(chave, (valor, time.time() + timeout, duracao, versoes), timeout * (1 + FATOR_SOBREVIDA))
+    return valor
+
+
+def obter_ou_calcular(chave, calcular, timeout, modelos=()):
+    """
+    Valor em cache para a chave, calculado por 'calcular()' quando ausente ou velho.
+
+    Apenas um worker por vez recalcula a mesma chave; enquanto isso os outros
+    recebem o valor anterior. Sem valor anterior, quem não pegou a trava calcula
+    por conta própria em vez de esperar.
+
+    'modelos' são nomes de modelos versionados (cache_versoes) de que o valor
+    depende: o valor guardado com outras versões conta como ausente. As versões
+    são lidas junto com o valor, na mesma ida ao cache.
+    """
+    registro, versoes = ler_com_versoes(chave, modelos)
+    if registro is not None and registro[3] != versoes:
+        registro = None
+    if registro is not None:
+        valor, expira_em, duracao, _ = registro
+        if not _deve_antecipar(duracao, expira_em, time.time()):
+            return valor
+
+    chave_trava = f'{chave}:recalculando'
+    if not cache.add(chave_trava, 1, TEMPO_TRAVA):
+        if registro is not None:
+            return registro[0]
+        return calcular()
+
+    try:
+        return _calcular_e_guardar(chave, calcular, timeout, versoes)
+    finally:
+        cache.delete(chave_trava)
@@ -0,0 +1,62 @@
+"""
+Contadores de versão por modelo para invalidar fragmentos de template em cache.
+
+Cada save/delete de um modelo monitorado troca a versão dele; as chaves dos
+fragmentos incluem as versões dos modelos de que dependem, então uma escrita
+torna obsoletos exatamente os fragmentos afetados, sem depender de TTL.
+
+As versões ficam no mesmo cache dos fragmentos e podem ser descartadas por ele
+(culling dos backends locais, ver CACHES em settings, ou eviction do Redis).
+Por isso uma versão nunca é reaproveitada: toda versão nova, inclusive a que
+substitui um contador descartado, vem de time.time_ns(), e os fragmentos de
+gerações anteriores nunca voltam a ser válidos. Trocar a versão com set, em
+vez de incr, também evita que duas trocas concorrentes (incr não é atômico no
+FileBasedCache) resultem no mesmo valor.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+
+_trava_versao = threading.Lock()
+_ultima_versao = 0
+
+
+def _chave(nome_modelo):
+    return f'versao_modelo:{nome_modelo}'
+
+
+def _nova_versao():
+    """Valor ainda não usado como versão (crescente dentro do processo)"""
+    global _ultima_versao
+    with _trava_versao:
+        _ultima_versao = max(time.time_ns(), _ultima_versao + 1)
+        return _ultima_versao
+
+
+def ler_com_versoes(chave, nomes_modelos):
+    """
+    Valor guardado na chave (None se ausente) e versões atuais dos modelos,
+    em uma única leitura do cache. Com chave None lê só as versões.
+    """
+    chaves = [_chave(nome) for nome in nomes_modelos]
+    encontradas = cache.get_many(chaves if chave is None else [chave, *chaves])
+    for chave_versao in chaves:
+        if chave_versao in encontradas:
+            continue
+        # add não sobrescreve a versão gravada por uma escrita concorrente
+        versao = _nova_versao()
+        if not cache.add(chave_versao, versao, None):
+            versao = cache.get(chave_versao, versao)
+        encontradas[chave_versao] = versao
+    return encontradas.get(chave), [encontradas[chave_versao] for chave_versao in chaves]
+
+
+def versoes_modelos(*nomes_modelos):
+    """Versões atuais dos modelos, em uma única leitura do cache"""
+    return ler_com_versoes(None, nomes_modelos)[1]
+
+
+def incrementar_versao(nome_modelo):
+    """Torna obsoletos os fragmentos que dependem do modelo"""
+    cache.set(_chave(nome_modelo), _nova_versao(), None)
@@ -0,0 +1,397 @@
+"""
+Alterações de quantidade nos itens do carrinho.
+
+Cada clique vira um UPDATE condicional (quantidade = quantidade + 1 somente se
+ainda houver estoque livre), e o número de linhas afetadas diz se a alteração
+foi aceita. Não há leitura seguida de escrita, então cliques rápidos ou em
+abas diferentes nunca perdem incrementos nem ultrapassam o estoque.
+
+Carrinho.total_itens e Carrinho.subtotal acompanham cada alteração na mesma
+transação, somando a diferença com F() (_ajustar_totais). Escritas em lote
+(mesclagem, compra rápida) recalculam com Carrinho.atualizar_totais, e o
+checkout revalida os totais contra os preços atuais (com_totais_atuais).
+
+A API JSON do carrinho (views carrinho_api_*) usa as mesmas funções e devolve
+só a linha alterada e os totais (resumo_carrinho), sem renderizar a página.
+
+Durante a navegação o carrinho fica na sessão (CarrinhoSessao), inclusive para
+visitantes sem login: adicionar, alterar a quantidade e remover produtos não
+grava Carrinho nem ItemCarrinho. As views carrinho_api_produto* usam a mesma
+interface nos dois carrinhos, identificando a linha pelo produto.
+O carrinho só vai para o banco no checkout (persistir_carrinho) ou no login,
+quando o usuário já tem um carrinho salvo (mesclar_carrinho_sessao). Depois
+disso a sessão guarda apenas o id do carrinho persistido e obter_carrinho passa
+a usar o banco (CarrinhoBanco).
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.lookups import GreaterThanOrEqual
+from django.utils import timezone
+
+from .models import Carrinho, ItemCarrinho, Produto, ReservaEstoque
+
+# Chaves na sessão: linhas do carrinho em navegação e id do carrinho já persistido
+CHAVE_SESSAO = 'carrinho'
+CHAVE_PERSISTIDO = 'carrinho_id'
+
+
+def _disponivel_para_item():
+    """Expressão: estoque do produto menos as reservas ativas de outros carrinhos"""
+    reservas = ReservaEstoque.objects.filter(
+        produto=OuterRef('produto'), expira_em__gt=timezone.now()
+    ).exclude(carrinho=OuterRef('carrinho')).values('produto').annotate(total=Sum('quantidade')).values('total')
+    return F('produto__total_estoque') - Coalesce(Subquery(reservas), Value(0))
+
+
+def _ajustar_totais(carrinhos, unidades, preco):
+    """Soma 'unidades' (negativo retira) de um produto de 'preco' aos totais dos carrinhos"""
+    # Itens gravados por fora destas funções podem deixar os totais abaixo do real;
+    # o piso em zero evita violar a restrição e o checkout corrige a diferença
+    Carrinho.objects.filter(id__in=carrinhos).update(
+        total_itens=Greatest(F('total_itens') + unidades, Value(0)),
+        subtotal=Greatest(F('subtotal') + Value(unidades) * preco, Value(Decimal('0'))),
+    )
+
+
+def _travar_item(itens):
+    return itens.select_for_update(of=('self',)).select_related('produto').first()
+
+
+def incrementar_item(itens, quantidade=1):
+    """
+    Soma 'quantidade' ao item filtrado por 'itens' se o estoque livre permitir.
+
+    Retorna True se a linha foi alterada.
+    """
+    with transaction.atomic(savepoint=False):
+        if not itens.filter(
+            quantidade__lte=_disponivel_para_item() - quantidade
+        ).update(quantidade=F('quantidade') + quantidade):
+            return False
+        _ajustar_totais(itens.values('carrinho'), quantidade, Subquery(itens.values('produto__preco')[:1]))
+    return True
+
+
+def definir_quantidade(itens, quantidade):
+    """
+    Fixa a quantidade do item; 0 remove a linha.
+
+    Reduções são sempre aceitas, aumentos só se o estoque livre comportar a nova
+    quantidade. Retorna True se o item foi alterado (ou removido).
+    """
+    with transaction.atomic(savepoint=False):
+        item = _travar_item(itens)
+        if item is None:
+            return False
+        linha = ItemCarrinho.objects.filter(id=item.id)
+        if quantidade <= 0:
+            quantidade = 0
+            linha.delete()
+        elif not linha.filter(
+            Q(quantidade__gte=quantidade) | GreaterThanOrEqual(_disponivel_para_item(), quantidade)
+        ).update(quantidade=quantidade):
+            return False
+        _ajustar_totais([item.carrinho_id], quantidade - item.quantidade, item.produto.preco)
+    return True
+
+
+def decrementar_item(itens, quantidade=1):
+    """
+    Subtrai 'quantidade' do item; se não sobrar nada, remove a linha.
+
+    Retorna 'reduzido', 'removido' ou None se o item não existir.
+    """
+    with transaction.atomic(savepoint=False):
+        # A linha travada garante que os totais descontem exatamente o que saiu
+        item = _travar_item(itens)
+        if item is None:
+            return None
+        linha = ItemCarrinho.objects.filter(id=item.id)
+        if item.quantidade > quantidade:
+            linha.update(quantidade=F('quantidade') - quantidade)
+            retirado, resultado = quantidade, 'reduzido'
+        else:
+            linha.delete()
+            retirado, resultado = item.quantidade, 'removido'
+        _ajustar_totais([item.carrinho_id], -retirado, item.produto.preco)
+    return resultado
+
+
+def adicionar_produto(carrinho, produto_id):
+    """
+    Adiciona uma unidade do produto ao carrinho, respeitando o estoque livre.
+
+    Para um item que já está no carrinho custa um UPDATE no item e outro nos
+    totais do carrinho. Retorna True se a unidade foi adicionada.
+    """
+    itens = ItemCarrinho.objects.filter(carrinho=carrinho, produto_id=produto_id)
+    if incrementar_item(itens):
+        return True
+    if itens.exists():
+        return False
+
+    produto = Produto.objects.only('total_estoque', 'preco').get(id=produto_id)
+    if produto.estoque_disponivel(carrinho=carrinho) < 1:
+        return False
+    try:
+        with transaction.atomic():
+            ItemCarrinho.objects.create(carrinho=carrinho, produto_id=produto_id, quantidade=1)
+            _ajustar_totais([carrinho.id], 1, produto.preco)
+    except IntegrityError:
+        # Outro clique criou o item ao mesmo tempo: soma a essa linha
+        return incrementar_item(itens)
+    return True
+
+
+def carregar_itens(itens):
+    """Itens com produto e estoque livre ('disponivel') em uma única consulta"""
+    return itens.select_related('produto').annotate(disponivel=_disponivel_para_item()).order_by('id')
+
+
+def item_para_dict(item):
+    """Representação JSON de um item carregado por carregar_itens"""
+    return {
+        'id': item.id,
+        'produto_id': item.produto_id,
+        'nome': item.produto.nome,
+        'preco': str(item.produto.preco),
+        'quantidade': item.quantidade,
+        'subtotal': str(item.calcular_subtotal()),
+        'disponivel': max(item.disponivel, 0),
+    }
+
+
+def resumo_carrinho(carrinho):
+    """Quantidade de unidades e valor do carrinho, lidos dos totais mantidos"""
+    totais = Carrinho.objects.filter(id=carrinho.id).values('total_itens', 'subtotal').first() if carrinho else None
+    if totais is None:
+        return {'total_itens': 0, 'subtotal': '0.00'}
+    return {'total_itens': totais['total_itens'], 'subtotal': str(totais['subtotal'].quantize(Decimal('0.01')))}
+
+
+class CarrinhoSessao:
+    """Carrinho da fase de navegação, guardado na sessão como {produto_id: quantidade}"""
+
+    def __init__(self, session):
+        self.session = session
+        self.linhas = {int(produto_id): qtd for produto_id, qtd in session.get(CHAVE_SESSAO, {}).items()}
+
+    def _salvar(self):
+        if self.linhas:
+            self.session[CHAVE_SESSAO] = {str(produto_id): qtd for produto_id, qtd in self.linhas.items()}
+        else:
+            self.session.pop(CHAVE_SESSAO, None)
+
+    def adicionar(self, produto):
+        """Soma uma unidade se o estoque livre permitir. Retorna True se adicionou."""
+        quantidade = self.linhas.get(produto.id, 0) + 1
+        if quantidade > produto.estoque_disponivel():
+            return False
+        self.linhas[produto.id] = quantidade
+        self._salvar()
+        return True
+
+    def definir_quantidade(self, produto, quantidade):
+        """
+        Fixa a quantidade do produto; 0 remove a linha.
+
+        Reduções são sempre aceitas, aumentos só se o estoque livre comportar a
+        nova quantidade. Retorna True se a linha foi alterada (ou removida).
+        """
+        atual = self.linhas.get(produto.id)
+        if atual is None:
+            return False
+        if quantidade <= 0:
+            del self.linhas[produto.id]
+        elif quantidade > atual and quantidade > produto.estoque_disponivel():
+            return False
+        else:
+            self.linhas[produto.id] = quantidade
+        self._salvar()
+        return True
+
+    def remover(self, produto, quantidade=None):
+        """
+        Retira 'quantidade' unidades do produto, ou a linha inteira se None.
+
+        Retorna 'reduzido', 'removido' ou None se o produto não está no carrinho.
+        """
+        atual = self.linhas.get(produto.id)
+        if atual is None:
+            return None
+        if quantidade is None or quantidade >= atual:
+            del self.linhas[produto.id]
+            resultado = 'removido'
+        else:
+            self.linhas[produto.id] = atual - quantidade
+            resultado = 'reduzido'
+        self._salvar()
+        return resultado
+
+    def limpar(self):
+        self.linhas = {}
+        self._salvar()
+
+    def total_itens(self):
+        return sum(self.linhas.values())
+
+    def _item_para_dict(self, produto, disponivel):
+        quantidade = self.linhas[produto.id]
+        return {
+            'id': None,
+            'produto_id': produto.id,
+            'nome': produto.nome,
+            'preco': str(produto.preco),
+            'quantidade': quantidade,
+            'subtotal': str(produto.preco * quantidade),
+            'disponivel': disponivel,
+        }
+
+    def item(self, produto):
+        if produto.id not in self.linhas:
+            return None
+        return self._item_para_dict(produto, produto.estoque_disponivel())
+
+    def itens(self):
+        produtos = Produto.objects.only('nome', 'preco', 'total_estoque').in_bulk(list(self.linhas))
+        reservados = ReservaEstoque.reservado_por_produto(list(produtos))
+        return [
+            self._item_para_dict(produto, max(produto.total_estoque - reservados.get(produto.id, 0), 0))
+            for produto in produtos.values()
+        ]
+
+    def resumo(self):
+        precos = dict(Produto.objects.filter(id__in=self.linhas).values_list('id', 'preco')) if self.linhas else {}
+        subtotal = sum((precos[produto_id] * qtd for produto_id, qtd in self.linhas.items() if produto_id in precos),
+                       Decimal('0'))
+        return {'total_itens': self.total_itens(), 'subtotal': str(subtotal.quantize(Decimal('0.01')))}
+
+
+class CarrinhoBanco:
+    """Carrinho já persistido (Carrinho/ItemCarrinho), com a mesma interface de CarrinhoSessao"""
+
+    def __init__(self, carrinho):
+        self.carrinho = carrinho
+
+    def _itens(self, produto):
+        return ItemCarrinho.objects.filter(carrinho=self.carrinho, produto=produto)
+
+    def adicionar(self, produto):
+        return adicionar_produto(self.carrinho, produto.id)
+
+    def definir_quantidade(self, produto, quantidade):
+        return definir_quantidade(self._itens(produto), quantidade)
+
+    def remover(self, produto, quantidade=None):
+        if quantidade is None:
+            return 'removido' if definir_quantidade(self._itens(produto), 0) else None
+        return decrementar_item(self._itens(produto), quantidade)
+
+    def total_itens(self):
+        return self.carrinho.total_itens
+
+    def item(self, produto):
+        item = carregar_itens(self._itens(produto)).first()
+        return item_para_dict(item) if item else None
+
+    def itens(self):
+        return [item_para_dict(item) for item in carregar_itens(self.carrinho.itens.all())]
+
+    def resumo(self):
+        return resumo_carrinho(self.carrinho)
+
+
+def obter_carrinho(request):
+    """Carrinho da requisição: o do banco se já foi persistido, senão o da sessão"""
+    carrinho_id = request.session.get(CHAVE_PERSISTIDO)
+    if carrinho_id and request.user.is_authenticated:
+        carrinho = Carrinho.objects.filter(id=carrinho_id, usuario=request.user, ativo=True).first()
+        if carrinho is not None:
+            return CarrinhoBanco(carrinho)
+        # Finalizado ou substituído em outra sessão
+        del request.session[CHAVE_PERSISTIDO]
+    return CarrinhoSessao(request.session)
+
+
+def mesclar_linhas(carrinho, linhas):
+    """
+    Soma {produto_id: quantidade} aos itens do carrinho no banco.
+
+    Cada produto fica limitado ao estoque livre para o carrinho; produtos sem
+    estoque são descartados. Retorna os ids dos produtos cuja quantidade foi
+    reduzida.
+    """
+    with transaction.atomic():
+        Carrinho.objects.select_for_update().filter(id=carrinho.id).first()
+        existentes = {item.produto_id: item for item in ItemCarrinho.objects.filter(carrinho=carrinho, produto_id__in=linhas)}
+        produtos = Produto.objects.only('total_estoque').in_bulk(list(linhas))
+        reservados = ReservaEstoque.reservado_por_produto(list(linhas), excluir_carrinho=carrinho)
+
+        ajustados = []
+        alterados = []
+        novos = []
+        for produto_id, quantidade in linhas.items():
+            produto = produtos.get(produto_id)
+            if produto is None:
+                continue
+            livre = max(produto.total_estoque - reservados.get(produto_id, 0), 0)
+            item = existentes.get(produto_id)
+            desejado = quantidade + (item.quantidade if item else 0)
+            final = min(desejado, livre)
+            if final < desejado:
+                ajustados.append(produto_id)
+            if item is not None:
+                if final != item.quantidade:
+                    item.quantidade = final
+                    alterados.append(item)
+            elif final > 0:
+                novos.append(ItemCarrinho(carrinho=carrinho, produto_id=produto_id, quantidade=final))
+
+        ItemCarrinho.objects.bulk_update([item for item in alterados if item.quantidade > 0], ['quantidade'])
+        ItemCarrinho.objects.filter(id__in=[item.id for item in alterados if item.quantidade == 0]).delete()
+        ItemCarrinho.objects.bulk_create(novos)
+        # A trava no carrinho garante que o recálculo veja todos os itens confirmados
+        Carrinho.atualizar_totais([carrinho.id])
+    return ajustados
+
+
+def persistir_carrinho(request):
+    """
+    Leva o carrinho da sessão para o banco no início do checkout.
+
+    As linhas da sessão são somadas ao carrinho ativo do usuário (criado se
+    preciso) e removidas da sessão. Retorna (carrinho ou None, ids dos produtos
+    ajustados ao estoque).
+    """
+    sessao = CarrinhoSessao(request.session)
+    carrinho = Carrinho.objects.filter(usuario=request.user, ativo=True).first()
+    ajustados = []
+    if sessao.linhas:
+        if carrinho is None:
+            # get_or_create: outra requisição pode ter criado o carrinho ativo agora
+            carrinho, _ = Carrinho.objects.get_or_create(usuario=request.user, ativo=True)
+        ajustados = mesclar_linhas(carrinho, sessao.linhas)
+        sessao.limpar()
+    if carrinho is not None:
+        request.session[CHAVE_PERSISTIDO] = carrinho.id
+    return carrinho, ajustados
+
+
+def mesclar_carrinho_sessao(request, usuario):
+    """
+    No login, junta o carrinho montado antes da autenticação ao carrinho salvo.
+
+    Sem carrinho salvo nada é gravado: as linhas continuam na sessão (que o
+    login preserva) até o checkout.
+    """
+    carrinho = Carrinho.objects.filter(usuario=usuario, ativo=True).first()
+    if carrinho is None:
+        return
+    sessao = CarrinhoSessao(request.session)
+    if sessao.linhas:
+        mesclar_linhas(carrinho, sessao.linhas)
+        sessao.limpar()
+    request.session[CHAVE_PERSISTIDO] = carrinho.id
@@ -0,0 +1,173 @@
+"""
+Baixa de estoque na finalização de pedidos.
+
+As linhas de Estoque dos produtos do pedido são travadas com select_for_update
+sempre na mesma ordem (por id), o que evita deadlock entre checkouts simultâneos.
+A disponibilidade é conferida sobre as linhas travadas e o débito é feito num
+único UPDATE com F(), então dois pedidos nunca vendem a mesma unidade. De quais
+armazéns sai cada unidade é decidido pela estratégia de alocação (alocacao.py).
+
+Na revisão do pedido o carrinho reserva suas unidades por alguns minutos
+(ReservaEstoque). As reservas ativas de outros carrinhos são descontadas da
+disponibilidade, e as do próprio carrinho são consumidas ao finalizar. Reservas
+vencidas são ignoradas nas leituras e apagadas pelo comando expirar_reservas.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .alocacao import planejar_alocacao
+from .cache_versoes import incrementar_versao
+from .models import Estoque, Produto, ReservaEstoque
+
+
+class EstoqueInsuficiente(Exception):
+    """Um ou mais produtos do pedido não têm estoque suficiente"""
+
+    def __init__(self, faltas):
+        # faltas: lista de (produto, disponivel, solicitado)
+        self.faltas = faltas
+        super().__init__('; '.join(self.mensagens()))
+
+    def mensagens(self):
+        return [
+            f"{produto.nome}: estoque insuficiente (disponível: {disponivel}, solicitado: {solicitado})"
+            for produto, disponivel, solicitado in self.faltas
+        ]
+
+
+def _levantar_faltas(faltas):
+    if faltas:
+        produtos = Produto.objects.in_bulk([produto_id for produto_id, _, _ in faltas])
+        raise EstoqueInsuficiente([
+            (produtos[produto_id], disponivel, solicitado) for produto_id, disponivel, solicitado in faltas
+        ])
+
+
+def _travar_produtos(produto_ids):
+    """Trava os produtos em ordem de id; reservas e baixas do mesmo produto ficam serializadas"""
+    return list(Produto.objects.select_for_update().filter(id__in=produto_ids).order_by('id'))
+
+
+def _travar_e_planejar(quantidades, estrategia, cep_destino, excluir_armazem=None, somente_armazem=None,
+                       descontar_reservas_de=None):
+    # descontar_reservas_de: carrinho cujas reservas não contam (None desconta todas, False nenhuma)
+    _travar_produtos(quantidades)
+    reservados = None
+    if descontar_reservas_de is not False:
+        reservados = ReservaEstoque.reservado_por_produto(quantidades, excluir_carrinho=descontar_reservas_de)
+    plano = planejar_alocacao(
+        quantidades, estrategia, cep_destino=cep_destino, travar=True, excluir_armazem=excluir_armazem,
+        somente_armazem=somente_armazem, reservados=reservados,
+    )
+    _levantar_faltas(plano.faltas)
+    return plano
+
+
+def _debitar(debitos):
+    Estoque.objects.filter(id__in=debitos).update(
+        quantidade=F('quantidade') - Case(
+            *[When(id=estoque_id, then=Value(unidades)) for estoque_id, unidades in debitos.items()],
+            output_field=IntegerField(),
+        )
+    )
+
+
+def baixar_estoque(quantidades, estrategia=None, cep_destino=None, carrinho=None):
+    """
+    Debita {produto_id: quantidade} dos armazéns, de forma atômica.
+
+    Levanta EstoqueInsuficiente (sem alterar nada) se algum produto não tiver
+    unidades suficientes somando todos os armazéns, descontadas as reservas de
+    outros carrinhos. As reservas de 'carrinho' são consumidas. Retorna o
+    PlanoAlocacao usado.
+    """
+    quantidades = {produto_id: qtd for produto_id, qtd in quantidades.items() if qtd > 0}
+    if not quantidades:
+        return None
+
+    with transaction.atomic():
+        plano = _travar_e_planejar(quantidades, estrategia, cep_destino, descontar_reservas_de=carrinho)
+        _debitar(plano.debitos)
+        if carrinho is not None:
+            ReservaEstoque.objects.filter(carrinho=carrinho).delete()
+
+        # update() não dispara os sinais de Estoque
+        Produto.atualizar_estoque_total(list(quantidades))
+        transaction.on_commit(lambda: incrementar_versao('Estoque'))
+    return plano
+
+
+def transferir_estoque(produto_id, armazem_destino, quantidade, estrategia='mais_proximo', origem=None):
+    """
+    Move unidades de um produto dos outros armazéns para 'armazem_destino'.
+
+    As origens são escolhidas pela estratégia de alocação (por padrão as mais
+    próximas do CEP do destino); com 'origem' (um Armazem) as unidades saem só
+    dele. Levanta ValueError se a quantidade não for positiva e
+    EstoqueInsuficiente se as origens não tiverem unidades suficientes.
+    Retorna o PlanoAlocacao usado.
+    """
+    if quantidade <= 0:
+        raise ValueError("A quantidade transferida deve ser maior que zero.")
+    if origem is not None and origem.id == armazem_destino.id:
+        raise ValueError("O armazém de origem deve ser diferente do destino.")
+
+    with transaction.atomic():
+        plano = _travar_e_planejar(
+            {produto_id: quantidade}, estrategia, armazem_destino.cep, excluir_armazem=armazem_destino.id,
+            somente_armazem=origem.id if origem is not None else None,
+            # Reservas são por produto, não por armazém: mover unidades não as afeta
+            descontar_reservas_de=False,
+        )
+        _debitar(plano.debitos)
+
+        destino, criado = Estoque.objects.select_for_update().get_or_create(
+            produto_id=produto_id, armazem=armazem_destino, defaults={'quantidade': quantidade}
+        )
+        if not criado:
+            Estoque.objects.filter(id=destino.id).update(
+                quantidade=F('quantidade') + quantidade, reabastecido_em=timezone.now()
+            )
+
+        # O total do produto não muda, mas os fragmentos por armazém sim
+        transaction.on_commit(lambda: incrementar_versao('Estoque'))
+    return plano
+
+
+def reservar_carrinho(carrinho, quantidades):
+    """
+    Reserva {produto_id: quantidade} para o carrinho até expirar.
+
+    Substitui as reservas anteriores do carrinho. Levanta EstoqueInsuficiente
+    (sem reservar nada) se as unidades livres não bastarem. Retorna o horário
+    em que as reservas expiram.
+    """
+    quantidades = {produto_id: qtd for produto_id, qtd in quantidades.items() if qtd > 0}
+    expira_em = timezone.now() + timedelta(minutes=settings.RESERVA_ESTOQUE_MINUTOS)
+
+    with transaction.atomic():
+        produtos = _travar_produtos(quantidades)
+        reservados = ReservaEstoque.reservado_por_produto(quantidades, excluir_carrinho=carrinho)
+        faltas = []
+        for produto in produtos:
+            livre = max(produto.total_estoque - reservados.get(produto.id, 0), 0)
+            if livre < quantidades[produto.id]:
+                faltas.append((produto.id, livre, quantidades[produto.id]))
+        _levantar_faltas(faltas)
+
+        ReservaEstoque.objects.filter(carrinho=carrinho).delete()
+        ReservaEstoque.objects.bulk_create([
+            ReservaEstoque(carrinho=carrinho, produto_id=produto_id, quantidade=quantidade, expira_em=expira_em)
+            for produto_id, quantidade in quantidades.items()
+        ])
+    return expira_em
+
+
+def expirar_reservas():
+    """Apaga as reservas vencidas e retorna quantas foram removidas"""
+    removidas, _ = ReservaEstoque.objects.filter(expira_em__lte=timezone.now()).delete()
+    return removidas
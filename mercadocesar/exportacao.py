@@ -0,0 +1,105 @@
+"""
+Exportação em CSV de pedidos, estoque e catálogo.
+
+As páginas de listagem aceitam ?formato=csv e exportam o mesmo queryset que
+exibiriam, com os mesmos filtros. As linhas são lidas com
+values_list(...).iterator(chunk_size=...) e escritas uma a uma num
+StreamingHttpResponse, então a memória usada não cresce com o número de linhas.
+"""
+import csv
+from datetime import datetime
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+TAMANHO_LOTE = 2000
+
+# (cabeçalho, campo) de cada coluna
+COLUNAS_PEDIDOS = [
+    ('pedido', 'id'),
+    ('data', 'data_criacao'),
+    ('usuario', 'usuario__username'),
+    ('tipo_entrega', 'tipo_entrega'),
+    ('loja', 'loja__nome'),
+    ('cidade', 'cidade'),
+    ('estado', 'estado'),
+    ('custo_entrega', 'custo_entrega'),
+    ('subtotal_produtos', 'subtotal_produtos'),
+    ('produto_codigo', 'itens__produto__codigo'),
+    ('produto', 'itens__produto__nome'),
+    ('quantidade', 'itens__quantidade'),
+    ('preco_unitario', 'itens__preco_unitario'),
+]
+
+COLUNAS_ESTOQUE = [
+    ('codigo', 'produto__codigo'),
+    ('produto', 'produto__nome'),
+    ('armazem', 'armazem__nome'),
+    ('quantidade', 'quantidade'),
+    ('minimo', 'minimo'),
+    ('reabastecido_em', 'reabastecido_em'),
+]
+
+COLUNAS_PRODUTOS = [
+    ('codigo', 'codigo'),
+    ('nome', 'nome'),
+    ('descricao', 'descricao'),
+    ('categoria', 'categoria'),
+    ('preco_custo', 'preco_custo'),
+    ('preco', 'preco'),
+    ('unidade_medida', 'unidade_medida'),
+    ('estoque_total', 'total_estoque'),
+]
+
+
+class Eco:
+    """Pseudo-arquivo para csv.writer: write devolve a linha em vez de gravá-la"""
+
+    def write(self, valor):
+        return valor
+
+
+def formatar_valor(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, datetime):
+        return timezone.localtime(valor).strftime('%Y-%m-%d %H:%M:%S')
+    return valor
+
+
+def resposta_csv(nome_arquivo, cabecalho, linhas):
+    """StreamingHttpResponse que escreve o cabeçalho e cada linha (sequência de valores) em CSV"""
+    escritor = csv.writer(Eco())
+
+    def gerar():
+        yield escritor.writerow(cabecalho)
+        for linha in linhas:
+            yield escritor.writerow([formatar_valor(valor) for valor in linha])
+
+    resposta = StreamingHttpResponse(gerar(), content_type='text/csv; charset=utf-8')
+    resposta['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
+    return resposta
+
+
+def exportar(queryset, colunas, nome_arquivo):
+    """Exporta as colunas do queryset na ordem em que ele já está"""
+    linhas = queryset.select_related(None).prefetch_related(None).values_list(
+        *[campo for _, campo in colunas]
+    )
+    return resposta_csv(
+        nome_arquivo, [cabecalho for cabecalho, _ in colunas], linhas.iterator(chunk_size=TAMANHO_LOTE)
+    )
+
+
+def exportar_pedidos(pedidos):
+    """Uma linha por item, com os dados do pedido repetidos; pedidos sem itens saem em uma linha"""
+    return exportar(pedidos.order_by('-data_criacao', '-id', 'itens__id'), COLUNAS_PEDIDOS, 'pedidos.csv')
+
+
+def exportar_estoque(estoques):
+    """Estoque por armazém; 'estoques' precisa da anotação 'minimo' (EstoqueMinimo.para)"""
+    return exportar(estoques, COLUNAS_ESTOQUE, 'estoque.csv')
+
+
+def exportar_produtos(produtos):
+    return exportar(produtos, COLUNAS_PRODUTOS, 'produtos.csv')
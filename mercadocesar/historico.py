@@ -0,0 +1,131 @@
+"""
+Paginação por chave do histórico de pedidos.
+
+Os pedidos são listados do mais recente para o mais antigo pela chave
+(data_criacao, id). Cada página busca apenas 'limite' + 1 pedidos a partir do
+cursor, então o custo de uma página não cresce com o volume de pedidos. Os
+cursores são opacos e vão na URL: 'depois' avança para pedidos mais antigos e
+'antes' volta para os mais recentes.
+"""
+import base64
+import json
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+TAMANHO_PAGINA_PEDIDOS = 20
+LIMITE_MAXIMO_PEDIDOS = 100
+
+# A contagem exibida para no limite ("mais de 1000") para não percorrer a tabela toda
+LIMITE_CONTAGEM_PEDIDOS = 1000
+
+
+class PaginaPedidos:
+    """Pedidos de uma página e os cursores das páginas vizinhas (None quando não existem)"""
+
+    def __init__(self, pedidos, proximo, anterior):
+        self.pedidos = pedidos
+        self.proximo = proximo
+        self.anterior = anterior
+
+    def __iter__(self):
+        return iter(self.pedidos)
+
+    def __len__(self):
+        return len(self.pedidos)
+
+
+def codificar_cursor(pedido):
+    bruto = json.dumps([pedido.data_criacao.isoformat(), pedido.id]).encode()
+    return base64.urlsafe_b64encode(bruto).decode()
+
+
+def decodificar_cursor(cursor):
+    """Retorna (data_criacao, id) do cursor, ou None se o cursor for inválido"""
+    try:
+        data, pedido_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(data), int(pedido_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def pagina_pedidos(pedidos, depois=None, antes=None, limite=TAMANHO_PAGINA_PEDIDOS):
+    """
+    Uma página de 'pedidos' (queryset já filtrado) na ordem -data_criacao, -id.
+
+    Sem cursor retorna a primeira página. Prefetches do queryset só rodam para
+    os pedidos da página.
+    """
+    limite = max(1, min(limite, LIMITE_MAXIMO_PEDIDOS))
+    posicao_depois = decodificar_cursor(depois) if depois else None
+    posicao_antes = decodificar_cursor(antes) if antes and not posicao_depois else None
+
+    if posicao_antes:
+        # Volta uma página: percorre em ordem crescente a partir do cursor e inverte
+        data, pedido_id = posicao_antes
+        pagina = list(
+            pedidos.filter(Q(data_criacao__gt=data) | Q(data_criacao=data, id__gt=pedido_id))
+            .order_by('data_criacao', 'id')[:limite + 1]
+        )
+        mais_recentes = len(pagina) > limite
+        pagina = pagina[:limite][::-1]
+        return PaginaPedidos(
+            pagina,
+            proximo=codificar_cursor(pagina[-1]) if pagina else None,
+            anterior=codificar_cursor(pagina[0]) if mais_recentes else None,
+        )
+
+    if posicao_depois:
+        data, pedido_id = posicao_depois
+        pedidos = pedidos.filter(Q(data_criacao__lt=data) | Q(data_criacao=data, id__lt=pedido_id))
+
+    # Busca um pedido a mais para saber se existe próxima página
+    pagina = list(pedidos.order_by('-data_criacao', '-id')[:limite + 1])
+    proximo = codificar_cursor(pagina[limite - 1]) if len(pagina) > limite else None
+    pagina = pagina[:limite]
+    anterior = codificar_cursor(pagina[0]) if posicao_depois and pagina else None
+    return PaginaPedidos(pagina, proximo, anterior)
+
+
+def contar_pedidos(pedidos, limite=LIMITE_CONTAGEM_PEDIDOS):
+    """
+    Conta os pedidos até 'limite'.
+
+    Retorna (total, aproximado); aproximado é True quando há mais pedidos que o
+    limite e o total exibido é só um piso.
+    """
+    total = pedidos.order_by()[:limite + 1].count()
+    return min(total, limite), total > limite
+
+
+def inicio_do_dia(data):
+    """Meia-noite de 'data' no fuso configurado, como datetime com fuso"""
+    return timezone.make_aware(datetime.combine(data, time.min), timezone.get_current_timezone())
+
+
+def ler_data(valor):
+    """Data de um parâmetro AAAA-MM-DD, ou None se vazio ou inválido"""
+    try:
+        return parse_date(valor) if valor else None
+    except ValueError:
+        return None
+
+
+def filtrar_periodo(pedidos, data_inicio=None, data_fim=None, campo='data_criacao'):
+    """
+    Filtra 'pedidos' pelos dias de data_inicio a data_fim (inclusive), no
+    formato AAAA-MM-DD; datas vazias ou inválidas são ignoradas.
+
+    Usa o intervalo semiaberto [início de data_inicio, início do dia seguinte a
+    data_fim) sobre a própria coluna, sem converter para DATE, para que o
+    índice em 'campo' seja usado.
+    """
+    inicio = ler_data(data_inicio)
+    fim = ler_data(data_fim)
+    if inicio:
+        pedidos = pedidos.filter(**{f'{campo}__gte': inicio_do_dia(inicio)})
+    if fim:
+        pedidos = pedidos.filter(**{f'{campo}__lt': inicio_do_dia(fim + timedelta(days=1))})
+    return pedidos
@@ -0,0 +1,271 @@
+"""
+Índice de busca textual de produtos.
+
+Em produção (PostgreSQL) o índice é uma tabela com uma coluna tsvector indexada
+por GIN, usando a configuração 'portuguese'. Em desenvolvimento (SQLite) é uma
+tabela virtual FTS5 alimentada com radicais calculados em Python. Nos dois casos
+o texto é normalizado sem acentos, então "cafe" encontra "Café".
+
+A relevância sai da própria consulta ao índice (menor é mais relevante) e a
+paginação por chave (relevancia, id) é feita nessa consulta, então a busca
+não tem limite de resultados e cada página lê só os seus itens.
+"""
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+TABELA_INDICE = 'mercadocesar_produto_busca'
+
+_PALAVRA = re.compile(r'\w+')
+
+# Sufixos de plural e de gênero, do mais longo para o mais curto
+_SUFIXOS_PLURAL = [('oes', 'ao'), ('aes', 'ao'), ('ais', 'al'), ('eis', 'el'), ('res', 'r'), ('ns', 'm'), ('s', '')]
+_SUFIXOS_GENERO = [('ona', 'ao'), ('ora', 'or')]
+
+
+def normalizar(texto):
+    """Remove acentos e converte para minúsculas"""
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).lower()
+
+
+def radical(palavra):
+    """Radical aproximado de uma palavra em português já normalizada"""
+    for sufixo, troca in _SUFIXOS_PLURAL:
+        if palavra.endswith(sufixo) and len(palavra) - len(sufixo) >= 3:
+            palavra = palavra[:-len(sufixo)] + troca
+            break
+    for sufixo, troca in _SUFIXOS_GENERO:
+        if palavra.endswith(sufixo) and len(palavra) - len(sufixo) >= 3:
+            palavra = palavra[:-len(sufixo)] + troca
+            break
+    if palavra[-1:] in ('a', 'e', 'o') and len(palavra) > 3:
+        palavra = palavra[:-1]
+    return palavra
+
+
+def termos(texto):
+    """Lista de radicais do texto, na ordem em que aparecem"""
+    return [radical(palavra) for palavra in _PALAVRA.findall(normalizar(texto))]
+
+
+class IndiceBusca(ABC):
+    """Interface comum dos índices de busca"""
+
+    @abstractmethod
+    def criar(self):
+        """Cria a tabela do índice, se ainda não existir"""
+
+    @abstractmethod
+    def remover_tabela(self):
+        """Remove a tabela do índice"""
+
+    @abstractmethod
+    def atualizar(self, produto):
+        """Grava ou substitui o produto no índice"""
+
+    @abstractmethod
+    def remover(self, produto_id):
+        """Remove o produto do índice"""
+
+    @abstractmethod
+    def consulta(self, termo):
+        """
+        (sql, parametros) de um SELECT com as colunas produto_id e relevancia
+        de todos os produtos encontrados, ou None se o termo não tiver palavras.
+        """
+
+    def reconstruir(self, produtos):
+        for produto in produtos:
+            self.atualizar(produto)
+
+    def filtro_ids(self, termo):
+        """Subconsulta com os ids de todos os produtos encontrados, para id__in"""
+        consulta = self.consulta(termo)
+        if consulta is None:
+            return None
+        sql, parametros = consulta
+        return RawSQL(f"SELECT produto_id FROM ({sql}) resultados", parametros)
+
+    def pagina(self, termo, produtos, depois=None, limite=24):
+        """
+        Lista de (id, relevancia) dos produtos encontrados que também estão no
+        queryset 'produtos', em ordem de (relevancia, id) e a partir da posição
+        'depois', um par (relevancia, id) vindo do cursor.
+        """
+        consulta = self.consulta(termo)
+        if consulta is None:
+            return []
+        sql, parametros = consulta
+        try:
+            sql_produtos, parametros_produtos = produtos.order_by().values('id').query.sql_with_params()
+        except EmptyResultSet:
+            return []
+
+        condicoes = [f"produto_id IN ({sql_produtos})"]
+        parametros = [*parametros, *parametros_produtos]
+        if depois:
+            relevancia, produto_id = depois
+            condicoes.append("(relevancia > %s OR (relevancia = %s AND produto_id > %s))")
+            parametros += [relevancia, relevancia, produto_id]
+
+        # MATERIALIZED faz a busca no índice uma única vez, antes dos filtros
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"WITH resultados AS MATERIALIZED ({sql}) "
+                f"SELECT produto_id, relevancia FROM resultados WHERE {' AND '.join(condicoes)} "
+                "ORDER BY relevancia, produto_id LIMIT %s",
+                [*parametros, limite]
+            )
+            return cursor.fetchall()
+
+
+class IndiceFTS5(IndiceBusca):
+    """Índice em tabela virtual FTS5 do SQLite, com rowid igual ao id do produto"""
+
+    def criar(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA_INDICE} USING fts5("
+                "nome, codigo, categoria, descricao, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+
+    def remover_tabela(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABELA_INDICE}")
+
+    def atualizar(self, produto):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABELA_INDICE} WHERE rowid = %s", [produto.id])
+            cursor.execute(
+                f"INSERT INTO {TABELA_INDICE} (rowid, nome, codigo, categoria, descricao) VALUES (%s, %s, %s, %s, %s)",
+                [
+                    produto.id,
+                    ' '.join(termos(produto.nome)),
+                    ' '.join(termos(produto.codigo)),
+                    ' '.join(termos(produto.categoria)),
+                    ' '.join(termos(produto.descricao)),
+                ]
+            )
+
+    def remover(self, produto_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABELA_INDICE} WHERE rowid = %s", [produto_id])
+
+    def consulta(self, termo):
+        radicais = termos(termo)
+        if not radicais:
+            return None
+        # Cada radical vira um prefixo: "caf tradic" -> "caf"* AND "tradic"*
+        return (
+            f"SELECT rowid AS produto_id, bm25({TABELA_INDICE}, 10.0, 5.0, 2.0, 1.0) AS relevancia "
+            f"FROM {TABELA_INDICE} WHERE {TABELA_INDICE} MATCH %s",
+            [' AND '.join(f'"{r}"*' for r in radicais)]
+        )
+
+
+class IndicePostgres(IndiceBusca):
+    """Índice tsvector com GIN no PostgreSQL, usando o stemmer 'portuguese'"""
+
+    def criar(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {TABELA_INDICE} ("
+                "produto_id bigint PRIMARY KEY REFERENCES mercadocesar_produto (id) ON DELETE CASCADE, "
+                "documento tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {TABELA_INDICE}_documento_gin ON {TABELA_INDICE} USING GIN (documento)"
+            )
+
+    def remover_tabela(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABELA_INDICE}")
+
+    def atualizar(self, produto):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {TABELA_INDICE} (produto_id, documento) VALUES (%s, "
+                "setweight(to_tsvector('portuguese', %s), 'A') || "
+                "setweight(to_tsvector('simple', %s), 'A') || "
+                "setweight(to_tsvector('portuguese', %s), 'B') || "
+                "setweight(to_tsvector('portuguese', %s), 'C')) "
+                "ON CONFLICT (produto_id) DO UPDATE SET documento = EXCLUDED.documento",
+                [
+                    produto.id,
+                    normalizar(produto.nome),
+                    normalizar(produto.codigo),
+                    normalizar(produto.categoria),
+                    normalizar(produto.descricao),
+                ]
+            )
+
+    def remover(self, produto_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABELA_INDICE} WHERE produto_id = %s", [produto_id])
+
+    def consulta(self, termo):
+        palavras = _PALAVRA.findall(normalizar(termo))
+        if not palavras:
+            return None
+        # ts_rank cresce com a relevância; negado para seguir a mesma ordem do bm25
+        return (
+            "SELECT produto_id, -ts_rank(documento, consulta)::float8 AS relevancia "
+            f"FROM {TABELA_INDICE}, to_tsquery('portuguese', %s) AS consulta WHERE documento @@ consulta",
+            [' & '.join(f'{palavra}:*' for palavra in palavras)]
+        )
+
+
+def obter_indice(conexao=None):
+    """Índice adequado ao banco em uso, ou None se o banco não tiver suporte"""
+    fornecedor = (conexao or connection).vendor
+    if fornecedor == 'postgresql':
+        return IndicePostgres()
+    if fornecedor == 'sqlite':
+        return IndiceFTS5()
+    return None
+
+
+def filtrar_sem_indice(termo, produtos):
+    return produtos.filter(
+        Q(codigo__icontains=termo) |
+        Q(nome__icontains=termo) |
+        Q(descricao__icontains=termo)
+    )
+
+
+def buscar_produtos(termo, produtos=None):
+    """Filtra os produtos pelo termo usando o índice, mantendo a ordem do queryset"""
+    from .models import Produto
+
+    if produtos is None:
+        produtos = Produto.objects.all()
+
+    indice = obter_indice()
+    if indice is None:
+        return filtrar_sem_indice(termo, produtos)
+
+    filtro = indice.filtro_ids(termo)
+    if filtro is None:
+        return produtos.none()
+    return produtos.filter(id__in=filtro)
+
+
+def pagina_por_relevancia(termo, produtos, depois=None, limite=24):
+    """
+    Uma página de (id, relevancia) dos produtos do queryset que batem com o
+    termo, em ordem de (relevancia, id). Sem índice a relevância é sempre 0.
+    """
+    indice = obter_indice()
+    if indice is not None:
+        return indice.pagina(termo, produtos, depois, limite)
+
+    produtos = filtrar_sem_indice(termo, produtos)
+    if depois:
+        produtos = produtos.filter(id__gt=depois[1])
+    return [(produto_id, 0.0) for produto_id in produtos.order_by('id').values_list('id', flat=True)[:limite]]
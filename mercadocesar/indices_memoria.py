@@ -0,0 +1,61 @@
+"""
+Construção dos índices de busca mantidos em memória por processo.
+
+Sem índice construído, a primeira consulta espera a construção (uma única vez,
+mesmo com várias threads). Com o índice antigo, só uma thread dispara a
+reconstrução em segundo plano e todas continuam usando a versão atual até a
+nova ficar pronta. aquecer() constrói o índice na subida do processo web.
+"""
+import logging
+import threading
+import time
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class ReconstrucaoIndice:
+    """Mantém um índice em memória construído e com no máximo 'idade_maxima' segundos"""
+
+    def __init__(self, indice, carregar, idade_maxima):
+        # 'carregar' recebe o índice e o (re)constrói a partir do banco
+        self.indice = indice
+        self.carregar = carregar
+        self.idade_maxima = idade_maxima
+        self._lock = threading.Lock()
+
+    def obter(self):
+        construido_em = self.indice.construido_em
+        if construido_em is None:
+            with self._lock:
+                if self.indice.construido_em is None:
+                    self.carregar(self.indice)
+        elif time.monotonic() - construido_em > self.idade_maxima and self._lock.acquire(blocking=False):
+            threading.Thread(target=self._reconstruir, daemon=True).start()
+        return self.indice
+
+    def construido(self):
+        """O índice, ou None se ainda não foi construído"""
+        return self.indice if self.indice.construido_em is not None else None
+
+    def aquecer(self):
+        """Constrói o índice em segundo plano, sem atrasar a subida do processo"""
+        threading.Thread(target=self._aquecer, daemon=True).start()
+
+    def _reconstruir(self):
+        try:
+            self.carregar(self.indice)
+        except Exception:
+            logger.exception("Falha ao reconstruir o índice %s", type(self.indice).__name__)
+        finally:
+            self._lock.release()
+            connections.close_all()
+
+    def _aquecer(self):
+        try:
+            self.obter()
+        except Exception:
+            logger.exception("Falha ao construir o índice %s", type(self.indice).__name__)
+        finally:
+            connections.close_all()
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from mercadocesar.estoque import expirar_reservas
+
+
+class Command(BaseCommand):
+    help = "Remove as reservas de estoque vencidas (agendar periodicamente, por exemplo a cada minuto)"
+
+    def handle(self, *args, **options):
+        removidas = expirar_reservas()
+        self.stdout.write(self.style.SUCCESS(f"{removidas} reserva(s) expirada(s) removida(s)."))
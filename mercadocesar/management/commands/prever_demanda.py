@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from mercadocesar.previsao import (ALFA_SUAVIZACAO, DIAS_HISTORICO, JANELA_MEDIA_MOVEL, TAMANHO_LOTE,
+                                   prever_demanda)
+
+
+class Command(BaseCommand):
+    help = ("Recalcula a previsão de demanda, o ponto de pedido e a compra sugerida de cada produto "
+            "a partir do histórico de pedidos (agendar diariamente, de madrugada)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=DIAS_HISTORICO, help='Dias de histórico considerados')
+        parser.add_argument('--janela', type=int, default=JANELA_MEDIA_MOVEL, help='Dias da média móvel')
+        parser.add_argument('--alfa', type=float, default=ALFA_SUAVIZACAO, help='Peso da suavização exponencial (0 a 1)')
+        parser.add_argument('--batch-size', type=int, default=TAMANHO_LOTE, help='Quantidade de produtos por lote')
+
+    def handle(self, *args, **options):
+        if not 0 < options['alfa'] <= 1:
+            raise CommandError("--alfa deve estar entre 0 e 1")
+        gravadas = prever_demanda(
+            dias=options['dias'], janela=options['janela'], alfa=options['alfa'], tamanho_lote=options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(f"{gravadas} previsão(ões) gravada(s)."))
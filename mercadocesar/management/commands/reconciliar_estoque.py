@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce
+from mercadocesar.models import Produto
+
+
+class Command(BaseCommand):
+    help = (
+        "Detecta e corrige divergências entre Produto.total_estoque e a soma dos registros de Estoque, "
+        "causadas por escritas em Estoque que não disparam sinais (update(), bulk_create(), bulk_update(), SQL direto)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Apenas lista as divergências, sem corrigir',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Quantidade de produtos atualizados por lote',
+        )
+
+    def handle(self, *args, **options):
+        divergentes = Produto.objects.annotate(
+            soma_estoque=Coalesce(Sum('estoque__quantidade'), Value(0))
+        ).exclude(total_estoque=F('soma_estoque')).only('id', 'nome', 'total_estoque')
+
+        corrigidos = []
+        for produto in divergentes.iterator(chunk_size=options['batch_size']):
+            self.stdout.write(
+                f"{produto.nome}: total_estoque={produto.total_estoque}, soma real={produto.soma_estoque}"
+            )
+            produto.total_estoque = produto.soma_estoque
+            corrigidos.append(produto)
+
+        if not corrigidos:
+            self.stdout.write(self.style.SUCCESS("Nenhuma divergência encontrada."))
+            return
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{len(corrigidos)} produto(s) divergente(s). Nada foi alterado."))
+            return
+
+        with transaction.atomic():
+            Produto.objects.bulk_update(corrigidos, ['total_estoque'], batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f"{len(corrigidos)} produto(s) corrigido(s)."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from mercadocesar.indice_busca import obter_indice
+from mercadocesar.models import Produto
+
+
+class Command(BaseCommand):
+    help = "Recria o índice de busca textual de produtos a partir da tabela Produto"
+
+    def handle(self, *args, **options):
+        indice = obter_indice()
+        if indice is None:
+            raise CommandError("O banco de dados em uso não tem suporte ao índice de busca.")
+
+        with transaction.atomic():
+            indice.remover_tabela()
+            indice.criar()
+            indice.reconstruir(Produto.objects.all().iterator(chunk_size=500))
+
+        self.stdout.write(self.style.SUCCESS(f"Índice recriado com {Produto.objects.count()} produto(s)."))
@@ -0,0 +1,93 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from mercadocesar.alocacao import ESTRATEGIAS, carregar_candidatos, planejar_alocacao
+from mercadocesar.models import Estoque, ItemPedido, Pedido
+
+
+class Command(BaseCommand):
+    help = "Compara as estratégias de alocação de estoque sobre pedidos reais ou sintéticos, sem alterar o banco"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--estrategia',
+            action='append',
+            choices=sorted(ESTRATEGIAS),
+            help='Estratégia a simular (pode repetir). Padrão: todas',
+        )
+        parser.add_argument(
+            '--pedidos',
+            type=int,
+            default=200,
+            help='Quantidade de pedidos simulados',
+        )
+        parser.add_argument(
+            '--sinteticos',
+            action='store_true',
+            help='Gera cestas aleatórias em vez de repetir os pedidos mais recentes',
+        )
+        parser.add_argument(
+            '--itens',
+            type=int,
+            default=20,
+            help='Itens por cesta sintética',
+        )
+        parser.add_argument(
+            '--cep',
+            default='',
+            help='CEP de destino usado pela estratégia mais_proximo (padrão: o do pedido ou da loja)',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def cestas_reais(self, limite):
+        pedidos = list(
+            Pedido.objects.order_by('-data_criacao').values_list('id', 'cep', 'loja__cep')[:limite]
+        )
+        cestas = {pedido_id: ({}, cep_loja or cep or '') for pedido_id, cep, cep_loja in pedidos}
+        itens = ItemPedido.objects.filter(pedido_id__in=cestas).values_list('pedido_id', 'produto_id', 'quantidade')
+        for pedido_id, produto_id, quantidade in itens:
+            quantidades = cestas[pedido_id][0]
+            quantidades[produto_id] = quantidades.get(produto_id, 0) + quantidade
+        return [cesta for cesta in cestas.values() if cesta[0]]
+
+    def cestas_sinteticas(self, limite, itens, gerador):
+        produtos = list(Estoque.objects.filter(quantidade__gt=0).values_list('produto_id', flat=True).distinct())
+        if not produtos:
+            return []
+        return [
+            ({produto_id: gerador.randint(1, 12) for produto_id in gerador.sample(produtos, min(itens, len(produtos)))}, '')
+            for _ in range(limite)
+        ]
+
+    def handle(self, *args, **options):
+        gerador = random.Random(options['seed'])
+        if options['sinteticos']:
+            cestas = self.cestas_sinteticas(options['pedidos'], options['itens'], gerador)
+        else:
+            cestas = self.cestas_reais(options['pedidos'])
+        if not cestas:
+            raise CommandError("Nenhuma cesta para simular. Cadastre estoque ou use --sinteticos.")
+
+        # Uma leitura de estoque para todas as cestas; cada cesta é simulada contra o estoque atual
+        produto_ids = {produto_id for quantidades, _ in cestas for produto_id in quantidades}
+        candidatos = carregar_candidatos(produto_ids)
+
+        self.stdout.write(f"{len(cestas)} cesta(s), {len(produto_ids)} produto(s) distintos\n")
+        for nome in options['estrategia'] or sorted(ESTRATEGIAS):
+            atendidas = linhas = armazens = 0
+            inicio = time.perf_counter()
+            for quantidades, cep in cestas:
+                plano = planejar_alocacao(quantidades, nome, cep_destino=options['cep'] or cep, candidatos=candidatos)
+                if not plano.faltas:
+                    atendidas += 1
+                linhas += len(plano.debitos)
+                armazens += len(plano.armazens)
+            decorrido = (time.perf_counter() - inicio) * 1000
+
+            self.stdout.write(
+                f"{nome:<16} atendidas={atendidas}/{len(cestas)}  "
+                f"armazéns/pedido={armazens / len(cestas):.2f}  "
+                f"retiradas/pedido={linhas / len(cestas):.2f}  "
+                f"tempo/pedido={decorrido / len(cestas):.3f} ms"
+            )
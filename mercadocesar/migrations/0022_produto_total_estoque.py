@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:42
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def preencher_total_estoque(apps, schema_editor):
+    Produto = apps.get_model('mercadocesar', 'Produto')
+    Estoque = apps.get_model('mercadocesar', 'Estoque')
+
+    soma = Estoque.objects.filter(produto=OuterRef('pk')).values('produto').annotate(
+        total=Sum('quantidade')
+    ).values('total')
+    Produto.objects.update(total_estoque=Coalesce(Subquery(soma), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercadocesar', '0021_adicionar_produtos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produto',
+            name='total_estoque',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(preencher_total_estoque, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def criar_indice_busca(apps, schema_editor):
+    from mercadocesar.indice_busca import obter_indice
+
+    indice = obter_indice(schema_editor.connection)
+    if indice is None:
+        return
+    Produto = apps.get_model('mercadocesar', 'Produto')
+    indice.criar()
+    indice.reconstruir(Produto.objects.all())
+
+
+def remover_indice_busca(apps, schema_editor):
+    from mercadocesar.indice_busca import obter_indice
+
+    indice = obter_indice(schema_editor.connection)
+    if indice is not None:
+        indice.remover_tabela()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercadocesar', '0022_produto_total_estoque'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indice_busca, remover_indice_busca),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def preencher_vendas(apps, schema_editor):
+    ItemPedido = apps.get_model('mercadocesar', 'ItemPedido')
+    VendaProduto = apps.get_model('mercadocesar', 'VendaProduto')
+
+    totais = ItemPedido.objects.values('produto').annotate(total=Sum('quantidade')).order_by()
+    VendaProduto.objects.bulk_create(
+        [VendaProduto(produto_id=linha['produto'], total_vendido=linha['total']) for linha in totais],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercadocesar', '0023_indice_busca_produto'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendaProduto',
+            fields=[
+                ('produto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='vendas', serialize=False, to='mercadocesar.produto')),
+                ('total_vendido', models.PositiveIntegerField(db_index=True, default=0)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(preencher_vendas, migrations.RunPython.noop),
+    ]
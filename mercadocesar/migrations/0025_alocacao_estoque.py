@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:54
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercadocesar', '0024_venda_produto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='armazem',
+            name='cep',
+            field=models.CharField(blank=True, max_length=9),
+        ),
+        migrations.AddField(
+            model_name='estoque',
+            name='reabastecido_em',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:59
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def unificar_itens_repetidos(apps, schema_editor):
+    ItemCarrinho = apps.get_model('mercadocesar', 'ItemCarrinho')
+
+    repetidos = ItemCarrinho.objects.values('carrinho', 'produto').annotate(
+        linhas=Count('id'), total=Sum('quantidade')
+    ).filter(linhas__gt=1).order_by()
+    for grupo in list(repetidos):
+        itens = ItemCarrinho.objects.filter(carrinho=grupo['carrinho'], produto=grupo['produto']).order_by('id')
+        primeiro = itens.first()
+        itens.exclude(id=primeiro.id).delete()
+        ItemCarrinho.objects.filter(id=primeiro.id).update(quantidade=grupo['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercadocesar', '0027_pedido_chave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.RunPython(unificar_itens_repetidos, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='itemcarrinho',
+            constraint=models.UniqueConstraint(fields=('carrinho', 'produto'), name='item_carrinho_produto_unico'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:07
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def preencher_totais(apps, schema_editor):
+    Carrinho = apps.get_model('mercadocesar', 'Carrinho')
+    ItemCarrinho = apps.get_model('mercadocesar', 'ItemCarrinho')
+
+    itens = ItemCarrinho.objects.filter(carrinho=OuterRef('pk')).order_by().values('carrinho')
+    Carrinho.objects.update(
+        total_itens=Coalesce(Subquery(itens.annotate(total=Sum('quantidade')).values('total')), Value(0)),
+        subtotal=Coalesce(
+            Subquery(itens.annotate(total=Sum(F('quantidade') * F('produto__preco'))).values('total')),
+            Value(Decimal('0')),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercadocesar', '0028_item_carrinho_unico'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carrinho',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='carrinho',
+            name='total_itens',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(preencher_totais, migrations.RunPython.noop),
+    ]
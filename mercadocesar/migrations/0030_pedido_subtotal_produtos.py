@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:10
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+
+
+def preencher_subtotais(apps, schema_editor):
+    Pedido = apps.get_model('mercadocesar', 'Pedido')
+    ItemPedido = apps.get_model('mercadocesar', 'ItemPedido')
+
+    soma = ItemPedido.objects.filter(pedido=OuterRef('pk')).order_by().values('pedido').annotate(
+        total=Sum(F('quantidade') * F('preco_unitario'))
+    ).values('total')
+    Pedido.objects.update(
+        subtotal_produtos=Subquery(soma, output_field=models.DecimalField(max_digits=12, decimal_places=2))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercadocesar', '0029_carrinho_totais'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedido',
+            name='subtotal_produtos',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=12, null=True),
+        ),
+        migrations.RunPython(preencher_subtotais, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:12
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def desativar_carrinhos_repetidos(apps, schema_editor):
+    # Mantém ativo o carrinho de menor id, o mesmo que obter_carrinho_ativo já usava
+    Carrinho = apps.get_model('mercadocesar', 'Carrinho')
+
+    repetidos = Carrinho.objects.filter(ativo=True).values('usuario').annotate(
+        carrinhos=Count('id'), primeiro=Min('id')
+    ).filter(carrinhos__gt=1).order_by()
+    for grupo in list(repetidos):
+        Carrinho.objects.filter(usuario=grupo['usuario'], ativo=True).exclude(id=grupo['primeiro']).update(ativo=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercadocesar', '0030_pedido_subtotal_produtos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(desativar_carrinhos_repetidos, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='estoque',
+            index=models.Index(fields=['produto', 'quantidade'], name='estoque_produto_qtd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='estoque',
+            index=models.Index(fields=['quantidade'], name='estoque_quantidade_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loja',
+            index=models.Index(condition=models.Q(('ativa', True)), fields=['id'], name='loja_ativa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['usuario', '-data_criacao', '-id'], name='pedido_usuario_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['-data_criacao', '-id'], name='pedido_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['tipo_entrega', 'data_criacao'], name='pedido_tipo_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='produto',
+            index=models.Index(fields=['categoria', 'id'], name='produto_categoria_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='carrinho',
+            constraint=models.UniqueConstraint(condition=models.Q(('ativo', True)), fields=('usuario',), name='carrinho_ativo_unico'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercadocesar', '0031_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstoqueMinimo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('categoria', models.CharField(blank=True, max_length=50)),
+                ('quantidade_minima', models.PositiveIntegerField()),
+                ('produto', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='estoque_minimo', to='mercadocesar.produto')),
+            ],
+            options={
+                'verbose_name': 'Estoque mínimo',
+                'verbose_name_plural': 'Estoques mínimos',
+                'constraints': [models.CheckConstraint(condition=models.Q(models.Q(('categoria', ''), ('produto__isnull', False)), models.Q(('produto__isnull', True), models.Q(('categoria', ''), _negated=True)), _connector='OR'), name='estoque_minimo_produto_ou_categoria'), models.UniqueConstraint(condition=models.Q(('produto__isnull', True)), fields=('categoria',), name='estoque_minimo_categoria_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercadocesar', '0032_estoque_minimo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrevisaoDemanda',
+            fields=[
+                ('produto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='previsao', serialize=False, to='mercadocesar.produto')),
+                ('media_movel', models.FloatField()),
+                ('demanda_suavizada', models.FloatField()),
+                ('desvio_padrao', models.FloatField()),
+                ('ponto_pedido', models.PositiveIntegerField()),
+                ('estoque_alvo', models.PositiveIntegerField()),
+                ('quantidade_sugerida', models.PositiveIntegerField()),
+                ('calculado_em', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Previsão de Demanda',
+                'verbose_name_plural': 'Previsões de Demanda',
+            },
+        ),
+    ]
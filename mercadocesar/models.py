@@ -2,9 +2,43 @@ from django.db import models
 from django.db.models import CheckConstraint, Q
 from django.core.validators import MinValueValidator
 from django.conf import settings
+from django.utils import timezone
 from cloudinary.models import CloudinaryField
 
 
+class CatalogoQuerySet(models.QuerySet):
+	def com_disponibilidade(self):
+		"""Anota o estoque livre (total menos reservas ativas) e o indicador de disponibilidade"""
+		from django.db.models import BooleanField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+		from django.db.models.functions import Coalesce, Greatest
+		reservado = ReservaEstoque.ativas().filter(produto=OuterRef('pk')).order_by().values('produto').annotate(
+			total=Sum('quantidade')
+		).values('total')
+		return self.annotate(
+			estoque_livre=Greatest(F('total_estoque') - Coalesce(Subquery(reservado), Value(0)), Value(0)),
+		).annotate(
+			disponivel=ExpressionWrapper(Q(estoque_livre__gt=0), output_field=BooleanField()),
+		)
+
+	def catalogo(self):
+		"""Produtos com disponibilidade e destaque por categoria calculados no banco"""
+		from django.db.models import BooleanField, Case, F, Value, When, Window
+		from django.db.models.functions import RowNumber
+		return self.com_disponibilidade().annotate(
+			posicao_categoria=Window(
+				expression=RowNumber(),
+				partition_by=[F('categoria')],
+				order_by=F('id').asc(),
+			),
+		).annotate(
+			destaque_categoria=Case(
+				When(posicao_categoria=1, then=Value(True)),
+				default=Value(False),
+				output_field=BooleanField(),
+			),
+		).order_by('categoria', 'id')
+
+
 class Produto(models.Model):
 	nome = models.CharField(max_length=30, unique=True)
 	codigo = models.CharField(max_length=30, unique=True)
@@ -22,6 +56,10 @@ class Produto(models.Model):
 	)
 	unidade_medida = models.CharField(max_length=20)
 	imagem = CloudinaryField('image', blank=True, null=True)
+	# Soma de Estoque.quantidade em todos os armazéns, mantida pelos sinais de Estoque
+	total_estoque = models.PositiveIntegerField(default=0, editable=False)
+
+	objects = CatalogoQuerySet.as_manager()
 
 	class Meta:
 		constraints = [
@@ -30,19 +68,46 @@ class Produto(models.Model):
 			CheckConstraint(check=~Q(categoria=""), name='categoria_nao_vazia'),
 			CheckConstraint(check=~Q(unidade_medida=""), name='unidade_medida_nao_vazia'),
 		]
+		indexes = [
+			# Listagem do catálogo por categoria, na ordem da paginação (categoria, id)
+			models.Index(fields=['categoria', 'id'], name='produto_categoria_idx'),
+		]
 
 	def __str__(self):
 		return f"{self.codigo} - {self.descricao} - {self.categoria}"
 	
 	def estoque_total(self):
-		from django.db.models import Sum
-		total = self.estoque_set.aggregate(Sum('quantidade'))['quantidade__sum']
-		return total if total is not None else 0
+		"""
+		Total de todos os armazéns, como carregado com a instância.
+
+		Os sinais de Estoque gravam o novo total com update(), sem alterar
+		instâncias de Produto já carregadas (exceto o produto em cache no
+		próprio Estoque salvo). Depois de alterar estoques, quem precisar do
+		valor atual deve chamar refresh_from_db(fields=['total_estoque']).
+		"""
+		return self.total_estoque
+
+	def estoque_disponivel(self, carrinho=None):
+		"""Estoque total menos as reservas ativas de outros carrinhos"""
+		return max(self.total_estoque - ReservaEstoque.reservado(self.id, excluir_carrinho=carrinho), 0)
+
+	@staticmethod
+	def atualizar_estoque_total(produto_ids):
+		"""Recalcula total_estoque dos produtos informados em um único UPDATE"""
+		from django.db.models import OuterRef, Subquery, Sum, Value
+		from django.db.models.functions import Coalesce
+		soma = Estoque.objects.filter(produto=OuterRef('pk')).values('produto').annotate(
+			total=Sum('quantidade')
+		).values('total')
+		return Produto.objects.filter(id__in=produto_ids).update(
+			total_estoque=Coalesce(Subquery(soma), Value(0))
+		)
 
 
 class Armazem(models.Model):
 	nome = models.CharField(max_length=100)
 	endereco = models.CharField(max_length=200, blank=True)
+	cep = models.CharField(max_length=9, blank=True)
 
 	def __str__(self):
 		return self.nome
@@ -55,16 +120,92 @@ class Estoque(models.Model):
 	produto = models.ForeignKey(Produto, on_delete=models.CASCADE)
 	armazem = models.ForeignKey(Armazem, on_delete=models.CASCADE)
 	quantidade = models.PositiveIntegerField()
+	reabastecido_em = models.DateTimeField(default=timezone.now)
 
 	class Meta:
 		unique_together = ('produto', 'armazem')
+		indexes = [
+			# Candidatos à alocação: produto_id IN (...) AND quantidade > 0
+			models.Index(fields=['produto', 'quantidade'], name='estoque_produto_qtd_idx'),
+			# Varreduras de estoque baixo
+			models.Index(fields=['quantidade'], name='estoque_quantidade_idx'),
+		]
 
 	def __str__(self):
 		return f"{self.produto} em {self.armazem}: {self.quantidade}"
 
+	def definir_quantidade(self, quantidade):
+		"""Altera a quantidade, registrando a data quando houver reposição"""
+		if quantidade > self.quantidade:
+			self.reabastecido_em = timezone.now()
+		self.quantidade = quantidade
+
+	@staticmethod
+	def abaixo_estoque_minimo(minimo=None):
+		"""Linhas abaixo do mínimo; sem 'minimo', vale o configurado para cada produto (EstoqueMinimo)"""
+		if minimo is not None:
+			return Estoque.objects.filter(quantidade__lt=minimo)
+		from django.db.models import F
+		# O maior mínimo configurado limita a faixa lida pelo índice de quantidade
+		return Estoque.objects.filter(quantidade__lt=EstoqueMinimo.maior()).annotate(
+			minimo=EstoqueMinimo.para('produto', 'produto__categoria')
+		).filter(quantidade__lt=F('minimo'))
+
+
+class EstoqueMinimo(models.Model):
+	"""
+	Quantidade mínima por armazém abaixo da qual o produto precisa de reposição.
+
+	Vale para um produto ou, sem produto, para toda uma categoria. O mínimo do
+	produto prevalece sobre o da categoria; sem nenhum dos dois vale
+	settings.ESTOQUE_MINIMO_PADRAO.
+	"""
+	produto = models.OneToOneField(
+		Produto, on_delete=models.CASCADE, null=True, blank=True, related_name='estoque_minimo'
+	)
+	categoria = models.CharField(max_length=50, blank=True)
+	quantidade_minima = models.PositiveIntegerField()
+
+	class Meta:
+		verbose_name = "Estoque mínimo"
+		verbose_name_plural = "Estoques mínimos"
+		constraints = [
+			CheckConstraint(
+				check=Q(produto__isnull=False, categoria="") | (Q(produto__isnull=True) & ~Q(categoria="")),
+				name='estoque_minimo_produto_ou_categoria',
+			),
+			models.UniqueConstraint(
+				fields=['categoria'], condition=Q(produto__isnull=True), name='estoque_minimo_categoria_unica'
+			),
+		]
+
+	def __str__(self):
+		alvo = self.produto if self.produto_id else f"Categoria {self.categoria}"
+		return f"{alvo}: mínimo {self.quantidade_minima}"
+
 	@staticmethod
-	def abaixo_estoque_minimo(minimo=30):
-		return Estoque.objects.filter(quantidade__lt=minimo)
+	def para(produto='pk', categoria='categoria'):
+		"""
+		Expressão com o mínimo de cada linha da consulta externa; 'produto' e
+		'categoria' são os caminhos até o produto e sua categoria.
+		"""
+		from django.db.models import OuterRef, Subquery, Value
+		from django.db.models.functions import Coalesce
+		do_produto = EstoqueMinimo.objects.filter(produto=OuterRef(produto)).values('quantidade_minima')
+		da_categoria = EstoqueMinimo.objects.filter(
+			produto__isnull=True, categoria=OuterRef(categoria)
+		).values('quantidade_minima')
+		return Coalesce(
+			Subquery(do_produto[:1]), Subquery(da_categoria[:1]), Value(settings.ESTOQUE_MINIMO_PADRAO),
+			output_field=models.PositiveIntegerField(),
+		)
+
+	@staticmethod
+	def maior():
+		"""Maior mínimo em vigor, entre o padrão e os configurados"""
+		from django.db.models import Max
+		maior = EstoqueMinimo.objects.aggregate(maior=Max('quantidade_minima'))['maior']
+		return max(maior or 0, settings.ESTOQUE_MINIMO_PADRAO)
 
 class CartaoCredito(models.Model):
     usuario = models.ForeignKey(
@@ -97,21 +238,83 @@ class Loja(models.Model):
     prazo_retirada_dias = models.IntegerField(default=1)
     ativa = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # Poucas lojas ativas: índice parcial só com elas
+            models.Index(fields=['id'], name='loja_ativa_idx', condition=Q(ativa=True)),
+        ]
+
     def __str__(self):
         return f"{self.nome} - {self.cidade}/{self.estado}"
 
 
+class CarrinhoQuerySet(models.QuerySet):
+    def com_totais_atuais(self):
+        """Anota total_itens_atual e subtotal_atual somando os itens com os preços atuais"""
+        from decimal import Decimal
+        from django.db.models import DecimalField, F, Sum, Value
+        from django.db.models.functions import Coalesce
+        return self.annotate(
+            total_itens_atual=Coalesce(Sum('itens__quantidade'), Value(0)),
+            subtotal_atual=Coalesce(
+                Sum(F('itens__quantidade') * F('itens__produto__preco')),
+                Value(Decimal('0')),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+
+
 class Carrinho(models.Model):
     usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     ativo = models.BooleanField(default=True)
     data_criacao = models.DateTimeField(auto_now_add=True)
+    # Totais mantidos a cada alteração de item (ver carrinho.py); o subtotal usa o
+    # preço do momento da alteração e é revalidado no checkout
+    total_itens = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    objects = CarrinhoQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Um carrinho ativo por usuário; também serve a busca (usuario, ativo=True)
+            models.UniqueConstraint(fields=['usuario'], condition=Q(ativo=True), name='carrinho_ativo_unico'),
+        ]
 
     def __str__(self):
         return f"Carrinho de {self.usuario.username}"
     
     def calcular_total(self):
-        total = sum(item.calcular_subtotal() for item in self.itens.all())
-        return total
+        return self.subtotal
+
+    def revalidar_totais(self):
+        """
+        Corrige os totais se divergirem dos itens e preços atuais.
+
+        Requer uma instância carregada com Carrinho.objects.com_totais_atuais().
+        Retorna True se os totais precisaram ser corrigidos.
+        """
+        if (self.total_itens, self.subtotal) == (self.total_itens_atual, self.subtotal_atual):
+            return False
+        Carrinho.atualizar_totais([self.id])
+        self.total_itens, self.subtotal = self.total_itens_atual, self.subtotal_atual
+        return True
+
+    @staticmethod
+    def atualizar_totais(carrinho_ids):
+        """Recalcula total_itens e subtotal dos carrinhos informados em um único UPDATE"""
+        from decimal import Decimal
+        from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+        from django.db.models.functions import Coalesce
+        itens = ItemCarrinho.objects.filter(carrinho=OuterRef('pk')).order_by().values('carrinho')
+        return Carrinho.objects.filter(id__in=carrinho_ids).update(
+            total_itens=Coalesce(Subquery(itens.annotate(total=Sum('quantidade')).values('total')), Value(0)),
+            subtotal=Coalesce(
+                Subquery(itens.annotate(total=Sum(F('quantidade') * F('produto__preco'))).values('total')),
+                Value(Decimal('0')),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
 
 
 class ItemCarrinho(models.Model):
@@ -119,6 +322,11 @@ class ItemCarrinho(models.Model):
     produto = models.ForeignKey(Produto, on_delete=models.CASCADE)
     quantidade = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['carrinho', 'produto'], name='item_carrinho_produto_unico'),
+        ]
+
     def __str__(self):
         return f"{self.quantidade}x {self.produto.nome}"
     
@@ -155,6 +363,21 @@ class Pedido(models.Model):
     prazo_dias = models.IntegerField()
     
     data_criacao = models.DateTimeField(auto_now_add=True)
+    
+    # Gerada na revisão do pedido; impede que um envio repetido crie outro pedido
+    chave_idempotencia = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+
+    # Soma dos itens, gravada ao finalizar (os itens não mudam depois)
+    subtotal_produtos = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Histórico paginado por (data_criacao, id), com e sem filtro por usuário
+            models.Index(fields=['usuario', '-data_criacao', '-id'], name='pedido_usuario_data_idx'),
+            models.Index(fields=['-data_criacao', '-id'], name='pedido_data_idx'),
+            # Filtros de tipo de entrega e período em visualizar_pedidos
+            models.Index(fields=['tipo_entrega', 'data_criacao'], name='pedido_tipo_data_idx'),
+        ]
 
     def __str__(self):
         return f"Pedido #{self.id} - {self.get_tipo_entrega_display()}"
@@ -162,8 +385,10 @@ class Pedido(models.Model):
     def calcular_subtotal_produtos(self):
         """Calcula o total dos produtos do pedido"""
         from decimal import Decimal
-        total = sum(item.calcular_subtotal() for item in self.itens.all())
-        return Decimal(str(total)) if total else Decimal('0')
+        if self.subtotal_produtos is not None:
+            return self.subtotal_produtos
+        # Pedidos criados sem o total gravado: soma os itens (aproveita o prefetch)
+        return sum((item.calcular_subtotal() for item in self.itens.all()), Decimal('0'))
     
     def calcular_total(self):
         """Calcula o valor total do pedido (produtos + entrega)"""
@@ -184,3 +409,89 @@ class ItemPedido(models.Model):
         return self.preco_unitario * self.quantidade
 
 
+
+
+class VendaProduto(models.Model):
+    """Total de unidades vendidas por produto, acumulado ao finalizar pedidos"""
+    produto = models.OneToOneField(Produto, on_delete=models.CASCADE, primary_key=True, related_name='vendas')
+    total_vendido = models.PositiveIntegerField(default=0, db_index=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.produto.nome}: {self.total_vendido} vendido(s)"
+
+    @staticmethod
+    def registrar(quantidades):
+        """Soma {produto_id: quantidade} aos totais vendidos com um INSERT e um UPDATE"""
+        from django.db.models import Case, F, IntegerField, Value, When
+        from django.utils import timezone
+        if not quantidades:
+            return
+        VendaProduto.objects.bulk_create(
+            [VendaProduto(produto_id=produto_id) for produto_id in quantidades],
+            ignore_conflicts=True,
+        )
+        VendaProduto.objects.filter(produto_id__in=quantidades).update(
+            total_vendido=F('total_vendido') + Case(
+                *[When(produto_id=produto_id, then=Value(quantidade)) for produto_id, quantidade in quantidades.items()],
+                output_field=IntegerField(),
+            ),
+            atualizado_em=timezone.now(),
+        )
+
+
+class PrevisaoDemanda(models.Model):
+    """Demanda diária prevista e ponto de pedido por produto, gravados pelo comando prever_demanda"""
+    produto = models.OneToOneField(Produto, on_delete=models.CASCADE, primary_key=True, related_name='previsao')
+    # Unidades por dia
+    media_movel = models.FloatField()
+    demanda_suavizada = models.FloatField()
+    desvio_padrao = models.FloatField()
+    # Repor quando o estoque total chegar ao ponto de pedido, comprando até o estoque alvo
+    ponto_pedido = models.PositiveIntegerField()
+    estoque_alvo = models.PositiveIntegerField()
+    quantidade_sugerida = models.PositiveIntegerField()
+    calculado_em = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Previsão de Demanda"
+        verbose_name_plural = "Previsões de Demanda"
+
+    def __str__(self):
+        return f"{self.produto.nome}: {self.demanda_suavizada:.1f}/dia, ponto de pedido {self.ponto_pedido}"
+
+
+class ReservaEstoque(models.Model):
+    """Unidades separadas para um carrinho enquanto o cliente revisa o pedido"""
+    carrinho = models.ForeignKey(Carrinho, on_delete=models.CASCADE, related_name='reservas')
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='reservas')
+    quantidade = models.PositiveIntegerField()
+    expira_em = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('carrinho', 'produto')
+        verbose_name = "Reserva de Estoque"
+        verbose_name_plural = "Reservas de Estoque"
+
+    def __str__(self):
+        return f"{self.quantidade}x {self.produto.nome} ({self.carrinho})"
+
+    @staticmethod
+    def ativas(excluir_carrinho=None):
+        reservas = ReservaEstoque.objects.filter(expira_em__gt=timezone.now())
+        if excluir_carrinho is not None:
+            reservas = reservas.exclude(carrinho=excluir_carrinho)
+        return reservas
+
+    @staticmethod
+    def reservado_por_produto(produto_ids, excluir_carrinho=None):
+        """{produto_id: unidades reservadas} considerando apenas reservas não expiradas"""
+        from django.db.models import Sum
+        return dict(
+            ReservaEstoque.ativas(excluir_carrinho).filter(produto_id__in=produto_ids).order_by()
+            .values('produto').annotate(total=Sum('quantidade')).values_list('produto', 'total')
+        )
+
+    @staticmethod
+    def reservado(produto_id, excluir_carrinho=None):
+        return ReservaEstoque.reservado_por_produto([produto_id], excluir_carrinho).get(produto_id, 0)
@@ -0,0 +1,147 @@
+"""
+Previsão de demanda e ponto de pedido por produto.
+
+O histórico de ItemPedido é agregado no próprio banco em vendas diárias
+(GROUP BY produto, dia) e lido em lotes de produtos com iterator(). Cada série
+é percorrida uma vez, só pelos dias com venda: na suavização exponencial os
+dias sem venda entram de uma vez como decaimento (1 - alfa) ** dias, e a média
+móvel e o desvio padrão somam apenas os dias da janela. Assim o tempo
+acompanha o número de dias com venda e a memória fica limitada a um lote,
+mesmo com anos de histórico.
+
+Os pedidos não registram de qual armazém saiu cada unidade, então a previsão é
+por produto e o ponto de pedido é comparado ao estoque total (total_estoque).
+"""
+import math
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .historico import inicio_do_dia
+from .models import ItemPedido, PrevisaoDemanda, Produto
+
+DIAS_HISTORICO = 730
+JANELA_MEDIA_MOVEL = 28
+ALFA_SUAVIZACAO = 0.3
+# Estoque de segurança para cerca de 95% de nível de serviço
+FATOR_SEGURANCA = 1.65
+TAMANHO_LOTE = 500
+
+
+def estatisticas_serie(vendas, hoje, janela=JANELA_MEDIA_MOVEL, alfa=ALFA_SUAVIZACAO):
+    """
+    Estatísticas de uma série de vendas diárias até 'hoje' (inclusive).
+
+    'vendas' é uma lista de (dia, unidades) em ordem, apenas com os dias em que
+    houve venda; os demais contam como zero. Retorna (media_movel,
+    demanda_suavizada, desvio_padrao), em unidades por dia. Para produtos
+    com menos dias de histórico que a janela, a janela começa na primeira venda.
+    """
+    dias_janela = max(min(janela, (hoje - vendas[0][0]).days + 1), 1)
+    inicio_janela = hoje - timedelta(days=dias_janela - 1)
+
+    suavizada = None
+    anterior = None
+    soma = soma_quadrados = 0
+    for dia, unidades in vendas:
+        if suavizada is None:
+            suavizada = float(unidades)
+        else:
+            suavizada *= (1 - alfa) ** ((dia - anterior).days - 1)
+            suavizada = alfa * unidades + (1 - alfa) * suavizada
+        anterior = dia
+        if dia >= inicio_janela:
+            soma += unidades
+            soma_quadrados += unidades * unidades
+    suavizada *= (1 - alfa) ** (hoje - anterior).days
+
+    media = soma / dias_janela
+    desvio = math.sqrt(max(soma_quadrados / dias_janela - media * media, 0))
+    return media, suavizada, desvio
+
+
+def ponto_de_pedido(demanda, desvio, prazo):
+    """Demanda esperada durante o prazo de reposição mais o estoque de segurança"""
+    return math.ceil(demanda * prazo + FATOR_SEGURANCA * desvio * math.sqrt(prazo))
+
+
+def calcular_previsao(produto_id, estoque_total, vendas, hoje, janela, alfa, calculado_em):
+    media, suavizada, desvio = estatisticas_serie(vendas, hoje, janela, alfa)
+    ponto = ponto_de_pedido(suavizada, desvio, settings.PRAZO_REPOSICAO_DIAS)
+    alvo = ponto + math.ceil(suavizada * settings.COBERTURA_REPOSICAO_DIAS)
+    return PrevisaoDemanda(
+        produto_id=produto_id,
+        media_movel=media,
+        demanda_suavizada=suavizada,
+        desvio_padrao=desvio,
+        ponto_pedido=ponto,
+        estoque_alvo=alvo,
+        quantidade_sugerida=alvo - estoque_total if estoque_total <= ponto else 0,
+        calculado_em=calculado_em,
+    )
+
+
+def vendas_diarias(produto_ids, inicio, fim):
+    """Unidades vendidas por (produto, dia) entre os instantes inicio e fim, em ordem"""
+    return (
+        ItemPedido.objects.filter(
+            produto_id__in=produto_ids, pedido__data_criacao__gte=inicio, pedido__data_criacao__lt=fim
+        )
+        .annotate(dia=TruncDate('pedido__data_criacao'))
+        .values('produto_id', 'dia')
+        .annotate(unidades=Sum('quantidade'))
+        .order_by('produto_id', 'dia')
+    )
+
+
+def prever_demanda(dias=DIAS_HISTORICO, janela=JANELA_MEDIA_MOVEL, alfa=ALFA_SUAVIZACAO,
+                   tamanho_lote=TAMANHO_LOTE, hoje=None):
+    """
+    Recalcula as previsões de todos os produtos, um lote de produtos por vez.
+
+    'hoje' é o último dia completo considerado (padrão: ontem, no fuso
+    configurado). Produtos sem vendas no período perdem a previsão. Retorna
+    quantas previsões foram gravadas.
+    """
+    hoje = hoje or timezone.localdate() - timedelta(days=1)
+    inicio = inicio_do_dia(hoje - timedelta(days=dias - 1))
+    fim = inicio_do_dia(hoje + timedelta(days=1))
+    calculado_em = timezone.now()
+    campos = [
+        'media_movel', 'demanda_suavizada', 'desvio_padrao', 'ponto_pedido', 'estoque_alvo',
+        'quantidade_sugerida', 'calculado_em',
+    ]
+
+    gravadas = 0
+    ultimo_id = 0
+    while True:
+        estoques = dict(
+            Produto.objects.filter(id__gt=ultimo_id).order_by('id').values_list('id', 'total_estoque')[:tamanho_lote]
+        )
+        if not estoques:
+            return gravadas
+        ultimo_id = max(estoques)
+
+        previsoes = [
+            calcular_previsao(
+                produto_id, estoques[produto_id], [(linha['dia'], linha['unidades']) for linha in linhas],
+                hoje, janela, alfa, calculado_em,
+            )
+            for produto_id, linhas in groupby(
+                vendas_diarias(estoques, inicio, fim).iterator(chunk_size=2000), key=itemgetter('produto_id')
+            )
+        ]
+        with transaction.atomic():
+            PrevisaoDemanda.objects.filter(produto_id__in=estoques).exclude(
+                produto_id__in=[previsao.produto_id for previsao in previsoes]
+            ).delete()
+            PrevisaoDemanda.objects.bulk_create(
+                previsoes, update_conflicts=True, unique_fields=['produto'], update_fields=campos
+            )
+        gravadas += len(previsoes)
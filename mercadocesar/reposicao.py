@@ -0,0 +1,88 @@
+"""
+Relatório de estoque baixo (reposição).
+
+Uma única consulta parte de Produto com LEFT JOIN em Estoque, agrupada por
+produto e armazém: cada grupo abaixo do mínimo do produto (EstoqueMinimo) vira
+uma linha com a falta até o mínimo, e produtos sem nenhum registro de estoque
+aparecem uma vez, sem armazém e com quantidade 0. Produtos cujo estoque total
+chegou ao ponto de pedido previsto (PrevisaoDemanda, comando prever_demanda)
+também entram, com a compra sugerida até o estoque alvo. As linhas são lidas com
+iterator(), então o relatório é percorrido na página ou exportado em CSV sem
+carregar o catálogo inteiro na memória.
+"""
+from itertools import groupby
+from operator import itemgetter
+
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import EstoqueMinimo, Produto
+
+TAMANHO_LOTE = 2000
+
+CABECALHO_CSV = [
+    'codigo', 'descricao', 'categoria', 'armazem', 'quantidade', 'minimo', 'falta', 'estoque_total',
+    'ponto_pedido', 'comprar',
+]
+
+
+def linhas_estoque_baixo():
+    """Valores por (produto, armazém) abaixo do mínimo ou do ponto de pedido, ordenados por categoria e código"""
+    return (
+        Produto.objects.annotate(minimo=EstoqueMinimo.para())
+        .values(
+            'id', 'codigo', 'descricao', 'categoria', 'minimo', 'total_estoque', 'previsao__ponto_pedido',
+            'previsao__estoque_alvo', 'estoque__armazem_id', 'estoque__armazem__nome',
+        )
+        .annotate(quantidade=Coalesce(Sum('estoque__quantidade'), Value(0)))
+        .filter(Q(quantidade__lt=F('minimo')) | Q(total_estoque__lte=F('previsao__ponto_pedido')))
+        .annotate(
+            falta=Greatest(F('minimo') - F('quantidade'), Value(0)),
+            # Compra sugerida com o estoque atual, não o do momento da previsão
+            comprar=Case(
+                When(
+                    total_estoque__lte=F('previsao__ponto_pedido'),
+                    then=F('previsao__estoque_alvo') - F('total_estoque'),
+                ),
+                default=None,
+            ),
+        )
+        .order_by('categoria', 'codigo', 'id', 'estoque__armazem__nome', 'estoque__armazem_id')
+    )
+
+
+def produtos_estoque_baixo(linhas=None):
+    """
+    Agrupa as linhas por produto, na ordem da consulta.
+
+    Cada item traz os dados do produto, 'armazens' (as linhas do produto),
+    'falta', a soma das faltas nos armazéns, e 'ponto_pedido' e 'comprar'
+    quando há previsão de demanda.
+    """
+    linhas = linhas_estoque_baixo() if linhas is None else linhas
+    for _, grupo in groupby(linhas.iterator(chunk_size=TAMANHO_LOTE), key=itemgetter('id')):
+        armazens = list(grupo)
+        produto = armazens[0]
+        yield {
+            'id': produto['id'],
+            'codigo': produto['codigo'],
+            'descricao': produto['descricao'],
+            'categoria': produto['categoria'],
+            'minimo': produto['minimo'],
+            'total_estoque': produto['total_estoque'],
+            'ponto_pedido': produto['previsao__ponto_pedido'],
+            'comprar': produto['comprar'],
+            'armazens': armazens,
+            'falta': sum(linha['falta'] for linha in armazens),
+        }
+
+
+def linhas_csv_estoque_baixo(linhas=None):
+    """Linhas do relatório na ordem de CABECALHO_CSV, para exportacao.resposta_csv"""
+    linhas = linhas_estoque_baixo() if linhas is None else linhas
+    for linha in linhas.iterator(chunk_size=TAMANHO_LOTE):
+        yield [
+            linha['codigo'], linha['descricao'], linha['categoria'], linha['estoque__armazem__nome'] or 'Nenhum',
+            linha['quantidade'], linha['minimo'], linha['falta'], linha['total_estoque'],
+            linha['previsao__ponto_pedido'], linha['comprar'],
+        ]
@@ -12,6 +12,7 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
 import time
 
@@ -47,6 +48,25 @@ def fazer_login(driver, base_url):
     time.sleep(1)
 
 
+def primeiro_card(driver):
+    """Primeiro card do grid, ou None se o grid estiver vazio"""
+    cards = driver.find_elements(By.CSS_SELECTOR, ".all-products-grid .product-card")
+    return cards[0] if cards else None
+
+
+def esperar_resultado_busca(driver, card_anterior, timeout=10):
+    """
+    Espera a resposta da API de busca: filtros e pesquisa buscam a página por
+    fetch e substituem os cards do grid, ou exibem a mensagem de sem resultados.
+    """
+    def grid_atualizado(d):
+        if card_anterior is not None and EC.staleness_of(card_anterior)(d):
+            return True
+        return d.find_element(By.ID, "semResultados").is_displayed()
+
+    WebDriverWait(driver, timeout).until(grid_atualizado)
+
+
 def cenario_1_pesquisa_com_resultado():
     """Cenário 1: Pesquisa com resultado dentro dos filtros"""
     print("\n[Cenário 1] Pesquisa com resultado dentro dos filtros")
@@ -68,12 +88,22 @@ def cenario_1_pesquisa_com_resultado():
             return True
         
         botao_alimentos = driver.find_element(By.CSS_SELECTOR, "button[data-filter='Alimentos']")
+        card_anterior = primeiro_card(driver)
         driver.execute_script("arguments[0].click();", botao_alimentos)
-        time.sleep(1)
+        esperar_resultado_busca(driver, card_anterior)
+        
+        categorias = {
+            card.get_attribute("data-categoria").lower()
+            for card in driver.find_elements(By.CSS_SELECTOR, ".all-products-grid .product-card")
+        }
+        if categorias - {"alimentos"}:
+            print(f"[Cenário 1] FALHOU - Filtro exibiu outras categorias: {sorted(categorias)}")
+            return False
         
         barra = driver.find_element(By.ID, "barraPesquisa")
+        card_anterior = primeiro_card(driver)
         barra.send_keys("a")  
-        time.sleep(1)
+        esperar_resultado_busca(driver, card_anterior)
         
         grid_visivel = driver.find_element(By.ID, "allProductsGridContainer").is_displayed()
         
@@ -106,10 +136,13 @@ def cenario_2_pesquisa_sem_resultado():
         
         barra = driver.find_element(By.ID, "barraPesquisa")
         barra.send_keys("PRODUTOINEXISTENTEXYZ9999")
-        time.sleep(1)
         
-        mensagem = driver.find_element(By.ID, "semResultados")
-        mensagem_visivel = mensagem.is_displayed()
+        # A mensagem só aparece quando a resposta da API de busca chega
+        try:
+            wait.until(EC.visibility_of_element_located((By.ID, "semResultados")))
+            mensagem_visivel = True
+        except TimeoutException:
+            mensagem_visivel = False
         
         if mensagem_visivel:
             print("[Cenário 2] PASSOU - Mensagem 'sem resultados' exibida")
@@ -146,8 +179,9 @@ def cenario_3_pesquisa_com_detalhes_preco_estoque():
             return True
         
         barra = driver.find_element(By.ID, "barraPesquisa")
+        card_anterior = primeiro_card(driver)
         barra.send_keys("a")  
-        time.sleep(2)
+        esperar_resultado_busca(driver, card_anterior)
         
         # Buscar apenas produtos VISÍVEIS
         produtos_encontrados = [card for card in driver.find_elements(By.CSS_SELECTOR, ".product-card") if card.is_displayed()]
@@ -521,6 +521,8 @@ def cenario4_compraindevida(base_url):
         
         # IMPORTANTE: ZERAR TODO O ESTOQUE do produto em TODOS os armazéns primeiro
         total_zerado = Estoque.objects.filter(produto=produto).update(quantidade=0)
+        # update() não dispara os sinais que mantêm Produto.total_estoque
+        Produto.atualizar_estoque_total([produto.id])
         print(f"[Cenário 4] - {total_zerado} registro(s) de estoque ZERADOS para '{produto.nome}'")
         
         # Verificar estado após zerar
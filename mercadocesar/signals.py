@@ -0,0 +1,86 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .autocompletar import indice_prefixos_construido
+from .busca_aproximada import indice_aproximado_construido
+from .cache_versoes import incrementar_versao
+from .carrinho import mesclar_carrinho_sessao
+from .indice_busca import obter_indice
+from .models import Estoque, Loja, Produto
+
+
+def atualizar_total_do_estoque(estoque):
+    Produto.atualizar_estoque_total([estoque.produto_id])
+    # O UPDATE não altera instâncias carregadas; atualiza o produto em cache no próprio Estoque
+    if Estoque.produto.is_cached(estoque):
+        estoque.produto.refresh_from_db(fields=['total_estoque'])
+
+
+@receiver(post_save, sender=Estoque)
+def estoque_salvo(sender, instance, **kwargs):
+    """Mantém Produto.total_estoque após criar ou alterar um Estoque"""
+    atualizar_total_do_estoque(instance)
+
+
+@receiver(post_delete, sender=Estoque)
+def estoque_removido(sender, instance, **kwargs):
+    """Mantém Produto.total_estoque após remover um Estoque"""
+    atualizar_total_do_estoque(instance)
+
+
+def atualizar_indices(produto):
+    indice = obter_indice()
+    if indice is not None:
+        indice.atualizar(produto)
+
+    aproximado = indice_aproximado_construido()
+    if aproximado is not None:
+        aproximado.atualizar(produto)
+
+    prefixos = indice_prefixos_construido()
+    if prefixos is not None:
+        prefixos.atualizar(produto)
+
+
+def remover_dos_indices(produto_id):
+    indice = obter_indice()
+    if indice is not None:
+        indice.remover(produto_id)
+
+    aproximado = indice_aproximado_construido()
+    if aproximado is not None:
+        aproximado.remover(produto_id)
+
+    prefixos = indice_prefixos_construido()
+    if prefixos is not None:
+        prefixos.remover(produto_id)
+
+
+@receiver(post_save, sender=Produto)
+def produto_salvo_indice(sender, instance, **kwargs):
+    """Atualiza o produto nos índices de busca depois do commit, para não indexar um save desfeito"""
+    transaction.on_commit(lambda: atualizar_indices(instance))
+
+
+@receiver(post_delete, sender=Produto)
+def produto_removido_indice(sender, instance, **kwargs):
+    """Remove o produto dos índices de busca depois do commit"""
+    # O id da instância vira None após o delete
+    produto_id = instance.id
+    transaction.on_commit(lambda: remover_dos_indices(produto_id))
+
+
+@receiver([post_save, post_delete], sender=Produto)
+@receiver([post_save, post_delete], sender=Loja)
+@receiver([post_save, post_delete], sender=Estoque)
+def modelo_versionado_alterado(sender, **kwargs):
+    """Invalida os fragmentos em cache que dependem do modelo alterado"""
+    incrementar_versao(sender.__name__)
+
+
+@receiver(user_logged_in)
+def usuario_logado(sender, request, user, **kwargs):
+    """Junta o carrinho montado antes do login ao carrinho salvo do usuário"""
+    if request is not None and hasattr(request, 'session'):
+        mesclar_carrinho_sessao(request, user)
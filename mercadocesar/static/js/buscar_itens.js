@@ -1,70 +1,188 @@
 document.addEventListener('DOMContentLoaded', () => {
     const barraPesquisa = document.getElementById('barraPesquisa');
-    
-    
+
+
     if (!barraPesquisa) return;
 
-    
+
     const allProductsGridContainer = document.getElementById('allProductsGridContainer');
-    const todosProdutosTitulo = document.getElementById('todosProdutosTitulo');
-    
-    
-    const cards = document.querySelectorAll('#allProductsGridContainer .product-card');
+    const grid = allProductsGridContainer.querySelector('.product-grid');
     const semResultados = document.getElementById('semResultados');
+    const carregarMais = document.getElementById('carregarMais');
     const categoryButtons = document.querySelectorAll('.category-button');
+    const csrfInput = document.querySelector('[name=csrfmiddlewaretoken]');
+    const sugestaoBusca = document.getElementById('sugestaoBusca');
+    const sugestaoLink = document.getElementById('sugestaoLink');
+
+    const apiUrl = allProductsGridContainer.dataset.apiUrl;
+    const buscaUrl = allProductsGridContainer.dataset.buscaUrl;
+    const carrinhoUrl = allProductsGridContainer.dataset.carrinhoUrl;
+    const contadorCarrinho = document.getElementById('contadorCarrinho');
+
+    let proximoCursor = allProductsGridContainer.dataset.proximoCursor || null;
+    let requisicaoAtual = null;
+    let debounceTimer = null;
+    let sugestoesTimer = null;
+
+    const listaSugestoes = document.getElementById('sugestoesBusca');
+    const sugestoesUrl = barraPesquisa.dataset.sugestoesUrl;
 
-    
-    const showAllProductsGrid = () => {
-        // Mostrar o container principal como block para que o grid interno funcione
-        allProductsGridContainer.style.display = 'block'; 
-        todosProdutosTitulo.style.display = 'flex'; 
+    const escapeHtml = (texto) => {
+        const div = document.createElement('div');
+        div.textContent = texto == null ? '' : String(texto);
+        return div.innerHTML;
     };
 
-    const applyFilter = () => {
-        const searchTerm = barraPesquisa.value.toLowerCase().trim();
-        const activeButton = document.querySelector('.category-button.active');
-       
-        const activeCategory = activeButton ? activeButton.getAttribute('data-filter').toLowerCase() : 'all';
-        
-        showAllProductsGrid(); 
-        
-        let foundCount = 0;
-
-        cards.forEach(card => {
-            
-            const nomeElement = card.querySelector('.nomeProduto');
-            const nomeProduto = nomeElement ? nomeElement.textContent.toLowerCase() : '';
-            
-            const cardCategory = card.getAttribute('data-categoria').toLowerCase();
-
-            const matchesCategory = activeCategory === 'all' || cardCategory === activeCategory;
-
-            
-            const matchesSearch = nomeProduto.includes(searchTerm);
-
-           
-            if (matchesCategory && matchesSearch) {
-                // Não sobrescrever o display - deixar o grid funcionar
-                card.style.display = '';
-                foundCount++;
-            } else {
-                card.style.display = 'none';
+    const criarCard = (produto) => {
+        const indisponivel = !produto.disponivel;
+        const card = document.createElement('div');
+        card.className = 'product-card';
+        card.dataset.categoria = produto.categoria;
+        card.style.cssText = 'background: white; border: 2px solid #e5e7eb; border-radius: 12px; display: flex; flex-direction: column; transition: all 0.3s; box-shadow: 0 2px 8px rgba(0,0,0,0.05);'
+            + (indisponivel ? ' opacity: 0.5; filter: grayscale(50%);' : '');
+
+        if (!indisponivel) {
+            card.addEventListener('mouseover', () => {
+                card.style.borderColor = '#f0834e';
+                card.style.boxShadow = '0 4px 12px rgba(240, 131, 78, 0.2)';
+            });
+            card.addEventListener('mouseout', () => {
+                card.style.borderColor = '#e5e7eb';
+                card.style.boxShadow = '0 2px 8px rgba(0,0,0,0.05)';
+            });
+        }
+
+        const imagem = produto.imagem
+            ? `<img src="${escapeHtml(produto.imagem)}" alt="${escapeHtml(produto.nome)}" style="max-width: 100%; max-height: 100%; object-fit: contain; padding: 20px;">`
+            : '<svg xmlns="http://www.w3.org/2000/svg" style="width: 60px; height: 60px; color: #9ca3af;" fill="none" viewBox="0 0 24 24" stroke="currentColor"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M20 7l-8-4-8 4m16 0l-8 4m8-4v10l-8 4m0-10L4 7m8 4v10M4 7v10l8 4" /></svg>';
+
+        const estoque = indisponivel
+            ? '<p class="estoque" style="color: #ef4444; font-size: 0.875rem; font-weight: 600; margin-bottom: 15px;">✗ Produto indisponível (Estoque Esgotado)</p>'
+            : `<p class="estoque" style="color: #059669; font-size: 0.875rem; font-weight: 500; margin-bottom: 15px;">✓ ${produto.estoque} unidades disponíveis</p>`;
+
+        card.innerHTML = `
+            <div style="height: 200px; background: #ffffff; border-radius: 10px 10px 0 0; display: flex; align-items: center; justify-content: center; overflow: hidden;">${imagem}</div>
+            <div style="padding: 20px; display: flex; flex-direction: column; flex-grow: 1;">
+                <h3 class="nomeProduto" style="color: #1f2937; font-size: 1.125rem; font-weight: 600; margin-bottom: 12px;">${escapeHtml(produto.nome || 'Nome Ausente')}</h3>
+                <p style="color: #6b7280; font-size: 0.875rem; margin-bottom: 10px; line-height: 1.4; flex-grow: 1;">${escapeHtml(produto.descricao)}</p>
+                <p style="color: #f0834e; font-size: 1.5rem; font-weight: 700; margin: 15px 0;">R$ ${escapeHtml(produto.preco)}</p>
+                ${estoque}
+                <form method="post" action="${escapeHtml(buscaUrl)}" style="margin-top: auto;">
+                    <input type="hidden" name="csrfmiddlewaretoken" value="${escapeHtml(csrfInput ? csrfInput.value : '')}">
+                    <input type="hidden" name="produto_id" value="${produto.id}">
+                    <button type="submit" ${indisponivel ? 'disabled' : ''}
+                            style="width: 100%; padding: 12px; background-color: ${indisponivel ? '#9ca3af' : '#f0834e'}; color: white; border: none; border-radius: 8px; font-weight: 600; cursor: ${indisponivel ? 'not-allowed' : 'pointer'}; transition: background-color 0.2s;">
+                        ${indisponivel ? 'Produto Indisponível' : '+ Adicionar ao Carrinho'}
+                    </button>
+                </form>
+            </div>`;
+        return card;
+    };
+
+    const atualizarContagens = (categorias) => {
+        const totais = {};
+        categorias.forEach(faceta => { totais[faceta.categoria] = faceta.total; });
+        categoryButtons.forEach(button => {
+            const contador = button.querySelector('.category-count');
+            if (contador) {
+                contador.textContent = `(${totais[button.getAttribute('data-filter')] || 0})`;
             }
         });
+    };
 
-        
-        if (semResultados) {
-            if (foundCount === 0) {
-                semResultados.style.display = 'block';
-            } else {
-                semResultados.style.display = 'none';
-            }
-        }
+    const buscarPagina = (substituir) => {
+        const activeButton = document.querySelector('.category-button.active');
+        const activeCategory = activeButton ? activeButton.getAttribute('data-filter') : 'all';
+
+        const params = new URLSearchParams();
+        const termo = barraPesquisa.value.trim();
+        if (termo) params.set('q', termo);
+        if (activeCategory !== 'all') params.set('categoria', activeCategory);
+        if (!substituir && proximoCursor) params.set('cursor', proximoCursor);
+
+        // Cancela a busca anterior para não misturar resultados
+        if (requisicaoAtual) requisicaoAtual.abort();
+        const controller = new AbortController();
+        requisicaoAtual = controller;
+
+        return fetch(`${apiUrl}?${params.toString()}`, {
+            headers: { 'Accept': 'application/json' },
+            signal: controller.signal,
+        })
+            .then(response => response.json())
+            .then(data => {
+                if (substituir) grid.innerHTML = '';
+                data.produtos.forEach(produto => grid.appendChild(criarCard(produto)));
+
+                proximoCursor = data.proximo_cursor;
+                carregarMais.style.display = proximoCursor ? '' : 'none';
+
+                if (data.categorias) atualizarContagens(data.categorias);
+
+                if (semResultados) {
+                    semResultados.style.display = grid.children.length === 0 ? 'block' : 'none';
+                }
+
+                if (sugestaoBusca && substituir) {
+                    sugestaoLink.textContent = data.sugestao || '';
+                    sugestaoBusca.style.display = data.sugestao ? 'block' : 'none';
+                }
+            })
+            .catch(error => {
+                if (error.name !== 'AbortError') console.error('Erro na busca:', error);
+            })
+            .finally(() => {
+                if (requisicaoAtual === controller) requisicaoAtual = null;
+            });
     };
 
-    barraPesquisa.addEventListener('keyup', applyFilter);
+    const atualizarSugestoes = () => {
+        const termo = barraPesquisa.value.trim();
+        if (!listaSugestoes || !termo) return;
+
+        fetch(`${sugestoesUrl}?q=${encodeURIComponent(termo)}`, { headers: { 'Accept': 'application/json' } })
+            .then(response => response.json())
+            .then(data => {
+                listaSugestoes.innerHTML = '';
+                data.sugestoes.forEach(sugestao => {
+                    const opcao = document.createElement('option');
+                    opcao.value = sugestao.texto;
+                    if (sugestao.tipo === 'categoria') opcao.label = 'Categoria';
+                    listaSugestoes.appendChild(opcao);
+                });
+            })
+            .catch(error => console.error('Erro ao buscar sugestões:', error));
+    };
+
+    barraPesquisa.addEventListener('input', () => {
+        clearTimeout(debounceTimer);
+        debounceTimer = setTimeout(() => buscarPagina(true), 250);
+
+        clearTimeout(sugestoesTimer);
+        sugestoesTimer = setTimeout(atualizarSugestoes, 80);
+    });
+
+    carregarMais.addEventListener('click', () => buscarPagina(false));
+
+    if (sugestaoLink) {
+        sugestaoLink.addEventListener('click', (event) => {
+            event.preventDefault();
+            barraPesquisa.value = sugestaoLink.textContent;
+            buscarPagina(true);
+        });
+    }
+
+    // Carrega a próxima página automaticamente ao chegar no fim da lista
+    if ('IntersectionObserver' in window) {
+        const observer = new IntersectionObserver(entries => {
+            if (entries[0].isIntersecting && proximoCursor && !requisicaoAtual) {
+                buscarPagina(false);
+            }
+        });
+        observer.observe(carregarMais);
+    }
+
 
-   
     categoryButtons.forEach(button => {
         button.addEventListener('click', () => {
             // Remover active de todos os botões
@@ -74,7 +192,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 btn.style.color = '#374151';
                 btn.style.borderColor = '#d1d5db';
             });
-            
+
             // Adicionar active ao botão clicado
             button.classList.add('active');
             button.style.backgroundColor = '#f0834e';
@@ -82,8 +200,26 @@ document.addEventListener('DOMContentLoaded', () => {
             button.style.borderColor = '#f0834e';
 
             // Aplicar filtro
-            applyFilter();
+            buscarPagina(true);
         });
     });
 
+    // Adicionar ao carrinho pela API: atualiza só o contador, sem recarregar o catálogo
+    document.addEventListener('submit', (evento) => {
+        const form = evento.target;
+        if (!form.querySelector('[name=produto_id]') || !window.Carrinho) return;
+        evento.preventDefault();
+
+        const botao = form.querySelector('button[type=submit]');
+        botao.disabled = true;
+        Carrinho.enviar(carrinhoUrl, new FormData(form))
+            .then(dados => {
+                const total = dados.carrinho ? dados.carrinho.total_itens : 0;
+                if (contadorCarrinho) contadorCarrinho.textContent = total > 0 ? `(${total})` : '';
+                Carrinho.avisar(dados.message || dados.error, dados.success ? 'success' : 'warning');
+            })
+            .catch(() => form.submit())
+            .finally(() => { botao.disabled = false; });
+    });
+
 });
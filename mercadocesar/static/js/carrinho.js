@@ -0,0 +1,38 @@
+// Cliente da API JSON do carrinho: altera itens sem recarregar a página.
+// Os formulários continuam funcionando sem JavaScript (POST + redirect).
+window.Carrinho = (() => {
+    const formatarPreco = (valor) => 'R$ ' + Number(valor).toFixed(2).replace('.', ',');
+
+    // Envia os campos do formulário (incluindo o token CSRF) e devolve o JSON da resposta.
+    // Respostas de erro da API (409 sem estoque, 404 item removido em outra aba) também
+    // trazem JSON; falhas de rede rejeitam a promise e o chamador recorre ao envio normal.
+    const enviar = (url, dados) => fetch(url, {
+        method: 'POST',
+        body: dados,
+        headers: { 'X-Requested-With': 'XMLHttpRequest' },
+        credentials: 'same-origin',
+    }).then(resposta => resposta.json());
+
+    const avisar = (texto, tipo) => {
+        if (!texto) return;
+        let container = document.getElementById('avisosCarrinho');
+        if (!container) {
+            container = document.createElement('div');
+            container.id = 'avisosCarrinho';
+            container.style.cssText = 'position: fixed; top: 20px; right: 20px; z-index: 1100; display: flex; flex-direction: column; gap: 10px; max-width: 360px;';
+            document.body.appendChild(container);
+        }
+        const cores = {
+            success: 'background-color: #d1fae5; color: #065f46; border-left: 4px solid #10b981;',
+            error: 'background-color: #fee2e2; color: #991b1b; border-left: 4px solid #ef4444;',
+            warning: 'background-color: #fef3c7; color: #92400e; border-left: 4px solid #f59e0b;',
+        };
+        const aviso = document.createElement('div');
+        aviso.style.cssText = 'padding: 14px 18px; border-radius: 8px; font-weight: 500; box-shadow: 0 2px 8px rgba(0,0,0,0.1); ' + (cores[tipo] || cores.success);
+        aviso.textContent = texto;
+        container.appendChild(aviso);
+        setTimeout(() => aviso.remove(), 4000);
+    };
+
+    return { formatarPreco, enviar, avisar };
+})();
@@ -0,0 +1,15 @@
+from django import template
+from mercadocesar.cache_versoes import versoes_modelos
+
+register = template.Library()
+
+
+@register.simple_tag
+def versao_modelos(*nomes_modelos):
+    """
+    Versão combinada dos modelos, para usar na chave de {% cache %}:
+
+        {% versao_modelos 'Produto' 'Estoque' as versao %}
+        {% cache 86400 card_produto produto.id versao %}...{% endcache %}
+    """
+    return '-'.join(str(versao) for versao in versoes_modelos(*nomes_modelos))
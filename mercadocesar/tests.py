@@ -1,4 +1,4 @@
-from django.test import TestCase, TransactionTestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from decimal import Decimal
 from .models import Produto, Armazem, Estoque
 from django.db import IntegrityError, transaction
@@ -149,4 +149,1362 @@ class ProdutoModelTest(TestCase):
                     preco_custo=Decimal('10.00'),
                     preco_venda=None,
                     unidade_medida="unidade"
-                )  
\ No newline at end of file
+                )  
+
+class FabricaTestCase(TestCase):
+    """Base dos testes que montam produtos e estoque nos armazéns."""
+
+    def criar_produto(self, codigo, quantidades=None, **campos):
+        """
+        Cria um produto com valores padrão para os campos não informados.
+
+        'quantidades' é um dicionário {armazem: unidades} com os registros de
+        Estoque a criar para o produto.
+        """
+        dados = {
+            'nome': f"Produto {codigo}",
+            'descricao': f"Descrição {codigo}",
+            'categoria': "Bebidas",
+            'preco_custo': Decimal('1.00'),
+            'preco': Decimal('2.00'),
+            'unidade_medida': "unidade",
+        }
+        dados.update(campos)
+        produto = Produto.objects.create(codigo=codigo, **dados)
+        for armazem, quantidade in (quantidades or {}).items():
+            Estoque.objects.create(produto=produto, armazem=armazem, quantidade=quantidade)
+        return produto
+
+
+class EstoqueTotalTest(FabricaTestCase):
+    """Testes para o total de estoque mantido em Produto."""
+
+    def setUp(self):
+        self.produto = self.criar_produto("EST001", nome="Produto Estoque", descricao="Produto para teste de estoque")
+        self.armazem1 = Armazem.objects.create(nome="Armazém A")
+        self.armazem2 = Armazem.objects.create(nome="Armazém B")
+
+    def test_total_acompanha_escritas_de_estoque(self):
+        """Testa se o total é atualizado ao criar, alterar e remover estoques."""
+        estoque1 = Estoque.objects.create(produto=self.produto, armazem=self.armazem1, quantidade=10)
+        Estoque.objects.create(produto=self.produto, armazem=self.armazem2, quantidade=5)
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.estoque_total(), 15)
+
+        estoque1.quantidade = 3
+        estoque1.save()
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.estoque_total(), 8)
+
+        self.armazem2.delete()
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.estoque_total(), 3)
+
+        # O produto em cache no Estoque salvo também é atualizado
+        estoque1 = Estoque.objects.select_related('produto').get(id=estoque1.id)
+        estoque1.quantidade = 12
+        estoque1.save()
+        self.assertEqual(estoque1.produto.estoque_total(), 12)
+
+    def test_reconciliar_estoque_corrige_divergencia(self):
+        """Testa se o comando de reconciliação corrige totais divergentes."""
+        from django.core.management import call_command
+        from io import StringIO
+
+        Estoque.objects.create(produto=self.produto, armazem=self.armazem1, quantidade=99)
+        # update() em massa não dispara os sinais de Estoque
+        Estoque.objects.filter(produto=self.produto).update(quantidade=7)
+
+        call_command('reconciliar_estoque', '--dry-run', stdout=StringIO())
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.total_estoque, 99)
+
+        call_command('reconciliar_estoque', stdout=StringIO())
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.total_estoque, 7)
+
+
+class CatalogoBuscaTest(FabricaTestCase):
+    """Testes para a consulta do catálogo usada na página de busca."""
+
+    def criar_produtos(self, inicio, fim, categoria):
+        # O índice de busca é atualizado no commit da transação
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(inicio, fim):
+                self.criar_produto(f"CAT{i:03d}", {self.armazem: i}, nome=f"Produto {i}",
+                                   descricao=f"Descrição {i}", categoria=categoria)
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        # Remove os produtos criados pelas migrações de dados
+        Produto.objects.all().delete()
+        self.armazem = Armazem.objects.create(nome="Armazém Catálogo")
+        self.user = User.objects.create_user(username="cliente", password="senha-teste-123")
+        self.client.force_login(self.user)
+
+    def test_destaque_e_disponibilidade(self):
+        """Testa o destaque por categoria e a disponibilidade anotados."""
+        self.criar_produtos(0, 3, "Bebidas")
+        self.criar_produtos(3, 5, "Alimentos")
+        produtos = list(Produto.objects.catalogo())
+        destaques = [p.nome for p in produtos if p.destaque_categoria]
+        self.assertEqual(destaques, ["Produto 3", "Produto 0"])
+        self.assertFalse(next(p for p in produtos if p.nome == "Produto 0").disponivel)
+        self.assertTrue(next(p for p in produtos if p.nome == "Produto 1").disponivel)
+
+    def test_busca_com_numero_constante_de_consultas(self):
+        """Testa se a página de busca não faz consultas por produto."""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.criar_produtos(1, 3, "Bebidas")
+        with CaptureQueriesContext(connection) as poucos:
+            self.client.get('/busca/')
+
+        self.criar_produtos(3, 13, "Alimentos")
+        with CaptureQueriesContext(connection) as muitos:
+            resposta = self.client.get('/busca/')
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(len(poucos), len(muitos))
+
+    def test_fragmentos_invalidados_ao_alterar_produto(self):
+        """Testa se o card em cache é refeito quando o produto muda."""
+        self.criar_produtos(1, 2, "Bebidas")
+        self.assertContains(self.client.get('/busca/'), "R$ 2,00")
+
+        produto = Produto.objects.get(codigo="CAT001")
+        produto.preco = Decimal('4.50')
+        produto.save()
+        resposta = self.client.get('/busca/')
+        self.assertContains(resposta, "R$ 4,50")
+        self.assertNotContains(resposta, "R$ 2,00")
+
+    def test_contador_descartado_nao_revalida_fragmento_antigo(self):
+        """Testa se, após o cache descartar o contador de versão, os cards de gerações anteriores não voltam."""
+        from django.core.cache import cache
+        self.criar_produtos(1, 2, "Bebidas")
+        # Começa sem contador, como depois de um descarte
+        cache.clear()
+        self.assertContains(self.client.get('/busca/'), "R$ 2,00")
+
+        produto = Produto.objects.get(codigo="CAT001")
+        produto.preco = Decimal('4.50')
+        produto.save()
+        self.assertContains(self.client.get('/busca/'), "R$ 4,50")
+
+        cache.delete('versao_modelo:Produto')
+        resposta = self.client.get('/busca/')
+        self.assertContains(resposta, "R$ 4,50")
+        self.assertNotContains(resposta, "R$ 2,00")
+
+    def test_venda_nao_invalida_cards(self):
+        """Testa se mudar o estoque atualiza a linha de estoque sem refazer o card em cache."""
+        from django.core.cache import cache
+        cache.clear()
+        self.criar_produtos(3, 4, "Bebidas")
+        self.assertContains(self.client.get('/busca/'), "3 unidades disponíveis")
+
+        # UPDATE sem sinais: o nome novo só aparece se o card for refeito
+        Produto.objects.filter(codigo="CAT003").update(nome="Nome Novo")
+        estoque = Estoque.objects.get(produto__codigo="CAT003")
+        estoque.quantidade = 1
+        estoque.save()
+        resposta = self.client.get('/busca/')
+        self.assertContains(resposta, "1 unidades disponíveis")
+        self.assertContains(resposta, "Produto 3")
+        self.assertNotContains(resposta, "Nome Novo")
+
+    def test_disponibilidade_desconta_reservas_ativas(self):
+        """Testa se o catálogo, o card e a API mostram o estoque menos as reservas ativas."""
+        from datetime import timedelta
+        from django.contrib.auth.models import User
+        from django.core.cache import cache
+        from django.utils import timezone
+        from .models import Carrinho, ReservaEstoque
+
+        cache.clear()
+        self.criar_produtos(3, 5, "Bebidas")
+        produto3, produto4 = Produto.objects.order_by('codigo')
+        carrinho = Carrinho.objects.create(usuario=self.user)
+        agora = timezone.now()
+        ReservaEstoque.objects.create(carrinho=carrinho, produto=produto3, quantidade=3,
+                                      expira_em=agora + timedelta(minutes=10))
+        ReservaEstoque.objects.create(carrinho=carrinho, produto=produto4, quantidade=1,
+                                      expira_em=agora + timedelta(minutes=10))
+        outro = Carrinho.objects.create(usuario=User.objects.create_user(username="outro", password="x"))
+        ReservaEstoque.objects.create(carrinho=outro, produto=produto4, quantidade=2,
+                                      expira_em=agora - timedelta(minutes=1))
+
+        por_codigo = {p.codigo: p for p in Produto.objects.com_disponibilidade()}
+        self.assertEqual((por_codigo['CAT003'].estoque_livre, por_codigo['CAT003'].disponivel), (0, False))
+        self.assertEqual((por_codigo['CAT004'].estoque_livre, por_codigo['CAT004'].disponivel), (3, True))
+
+        resposta = self.client.get('/busca/')
+        self.assertContains(resposta, "3 unidades disponíveis")
+        self.assertContains(resposta, "Produto indisponível")
+        dados = {p['codigo']: p for p in self.client.get('/busca/api/').json()['produtos']}
+        self.assertEqual((dados['CAT003']['estoque'], dados['CAT003']['disponivel']), (0, False))
+        self.assertEqual((dados['CAT004']['estoque'], dados['CAT004']['disponivel']), (3, True))
+
+    def test_checkout_nao_consulta_lojas_com_fragmento_em_cache(self):
+        """Testa se a lista de lojas da retirada sai do cache sem consultar Loja."""
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import Loja
+
+        cache.clear()
+        Loja.objects.create(nome="Loja Centro", endereco="Rua B", numero="1", bairro="Centro",
+                            cidade="Recife", estado="PE", cep="50000-000")
+        self.assertContains(self.client.get('/checkout/'), "Loja Centro")
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get('/checkout/')
+        self.assertContains(resposta, "Loja Centro")
+        self.assertContains(resposta, "csrfmiddlewaretoken")
+        self.assertNotIn('mercadocesar_loja', ' '.join(q['sql'] for q in consultas))
+
+    def test_api_busca_paginada(self):
+        """Testa a paginação por cursor e as facetas da API de busca."""
+        self.criar_produtos(1, 6, "Bebidas")
+        self.criar_produtos(6, 8, "Alimentos")
+
+        resposta = self.client.get('/busca/api/', {'limite': 4})
+        dados = resposta.json()
+        self.assertEqual(len(dados['produtos']), 4)
+        self.assertEqual(dados['categorias'], [
+            {'categoria': 'Alimentos', 'total': 2},
+            {'categoria': 'Bebidas', 'total': 5},
+        ])
+
+        resposta = self.client.get('/busca/api/', {'limite': 4, 'cursor': dados['proximo_cursor']})
+        pagina2 = resposta.json()
+        self.assertEqual(len(pagina2['produtos']), 3)
+        self.assertIsNone(pagina2['proximo_cursor'])
+        self.assertNotIn('categorias', pagina2)
+
+        ids = [p['id'] for p in dados['produtos'] + pagina2['produtos']]
+        self.assertEqual(len(set(ids)), 7)
+
+        resposta = self.client.get('/busca/api/', {'q': 'cat00', 'categoria': 'bebidas'})
+        self.assertEqual([p['codigo'] for p in resposta.json()['produtos']], ['CAT001', 'CAT002', 'CAT003', 'CAT004', 'CAT005'])
+
+    def test_api_busca_ignora_cursor_malformado(self):
+        """Testa se cursores com tipos errados voltam à primeira página em vez de gerar erro."""
+        import base64
+        import json
+
+        self.criar_produtos(1, 4, "Bebidas")
+        primeira = self.client.get('/busca/api/', {'limite': 2}).json()['produtos']
+        for valores in (["a", "x"], ["", "1; drop"], ["Bebidas", True], [1, 2], "nao-lista"):
+            cursor = base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+            with self.subTest(cursor=valores):
+                resposta = self.client.get('/busca/api/', {'limite': 2, 'cursor': cursor})
+                self.assertEqual(resposta.status_code, 200)
+                self.assertEqual(resposta.json()['produtos'], primeira)
+        resposta = self.client.get('/busca/api/', {'q': 'cat', 'cursor': base64.urlsafe_b64encode(b'["x", 1]').decode()})
+        self.assertEqual(resposta.status_code, 200)
+
+
+class IndiceBuscaTest(FabricaTestCase):
+    """Testes para o índice de busca textual de produtos."""
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Produto.objects.all().delete()
+            self.cafe = self.criar_produto(
+                "COR-001", nome="Café Tradicional", descricao="Café torrado e moído 3 Corações",
+                preco_custo=Decimal('5.00'), preco=Decimal('9.90'), unidade_medida="pacote"
+            )
+            self.feijao = self.criar_produto(
+                "FEI-001", nome="Feijão Preto", descricao="Feijões pretos tipo 1", categoria="Alimentos",
+                preco_custo=Decimal('4.00'), preco=Decimal('7.50'), unidade_medida="kg"
+            )
+
+    def test_busca_sem_acentos_e_com_plural(self):
+        """Testa se a busca ignora acentos e variações de plural."""
+        from .indice_busca import buscar_produtos
+        self.assertEqual(list(buscar_produtos("cafe")), [self.cafe])
+        self.assertEqual(list(buscar_produtos("coracao")), [self.cafe])
+        self.assertEqual(list(buscar_produtos("feijoes")), [self.feijao])
+        self.assertEqual(list(buscar_produtos("fei-0")), [self.feijao])
+
+    def test_indice_acompanha_alteracoes(self):
+        """Testa se o índice é atualizado ao editar e remover produtos."""
+        from .indice_busca import buscar_produtos
+        self.cafe.nome = "Café Extra Forte"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cafe.save()
+        self.assertEqual(list(buscar_produtos("forte")), [self.cafe])
+        self.assertEqual(list(buscar_produtos("tradicional")), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.feijao.delete()
+        self.assertEqual(list(buscar_produtos("feijao")), [])
+
+    def test_indice_ignora_alteracao_desfeita(self):
+        """Testa se um save desfeito pelo rollback não chega aos índices."""
+        from django.db import IntegrityError, transaction
+        from .indice_busca import buscar_produtos
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.cafe.nome = "Café Descafeinado"
+                    self.cafe.save()
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(list(buscar_produtos("descafeinado")), [])
+
+    def test_busca_paginada_por_relevancia(self):
+        """Testa se as páginas da busca seguem a relevância do índice sem repetir produtos."""
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, (nome, descricao) in enumerate([
+                ("Biscoito Doce", "Biscoito com arroz"),
+                ("Arroz Branco", "Tipo 1"),
+                ("Farinha", "Farinha de arroz"),
+                ("Arroz Integral", "Arroz integral tipo 1"),
+            ]):
+                self.criar_produto(f"ARR-{i}", nome=nome, descricao=descricao, categoria="Alimentos",
+                                   unidade_medida="kg")
+
+        codigos = []
+        cursor = None
+        while True:
+            parametros = {'q': 'arroz', 'limite': 1}
+            if cursor:
+                parametros['cursor'] = cursor
+            dados = self.client.get('/busca/api/', parametros).json()
+            codigos += [p['codigo'] for p in dados['produtos']]
+            cursor = dados['proximo_cursor']
+            if cursor is None:
+                break
+
+        dados = self.client.get('/busca/api/', {'q': 'arroz'}).json()
+        self.assertEqual(codigos, [p['codigo'] for p in dados['produtos']])
+        # Nome pesa mais que descrição
+        self.assertEqual(set(codigos[:2]), {"ARR-1", "ARR-3"})
+        self.assertEqual(dados['categorias'], [{'categoria': 'Alimentos', 'total': 4}])
+
+    def test_sugestao_para_termo_com_erro(self):
+        """Testa a sugestão de "você quis dizer" para termos digitados errado."""
+        from .busca_aproximada import sugerir_termo
+        self.assertEqual(sugerir_termo("fejao pretto"), "feijao preto")
+        self.assertEqual(sugerir_termo("tradicionl"), "tradicional")
+        self.assertIsNone(sugerir_termo("feijao"))
+
+    def test_indice_antigo_reconstruido_uma_vez(self):
+        """Testa se o índice antigo segue em uso enquanto uma única reconstrução roda."""
+        import threading
+        import time
+        from types import SimpleNamespace
+        from .indices_memoria import ReconstrucaoIndice
+
+        liberar = threading.Event()
+        cargas = []
+
+        def carregar(indice):
+            cargas.append(indice.construido_em)
+            if indice.construido_em is not None:
+                liberar.wait(5)
+            indice.construido_em = time.monotonic()
+
+        reconstrucao = ReconstrucaoIndice(SimpleNamespace(construido_em=None), carregar, idade_maxima=60)
+        indice = reconstrucao.obter()
+        indice.construido_em -= 120
+        antigo = indice.construido_em
+        for _ in range(5):
+            self.assertIs(reconstrucao.obter(), indice)
+            self.assertEqual(indice.construido_em, antigo)
+
+        liberar.set()
+        limite = time.monotonic() + 5
+        while indice.construido_em == antigo and time.monotonic() < limite:
+            time.sleep(0.01)
+        self.assertGreater(indice.construido_em, antigo)
+        self.assertEqual(len(cargas), 2)
+
+    def test_autocompletar_por_prefixo(self):
+        """Testa as sugestões por prefixo de nome, código e categoria."""
+        from .autocompletar import obter_indice_prefixos
+        indice = obter_indice_prefixos()
+        self.assertEqual([s['texto'] for s in indice.sugerir("pre")], ["Feijão Preto"])
+        self.assertEqual([s['texto'] for s in indice.sugerir("cor-0")], ["Café Tradicional"])
+        self.assertEqual(indice.sugerir("beb"), [{'texto': 'Bebidas', 'tipo': 'categoria'}])
+
+        self.feijao.nome = "Feijão Carioca"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.feijao.save()
+        self.assertEqual(indice.sugerir("pre"), [])
+        self.assertEqual([s['texto'] for s in indice.sugerir("carioca")], ["Feijão Carioca"])
+
+    def test_autocompletar_mais_vendidos_de_prefixo_comum(self):
+        """Testa se o mais vendido aparece mesmo quando muitas chaves têm o mesmo prefixo."""
+        from types import SimpleNamespace
+        from .autocompletar import IndicePrefixos
+
+        produtos = [
+            SimpleNamespace(id=i, nome=f"Arroz {i:04d}", codigo=f"ARZ{i:04d}", categoria="Alimentos")
+            for i in range(1, 3001)
+        ]
+        indice = IndicePrefixos()
+        indice.construir(produtos, {3000: 50, 2999: 40, 5: 30})
+        self.assertEqual([s['id'] for s in indice.sugerir("arr", limite=3)], [3000, 2999, 5])
+        self.assertEqual([s['id'] for s in indice.sugerir("arroz 2", limite=2)], [2999, 2000])
+
+        indice.remover(3000)
+        indice.atualizar(SimpleNamespace(id=3001, nome="Arroz Integral", codigo="ARZ3001", categoria="Alimentos"))
+        self.assertEqual([s['id'] for s in indice.sugerir("arr", limite=3)], [2999, 5, 1])
+        self.assertEqual([s['id'] for s in indice.sugerir("arroz i")], [3001])
+
+    def test_autocompletar_rapido_com_catalogo_grande(self):
+        """Testa se o p99 das sugestões fica abaixo de 5 ms com 100 mil produtos."""
+        import random
+        import time
+        from types import SimpleNamespace
+        from .autocompletar import IndicePrefixos
+
+        aleatorio = random.Random(7)
+        tipos = ["Arroz", "Feijão", "Café", "Leite", "Refrigerante", "Sabão", "Biscoito", "Macarrão", "Suco"]
+        marcas = ["Camil", "Pilão", "Ypê", "Omo", "Italac", "Nestlé", "Sadia", "Melitta"]
+        produtos = [
+            SimpleNamespace(
+                id=i, nome=f"{aleatorio.choice(tipos)} {aleatorio.choice(marcas)} {aleatorio.randint(1, 2000)}g",
+                codigo=f"P{i:06d}", categoria=aleatorio.choice(["Bebidas", "Alimentos", "Limpeza"]),
+            )
+            for i in range(1, 100001)
+        ]
+        indice = IndicePrefixos()
+        indice.construir(produtos, {i: aleatorio.randint(0, 5000) for i in range(1, 100001)})
+
+        tempos = []
+        for produto in aleatorio.sample(produtos, 500):
+            for tamanho in range(1, 12):
+                inicio = time.perf_counter()
+                indice.sugerir(produto.nome[:tamanho])
+                tempos.append(time.perf_counter() - inicio)
+        tempos.sort()
+        self.assertLess(tempos[int(len(tempos) * 0.99)], 0.005)
+
+
+class PaginaInicialTest(FabricaTestCase):
+    """Testes para os mais vendidos da página inicial."""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from django.core.cache import cache
+        cache.clear()
+        Produto.objects.all().delete()
+        self.produtos = [
+            self.criar_produto(f"HOME{i}", nome=f"Produto {i}", descricao=f"Produto da home {i}", preco=Decimal('3.00'))
+            for i in range(4)
+        ]
+        self.client.force_login(User.objects.create_user(username="home", password="senha-teste-123"))
+
+    def test_registrar_vendas_acumula_totais(self):
+        """Testa se os totais vendidos são somados a cada pedido."""
+        from .models import VendaProduto
+        VendaProduto.registrar({self.produtos[0].id: 2, self.produtos[1].id: 5})
+        VendaProduto.registrar({self.produtos[0].id: 4})
+        totais = dict(VendaProduto.objects.values_list('produto_id', 'total_vendido'))
+        self.assertEqual(totais, {self.produtos[0].id: 6, self.produtos[1].id: 5})
+
+    def test_pagina_inicial_servida_do_cache(self):
+        """Testa se a segunda visita à página inicial não consulta produtos nem lojas."""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import VendaProduto
+
+        VendaProduto.registrar({self.produtos[2].id: 9, self.produtos[3].id: 1})
+        resposta = self.client.get('/')
+        self.assertEqual([p['nome'] for p in resposta.context['produtos_destaque']], ["Produto 2", "Produto 3"])
+
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get('/')
+        tabelas = ' '.join(q['sql'] for q in consultas)
+        self.assertNotIn('mercadocesar_produto', tabelas)
+        self.assertNotIn('mercadocesar_loja', tabelas)
+
+
+class CacheCompartilhadoTest(TestCase):
+    """Testes para a proteção contra recálculos simultâneos do cache."""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.chamadas = 0
+
+    def calcular(self):
+        self.chamadas += 1
+        return f"valor {self.chamadas}"
+
+    def test_valor_calculado_uma_vez(self):
+        """Testa se o valor é calculado apenas na primeira leitura."""
+        from .cache_compartilhado import obter_ou_calcular
+        self.assertEqual(obter_ou_calcular('teste:chave', self.calcular, 60), "valor 1")
+        self.assertEqual(obter_ou_calcular('teste:chave', self.calcular, 60), "valor 1")
+        self.assertEqual(self.chamadas, 1)
+
+    def test_valor_velho_servido_durante_recalculo(self):
+        """Testa se outro worker recebe o valor velho enquanto a trava está com alguém."""
+        import time
+        from django.core.cache import cache
+        from .cache_compartilhado import obter_ou_calcular
+
+        cache.set('teste:chave', ("velho", time.time() - 1, 0.01, []), 120)
+        cache.add('teste:chave:recalculando', 1, 30)
+        self.assertEqual(obter_ou_calcular('teste:chave', self.calcular, 60), "velho")
+        self.assertEqual(self.chamadas, 0)
+
+        cache.delete('teste:chave:recalculando')
+        self.assertEqual(obter_ou_calcular('teste:chave', self.calcular, 60), "valor 1")
+        self.assertEqual(obter_ou_calcular('teste:chave', self.calcular, 60), "valor 1")
+
+    def test_valor_versionado_lido_em_uma_ida_ao_cache(self):
+        """Testa se valor e versões vêm numa só leitura e se mudar a versão recalcula."""
+        from unittest import mock
+        from django.core.cache import cache
+        from .cache_compartilhado import obter_ou_calcular
+        from .cache_versoes import incrementar_versao
+
+        self.assertEqual(obter_ou_calcular('teste:chave', self.calcular, 60, modelos=('Produto',)), "valor 1")
+        espiao = mock.Mock(wraps=cache)
+        with mock.patch('mercadocesar.cache_compartilhado.cache', espiao), \
+                mock.patch('mercadocesar.cache_versoes.cache', espiao):
+            self.assertEqual(obter_ou_calcular('teste:chave', self.calcular, 60, modelos=('Produto',)), "valor 1")
+        self.assertEqual([nome for nome, _, _ in espiao.method_calls], ['get_many'])
+
+        incrementar_versao('Produto')
+        self.assertEqual(obter_ou_calcular('teste:chave', self.calcular, 60, modelos=('Produto',)), "valor 2")
+
+
+class FinalizarPedidoTest(FabricaTestCase):
+    """Testes para a baixa de estoque ao finalizar pedidos."""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import Carrinho, CartaoCredito, ItemCarrinho
+
+        self.usuario = User.objects.create_user(username="comprador", password="senha-teste-123")
+        self.cartao = CartaoCredito.objects.create(
+            usuario=self.usuario, bandeira="Visa", ultimos_4_digitos="1234", mes_validade=12, ano_validade=2030
+        )
+        self.armazem1 = Armazem.objects.create(nome="Armazém A")
+        self.armazem2 = Armazem.objects.create(nome="Armazém B")
+        self.produtos = [
+            self.criar_produto("PED0", {self.armazem1: 4, self.armazem2: 6}, nome="Produto 0",
+                               descricao="Produto do pedido 0", preco=Decimal('2.50')),
+            self.criar_produto("PED1", {self.armazem1: 2}, nome="Produto 1",
+                               descricao="Produto do pedido 1", preco=Decimal('2.50')),
+        ]
+
+        self.carrinho = Carrinho.objects.create(usuario=self.usuario)
+        ItemCarrinho.objects.create(carrinho=self.carrinho, produto=self.produtos[0], quantidade=8)
+        ItemCarrinho.objects.create(carrinho=self.carrinho, produto=self.produtos[1], quantidade=2)
+        self.client.force_login(self.usuario)
+
+    def finalizar(self):
+        sessao = self.client.session
+        sessao['pedido_temp'] = {
+            'tipo_entrega': 'DOMICILIO', 'cep': '50000-000', 'endereco': 'Rua A', 'numero': '10',
+            'bairro': 'Centro', 'cidade': 'Recife', 'estado': 'PE', 'custo_entrega': '5.00', 'prazo_dias': 2,
+        }
+        sessao.save()
+        return self.client.post('/checkout/finalizar/', {'cartao_id': self.cartao.id})
+
+    def quantidades(self, produto):
+        return sorted(Estoque.objects.filter(produto=produto).values_list('quantidade', flat=True))
+
+    def test_baixa_estoque_prioriza_armazem_com_mais_unidades(self):
+        """Testa se o pedido debita os armazéns e atualiza o total do produto."""
+        from .models import Pedido
+
+        resposta = self.finalizar()
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(Pedido.objects.count(), 1)
+        self.assertEqual(self.quantidades(self.produtos[0]), [0, 2])
+        self.assertEqual(self.quantidades(self.produtos[1]), [0])
+        self.produtos[0].refresh_from_db()
+        self.assertEqual(self.produtos[0].total_estoque, 2)
+        self.carrinho.refresh_from_db()
+        self.assertFalse(self.carrinho.ativo)
+
+    def test_falha_nos_totais_vendidos_nao_afeta_pedido(self):
+        """Testa se um erro ao somar os totais vendidos após o commit só é registrado no log."""
+        from unittest import mock
+        from django.db import DatabaseError
+        from .models import Pedido, VendaProduto
+
+        with mock.patch.object(VendaProduto, 'registrar', side_effect=DatabaseError("bloqueio")), \
+                self.assertLogs('mercadocesar.views', 'ERROR'), \
+                self.captureOnCommitCallbacks(execute=True):
+            resposta = self.finalizar()
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(Pedido.objects.count(), 1)
+
+    def test_totais_do_historico_sem_percorrer_itens(self):
+        """Testa se o subtotal é gravado ao finalizar e o histórico não consulta itens por pedido."""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import Pedido
+
+        self.finalizar()
+        pedido = Pedido.objects.get()
+        self.assertEqual(pedido.subtotal_produtos, Decimal('25.00'))
+        with self.assertNumQueries(0):
+            self.assertEqual(pedido.calcular_total(), Decimal('30.00'))
+
+        with CaptureQueriesContext(connection) as um_pedido:
+            self.client.get('/recentes/')
+        for _ in range(3):
+            Pedido.objects.create(
+                usuario=self.usuario, tipo_entrega='DOMICILIO', custo_entrega=Decimal('5.00'), prazo_dias=2,
+                subtotal_produtos=Decimal('1.00'),
+            )
+        with CaptureQueriesContext(connection) as varios:
+            resposta = self.client.get('/recentes/')
+        self.assertContains(resposta, "30,00")
+        self.assertEqual(len(um_pedido), len(varios))
+
+    def test_estoque_insuficiente_nao_altera_nada(self):
+        """Testa se a falta de um produto cancela o pedido inteiro."""
+        from .estoque import EstoqueInsuficiente, baixar_estoque
+        from .models import Pedido
+
+        Estoque.objects.filter(produto=self.produtos[1]).update(quantidade=1)
+        resposta = self.finalizar()
+        self.assertRedirects(resposta, '/checkout/', fetch_redirect_response=False)
+        self.assertEqual(Pedido.objects.count(), 0)
+        self.assertEqual(self.quantidades(self.produtos[0]), [4, 6])
+        self.carrinho.refresh_from_db()
+        self.assertTrue(self.carrinho.ativo)
+
+        with self.assertRaises(EstoqueInsuficiente) as contexto:
+            baixar_estoque({self.produtos[0].id: 11})
+        self.assertEqual(contexto.exception.faltas, [(self.produtos[0], 10, 11)])
+
+    def test_consultas_constantes_no_tamanho_do_carrinho(self):
+        """Testa se finalizar um carrinho grande não faz consultas por item."""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import ItemCarrinho, ItemPedido
+
+        with CaptureQueriesContext(connection) as pequeno:
+            self.finalizar()
+
+        self.carrinho.ativo = True
+        self.carrinho.save()
+        for i in range(2, 40):
+            produto = self.criar_produto(f"PED{i}", {self.armazem1: 3, self.armazem2: 3}, nome=f"Produto {i}",
+                                         descricao=f"Item de atacarejo {i}", preco=Decimal('2.50'))
+            ItemCarrinho.objects.create(carrinho=self.carrinho, produto=produto, quantidade=4)
+        ItemCarrinho.objects.filter(produto__in=self.produtos).delete()
+
+        with CaptureQueriesContext(connection) as grande:
+            self.finalizar()
+
+        self.assertEqual(ItemPedido.objects.count(), 2 + 38)
+        self.assertEqual(len(pequeno), len(grande))
+
+    def test_envio_repetido_devolve_o_mesmo_pedido(self):
+        """Testa se um segundo envio com a mesma chave não cria outro pedido nem baixa estoque de novo."""
+        from .models import Loja, Pedido
+
+        loja = Loja.objects.create(nome="Loja Centro", endereco="Rua B", numero="1", bairro="Centro",
+                                   cidade="Recife", estado="PE", cep="50000-000")
+        revisao = self.client.post('/checkout/retirada/', {'loja_id': loja.id})
+        chave = revisao.context['chave_idempotencia']
+        self.assertContains(revisao, f'value="{chave}"')
+
+        dados = {'cartao_id': self.cartao.id, 'chave_idempotencia': chave}
+        primeira = self.client.post('/checkout/finalizar/', dados)
+        segunda = self.client.post('/checkout/finalizar/', dados)
+
+        self.assertEqual(Pedido.objects.count(), 1)
+        self.assertEqual(primeira.context['pedido'].id, segunda.context['pedido'].id)
+        self.assertEqual(self.quantidades(self.produtos[0]), [0, 2])
+
+    def test_chave_de_pedido_de_outro_usuario(self):
+        """Testa se uma chave já usada por outro usuário volta ao checkout com mensagem, sem erro 500."""
+        from django.contrib.auth.models import User
+        from django.contrib.messages import get_messages
+        from .models import Loja, Pedido
+
+        loja = Loja.objects.create(nome="Loja Centro", endereco="Rua B", numero="1", bairro="Centro",
+                                   cidade="Recife", estado="PE", cep="50000-000")
+        self.client.post('/checkout/retirada/', {'loja_id': loja.id})
+        outro = User.objects.create_user(username="outro", password="senha-teste-123")
+        Pedido.objects.create(usuario=outro, tipo_entrega='RETIRADA', loja=loja, prazo_dias=1,
+                              chave_idempotencia="chave-de-outro")
+
+        resposta = self.client.post('/checkout/finalizar/', {'cartao_id': self.cartao.id,
+                                                             'chave_idempotencia': "chave-de-outro"})
+
+        self.assertRedirects(resposta, '/checkout/', fetch_redirect_response=False)
+        self.assertIn("Não foi possível finalizar o pedido. Tente novamente.",
+                      [str(m) for m in get_messages(resposta.wsgi_request)])
+        self.assertEqual(Pedido.objects.count(), 1)
+        self.assertEqual(self.quantidades(self.produtos[0]), [4, 6])
+
+    def test_reserva_na_revisao_bloqueia_outros_carrinhos(self):
+        """Testa se a revisão reserva o estoque, descontado de outros carrinhos e consumido ao finalizar."""
+        from django.contrib.auth.models import User
+        from .estoque import EstoqueInsuficiente, reservar_carrinho
+        from .models import Carrinho, Loja, ReservaEstoque
+
+        loja = Loja.objects.create(nome="Loja Centro", endereco="Rua B", numero="1", bairro="Centro",
+                                   cidade="Recife", estado="PE", cep="50000-000")
+        resposta = self.client.post('/checkout/retirada/', {'loja_id': loja.id})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIsNotNone(resposta.context['reserva_expira_em'])
+        self.assertEqual(ReservaEstoque.reservado(self.produtos[0].id), 8)
+
+        outro = Carrinho.objects.create(usuario=User.objects.create_user(username="outro", password="senha-123-x"))
+        self.produtos[0].refresh_from_db()
+        self.assertEqual(self.produtos[0].estoque_disponivel(carrinho=outro), 2)
+        with self.assertRaises(EstoqueInsuficiente):
+            reservar_carrinho(outro, {self.produtos[0].id: 3})
+
+        resposta = self.client.post('/checkout/finalizar/', {'cartao_id': self.cartao.id})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertFalse(ReservaEstoque.objects.exists())
+        self.assertIsNotNone(reservar_carrinho(outro, {self.produtos[0].id: 2}))
+
+    def test_reservas_expiradas_sao_ignoradas_e_removidas(self):
+        """Testa se reservas vencidas não contam e são apagadas pelo comando."""
+        from datetime import timedelta
+        from django.core.management import call_command
+        from django.utils import timezone
+        from io import StringIO
+        from .models import ReservaEstoque
+
+        ReservaEstoque.objects.create(carrinho=self.carrinho, produto=self.produtos[0], quantidade=10,
+                                      expira_em=timezone.now() - timedelta(minutes=1))
+        self.produtos[0].refresh_from_db()
+        self.assertEqual(self.produtos[0].estoque_disponivel(), 10)
+
+        call_command('expirar_reservas', stdout=StringIO())
+        self.assertFalse(ReservaEstoque.objects.exists())
+
+
+class AlocacaoEstoqueTest(FabricaTestCase):
+    """Testes para as estratégias de alocação de estoque entre armazéns."""
+
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        self.armazem_norte = Armazem.objects.create(nome="Norte", cep="50000-000")
+        self.armazem_sul = Armazem.objects.create(nome="Sul", cep="90000-000")
+        self.armazem_central = Armazem.objects.create(nome="Central", cep="")
+        self.produtos = [
+            self.criar_produto(f"ALO{i}", nome=f"Produto {i}", descricao=f"Produto de alocação {i}")
+            for i in range(2)
+        ]
+        agora = timezone.now()
+        # Central tem mais unidades do produto 0, mas Norte e Sul têm os dois produtos
+        Estoque.objects.create(produto=self.produtos[0], armazem=self.armazem_central, quantidade=20,
+                               reabastecido_em=agora)
+        Estoque.objects.create(produto=self.produtos[0], armazem=self.armazem_sul, quantidade=5,
+                               reabastecido_em=agora - timedelta(days=3))
+        Estoque.objects.create(produto=self.produtos[0], armazem=self.armazem_norte, quantidade=5,
+                               reabastecido_em=agora - timedelta(days=1))
+        Estoque.objects.create(produto=self.produtos[1], armazem=self.armazem_norte, quantidade=20)
+        Estoque.objects.create(produto=self.produtos[1], armazem=self.armazem_sul, quantidade=5)
+
+    def origens(self, estrategia, quantidades, cep_destino=None):
+        from .alocacao import planejar_alocacao
+        plano = planejar_alocacao(quantidades, estrategia, cep_destino=cep_destino)
+        return {
+            produto_id: [(estoque.armazem.nome, unidades) for estoque, unidades in linhas]
+            for produto_id, linhas in plano.retiradas.items()
+        }
+
+    def test_estrategias_escolhem_armazens_diferentes(self):
+        """Testa a ordem de retirada de cada estratégia para a mesma cesta."""
+        p0, p1 = self.produtos[0].id, self.produtos[1].id
+        cesta = {p0: 4, p1: 3}
+        self.assertEqual(self.origens('maior_estoque', cesta), {p0: [("Central", 4)], p1: [("Norte", 3)]})
+        self.assertEqual(self.origens('menos_armazens', cesta), {p0: [("Norte", 4)], p1: [("Norte", 3)]})
+        self.assertEqual(self.origens('mais_proximo', cesta, "91000-000"), {p0: [("Sul", 4)], p1: [("Sul", 3)]})
+        self.assertEqual(self.origens('fifo', {p0: 7}), {p0: [("Sul", 5), ("Norte", 2)]})
+
+    def test_transferencia_e_simulacao(self):
+        """Testa a transferência entre armazéns e o comando de simulação."""
+        from django.core.management import call_command
+        from io import StringIO
+        from .estoque import transferir_estoque
+
+        transferir_estoque(self.produtos[0].id, self.armazem_norte, 8)
+        quantidades = dict(
+            Estoque.objects.filter(produto=self.produtos[0]).values_list('armazem__nome', 'quantidade')
+        )
+        # Sem CEP, o Central é o último candidato; o Sul (mais próximo do Norte) sai primeiro
+        self.assertEqual(quantidades, {"Central": 17, "Sul": 0, "Norte": 13})
+
+        saida = StringIO()
+        call_command('simular_alocacao', '--sinteticos', '--pedidos', '5', '--itens', '2', stdout=saida)
+        for nome in ("maior_estoque", "menos_armazens", "mais_proximo", "fifo"):
+            self.assertIn(nome, saida.getvalue())
+
+        for quantidade in (0, -3):
+            with self.subTest(quantidade=quantidade), self.assertRaises(ValueError):
+                transferir_estoque(self.produtos[0].id, self.armazem_norte, quantidade)
+
+    def test_edicao_de_armazem_transfere_pela_alocacao(self):
+        """Testa se mudar o armazém de um estoque na tela de edição transfere as unidades para o destino."""
+        from django.contrib.auth.models import User
+
+        self.client.force_login(User.objects.create_user(username="gerente", password="senha-teste-123", is_staff=True))
+        estoque_sul = Estoque.objects.get(produto=self.produtos[0], armazem=self.armazem_sul)
+        resposta = self.client.post(
+            f'/estoque/?action=edit&id={estoque_sul.id}', {'quantidade': 4, 'armazem': self.armazem_norte.id}
+        )
+        self.assertRedirects(resposta, '/estoque/', fetch_redirect_response=False)
+
+        quantidades = dict(
+            Estoque.objects.filter(produto=self.produtos[0]).values_list('armazem__nome', 'quantidade')
+        )
+        self.assertEqual(quantidades, {"Central": 20, "Norte": 9})
+        self.produtos[0].refresh_from_db()
+        self.assertEqual(self.produtos[0].total_estoque, 29)
+
+
+class CarrinhoQuantidadeTest(FabricaTestCase):
+    """Testes para as alterações condicionais de quantidade no carrinho."""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import Carrinho
+
+        self.usuario = User.objects.create_user(username="carrinho", password="senha-teste-123")
+        self.produto = self.criar_produto("CAR001", {Armazem.objects.create(nome="A"): 3},
+                                          nome="Produto Carrinho", descricao="Produto do carrinho")
+        self.carrinho = Carrinho.objects.create(usuario=self.usuario)
+        self.client.force_login(self.usuario)
+
+    def test_adicionar_respeita_estoque(self):
+        """Testa se cliques repetidos em adicionar param no estoque disponível."""
+        from .models import ItemCarrinho
+
+        for _ in range(5):
+            self.client.post('/busca/', {'produto_id': self.produto.id})
+        self.assertEqual(ItemCarrinho.objects.get(carrinho=self.carrinho).quantidade, 3)
+
+    def test_incremento_em_uma_instrucao(self):
+        """Testa se aumentar e diminuir usam o número de linhas afetadas, sem ler o item."""
+        from .carrinho import decrementar_item, incrementar_item
+        from .models import ItemCarrinho
+
+        item = ItemCarrinho.objects.create(carrinho=self.carrinho, produto=self.produto, quantidade=2)
+        itens = ItemCarrinho.objects.filter(id=item.id)
+        # Um UPDATE no item e outro nos totais do carrinho
+        with self.assertNumQueries(2):
+            self.assertTrue(incrementar_item(itens))
+        self.assertFalse(incrementar_item(itens))
+
+        self.assertEqual(decrementar_item(itens, 2), 'reduzido')
+        self.assertEqual(decrementar_item(itens), 'removido')
+        self.assertIsNone(decrementar_item(itens))
+
+        resposta = self.client.post(f'/carrinho/atualizar/{item.id}/', {'acao': 'aumentar'})
+        self.assertRedirects(resposta, '/checkout/', fetch_redirect_response=False)
+
+    def test_totais_mantidos_e_revalidados(self):
+        """Testa se os totais do carrinho acompanham os itens e são revalidados após mudança de preço."""
+        from .carrinho import adicionar_produto, decrementar_item, definir_quantidade
+        from .models import Carrinho, ItemCarrinho
+
+        adicionar_produto(self.carrinho, self.produto.id)
+        adicionar_produto(self.carrinho, self.produto.id)
+        itens = ItemCarrinho.objects.filter(carrinho=self.carrinho)
+        definir_quantidade(itens, 3)
+        decrementar_item(itens)
+        self.carrinho.refresh_from_db()
+        self.assertEqual((self.carrinho.total_itens, self.carrinho.subtotal), (2, Decimal('4.00')))
+
+        self.produto.preco = Decimal('5.00')
+        self.produto.save()
+        carrinho = Carrinho.objects.com_totais_atuais().get(id=self.carrinho.id)
+        self.assertTrue(carrinho.revalidar_totais())
+        self.carrinho.refresh_from_db()
+        self.assertEqual(self.carrinho.subtotal, Decimal('10.00'))
+
+        decrementar_item(itens, 5)
+        self.carrinho.refresh_from_db()
+        self.assertEqual((self.carrinho.total_itens, self.carrinho.subtotal), (0, Decimal('0.00')))
+
+    def test_api_json_do_carrinho(self):
+        """Testa se a API do carrinho devolve só a linha alterada e os totais."""
+        from .models import ItemCarrinho
+
+        resposta = self.client.post('/carrinho/api/adicionar/', {'produto_id': self.produto.id})
+        dados = resposta.json()
+        self.assertEqual(dados['item']['quantidade'], 1)
+        self.assertEqual(dados['carrinho'], {'total_itens': 1, 'subtotal': '2.00'})
+
+        item = ItemCarrinho.objects.get(carrinho=self.carrinho)
+        resposta = self.client.post(f'/carrinho/api/itens/{item.id}/', {'quantidade': 5})
+        self.assertEqual(resposta.status_code, 409)
+        self.assertEqual(resposta.json()['item']['disponivel'], 3)
+
+        dados = self.client.post(f'/carrinho/api/itens/{item.id}/', {'quantidade': 3}).json()
+        self.assertEqual(dados['carrinho'], {'total_itens': 3, 'subtotal': '6.00'})
+        dados = self.client.post(f'/carrinho/api/itens/{item.id}/', {'acao': 'diminuir'}).json()
+        self.assertEqual(dados['item']['subtotal'], '4.00')
+
+        dados = self.client.post(f'/carrinho/api/itens/{item.id}/remover/').json()
+        self.assertTrue(dados['removido'])
+        self.assertEqual(self.client.get('/carrinho/api/').json()['carrinho']['total_itens'], 0)
+
+
+class CarrinhoSessaoTest(FabricaTestCase):
+    """Testes para o carrinho guardado na sessão durante a navegação."""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.usuario = User.objects.create_user(username="visitante", password="senha-teste-123")
+        self.produto = self.criar_produto("SES001", {Armazem.objects.create(nome="A"): 3},
+                                          nome="Produto Sessao", descricao="Produto da sessão")
+
+    def test_navegacao_sem_gravar_no_banco(self):
+        """Testa se visitantes montam o carrinho na sessão e o checkout o persiste."""
+        from .models import Carrinho, ItemCarrinho
+
+        for _ in range(2):
+            resposta = self.client.post('/carrinho/api/adicionar/', {'produto_id': self.produto.id})
+        self.assertEqual(resposta.json()['carrinho'], {'total_itens': 2, 'subtotal': '4.00'})
+        self.assertFalse(Carrinho.objects.exists())
+
+        # Sem carrinho salvo, o login não grava nada
+        self.client.login(username="visitante", password="senha-teste-123")
+        self.assertFalse(ItemCarrinho.objects.exists())
+
+        self.client.get('/checkout/')
+        carrinho = Carrinho.objects.get(usuario=self.usuario, ativo=True)
+        self.assertEqual(carrinho.itens.get().quantidade, 2)
+        self.assertNotIn('carrinho', self.client.session)
+
+        # Com o carrinho persistido, novas adições vão direto para o banco
+        self.client.post('/carrinho/api/adicionar/', {'produto_id': self.produto.id})
+        self.assertEqual(carrinho.itens.get().quantidade, 3)
+
+    def test_login_mescla_com_carrinho_salvo(self):
+        """Testa se o carrinho anterior ao login é somado ao salvo, limitado ao estoque."""
+        from .models import Carrinho, ItemCarrinho
+
+        carrinho = Carrinho.objects.create(usuario=self.usuario)
+        ItemCarrinho.objects.create(carrinho=carrinho, produto=self.produto, quantidade=2)
+
+        for _ in range(2):
+            self.client.post('/busca/', {'produto_id': self.produto.id})
+        self.client.login(username="visitante", password="senha-teste-123")
+
+        self.assertEqual(carrinho.itens.get().quantidade, 3)
+        self.assertNotIn('carrinho', self.client.session)
+        self.assertEqual(self.client.get('/carrinho/api/').json()['carrinho']['total_itens'], 3)
+
+    def test_visitante_altera_e_remove_itens(self):
+        """Testa se visitantes alteram quantidades e removem produtos na sessão e se isso vale após o login."""
+        from .models import Carrinho, ItemCarrinho
+
+        outro = self.criar_produto("SES002", {Armazem.objects.create(nome="B"): 5})
+        for produto in (self.produto, self.produto, outro):
+            self.client.post('/carrinho/api/adicionar/', {'produto_id': produto.id})
+        url = f'/carrinho/api/produtos/{self.produto.id}/'
+
+        resposta = self.client.post(url, {'quantidade': 4})
+        self.assertEqual(resposta.status_code, 409)
+        self.assertEqual(resposta.json()['item']['quantidade'], 2)
+        resposta = self.client.post(url, {'quantidade': 3})
+        self.assertEqual(resposta.json()['item']['quantidade'], 3)
+        resposta = self.client.post(url, {'acao': 'diminuir'})
+        self.assertEqual(resposta.json()['item']['quantidade'], 2)
+        self.assertEqual(resposta.json()['carrinho'], {'total_itens': 3, 'subtotal': '6.00'})
+
+        resposta = self.client.post(f'/carrinho/api/produtos/{outro.id}/remover/')
+        self.assertTrue(resposta.json()['removido'])
+        self.assertEqual(self.client.post(f'/carrinho/api/produtos/{outro.id}/remover/').status_code, 404)
+        self.assertEqual(self.client.post(f'/carrinho/api/produtos/{outro.id}/', {'acao': 'aumentar'}).status_code, 404)
+        self.assertFalse(Carrinho.objects.exists())
+
+        # As alterações feitas na sessão são as que entram no carrinho salvo
+        carrinho = Carrinho.objects.create(usuario=self.usuario)
+        self.client.login(username="visitante", password="senha-teste-123")
+        self.assertEqual(list(carrinho.itens.values_list('produto_id', 'quantidade')), [(self.produto.id, 2)])
+
+        # Já logado, a mesma API altera o carrinho do banco
+        resposta = self.client.post(f'/carrinho/api/produtos/{self.produto.id}/remover/', {'quantidade_remover': 1})
+        self.assertEqual(resposta.json()['item']['quantidade'], 1)
+        self.assertEqual(ItemCarrinho.objects.get(carrinho=carrinho).quantidade, 1)
+        carrinho.refresh_from_db()
+        self.assertEqual(carrinho.total_itens, 1)
+
+
+class HistoricoPedidosTest(TestCase):
+    """Testes para a paginação por chave do histórico de pedidos."""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import Pedido
+
+        self.usuario = User.objects.create_user(username="historico", password="senha-teste-123")
+        Pedido.objects.bulk_create([
+            Pedido(usuario=self.usuario, tipo_entrega='DOMICILIO', prazo_dias=2, subtotal_produtos=Decimal('1.00'))
+            for _ in range(7)
+        ])
+        # Metade com a mesma data, para exercitar o desempate por id
+        Pedido.objects.filter(id__in=Pedido.objects.order_by('id').values('id')[:4]).update(
+            data_criacao=Pedido.objects.order_by('id').first().data_criacao
+        )
+        self.esperado = list(Pedido.objects.order_by('-data_criacao', '-id').values_list('id', flat=True))
+
+    def test_paginas_sem_repetir_nem_pular(self):
+        """Testa se avançar e voltar pelos cursores percorre todos os pedidos uma vez."""
+        from .historico import pagina_pedidos
+        from .models import Pedido
+
+        pedidos = Pedido.objects.all()
+        vistos = []
+        pagina = pagina_pedidos(pedidos, limite=3)
+        self.assertIsNone(pagina.anterior)
+        paginas = [pagina]
+        while pagina.proximo:
+            pagina = pagina_pedidos(pedidos, depois=pagina.proximo, limite=3)
+            paginas.append(pagina)
+        for pagina in paginas:
+            vistos += [pedido.id for pedido in pagina]
+        self.assertEqual(vistos, self.esperado)
+
+        volta = pagina_pedidos(pedidos, antes=paginas[2].anterior, limite=3)
+        self.assertEqual([p.id for p in volta], [p.id for p in paginas[1]])
+        self.assertEqual(pagina_pedidos(pedidos, depois='invalido', limite=3).proximo, paginas[0].proximo)
+
+    def test_view_usa_cursor_da_url(self):
+        """Testa se a página de pedidos recentes segue o cursor e mostra a contagem limitada."""
+        from .historico import TAMANHO_PAGINA_PEDIDOS
+        from .models import Pedido
+
+        Pedido.objects.bulk_create([
+            Pedido(usuario=self.usuario, tipo_entrega='RETIRADA', prazo_dias=1, subtotal_produtos=Decimal('1.00'))
+            for _ in range(TAMANHO_PAGINA_PEDIDOS)
+        ])
+        self.client.force_login(self.usuario)
+        resposta = self.client.get('/recentes/')
+        self.assertEqual(resposta.context['total_pedidos'], TAMANHO_PAGINA_PEDIDOS + 7)
+        self.assertEqual(len(resposta.context['pedidos']), TAMANHO_PAGINA_PEDIDOS)
+
+        resposta = self.client.get('/recentes/', {'depois': resposta.context['pedidos'].proximo})
+        self.assertEqual([pedido.id for pedido in resposta.context['pedidos']], self.esperado[-7:])
+        self.assertContains(resposta, "Mais recentes")
+
+    def test_filtro_de_periodo_no_fuso_configurado(self):
+        """Testa se o período inclui os dias inteiros no fuso local, sem converter a coluna para data."""
+        from datetime import datetime
+        from zoneinfo import ZoneInfo
+        from django.utils import timezone
+        from .historico import filtrar_periodo
+        from .models import Pedido
+
+        recife = ZoneInfo('America/Recife')
+        ids = self.esperado
+        # 00:30 do dia 10 em Recife ainda é dia 10 (03:30 UTC); 23:30 do dia 10 já é dia 11 em UTC
+        datas = {
+            ids[0]: datetime(2025, 3, 9, 23, 59, tzinfo=recife),
+            ids[1]: datetime(2025, 3, 10, 0, 30, tzinfo=recife),
+            ids[2]: datetime(2025, 3, 10, 23, 30, tzinfo=recife),
+            ids[3]: datetime(2025, 3, 11, 0, 0, tzinfo=recife),
+        }
+        for pedido_id, data in datas.items():
+            Pedido.objects.filter(id=pedido_id).update(data_criacao=data)
+
+        with timezone.override(recife):
+            pedidos = filtrar_periodo(Pedido.objects.all(), '2025-03-10', '2025-03-10')
+            self.assertEqual(set(pedidos.values_list('id', flat=True)), {ids[1], ids[2]})
+            self.assertNotIn('django_datetime_cast_date', str(pedidos.query))
+            self.assertEqual(filtrar_periodo(Pedido.objects.all(), '10/03/2025', '').count(), 7)
+
+
+class IndicesConsultasTest(TestCase):
+    """Testes para os índices usados pelas consultas mais frequentes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        from datetime import timedelta
+        from django.contrib.auth.models import User
+        from django.db import connection
+        from django.utils import timezone
+        from .models import Carrinho, Loja, Pedido
+
+        usuarios = User.objects.bulk_create([User(username=f"indice{i}") for i in range(300)])
+        cls.usuario = usuarios[0]
+        Carrinho.objects.bulk_create(
+            [Carrinho(usuario=usuario) for usuario in usuarios]
+            + [Carrinho(usuario=usuario, ativo=False) for usuario in usuarios for _ in range(4)]
+        )
+        agora = timezone.now()
+        Pedido.objects.bulk_create([
+            Pedido(usuario=usuarios[i % 300], tipo_entrega='RETIRADA' if i % 10 == 0 else 'DOMICILIO',
+                   prazo_dias=1, data_criacao=agora - timedelta(hours=i))
+            for i in range(2000)
+        ])
+        produtos = Produto.objects.bulk_create([
+            Produto(nome=f"Produto {i}", codigo=f"IDX{i}", descricao=f"Produto indexado {i}", categoria=f"Cat{i % 20}",
+                    preco_custo=Decimal('1.00'), preco=Decimal('2.00'), unidade_medida="unidade")
+            for i in range(100)
+        ])
+        armazens = Armazem.objects.bulk_create([Armazem(nome=f"Armazém {i}") for i in range(20)])
+        Estoque.objects.bulk_create([
+            Estoque(produto=produto, armazem=armazem, quantidade=5 if (produto.id + armazem.id) % 50 == 0 else 200)
+            for produto in produtos for armazem in armazens
+        ])
+        Loja.objects.bulk_create([
+            Loja(nome=f"Loja {i}", endereco="Rua", numero="1", bairro="Centro", cidade="Recife", estado="PE",
+                 cep="50000-000", ativa=i < 10)
+            for i in range(200)
+        ])
+        cls.produtos = produtos
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def varreduras_completas(self, queryset):
+        """Tabelas lidas por inteiro no plano de execução da consulta"""
+        import re
+        from django.db import connection
+
+        plano = queryset.explain()
+        if connection.vendor == 'postgresql':
+            return re.findall(r'Seq Scan on (\w+)', plano)
+        # SQLite: "SCAN tabela" sem índice; "SCAN tabela USING INDEX ..." percorre o índice em ordem
+        return re.findall(r'SCAN (mercadocesar_\w+)\s*$', plano, re.MULTILINE)
+
+    def test_consultas_frequentes_usam_indices(self):
+        """Testa se nenhuma consulta frequente faz varredura sequencial nas tabelas populadas."""
+        from datetime import timedelta
+        from django.utils import timezone
+        from .historico import filtrar_periodo
+        from .models import Carrinho, Loja, Pedido
+
+        semana_passada = timezone.now() - timedelta(days=7)
+        hoje = timezone.localdate().isoformat()
+        consultas = {
+            'carrinho ativo': Carrinho.objects.filter(usuario=self.usuario, ativo=True),
+            'pedidos do usuário': Pedido.objects.filter(usuario=self.usuario).order_by('-data_criacao', '-id')[:21],
+            'todos os pedidos': Pedido.objects.order_by('-data_criacao', '-id')[:21],
+            'pedidos por tipo e período': Pedido.objects.filter(
+                tipo_entrega='RETIRADA', data_criacao__gte=semana_passada
+            ),
+            'pedidos do dia': filtrar_periodo(Pedido.objects.all(), hoje, hoje).order_by('-data_criacao', '-id'),
+            'candidatos à alocação': Estoque.objects.filter(
+                produto_id__in=[p.id for p in self.produtos[:3]], quantidade__gt=0
+            ),
+            'estoque baixo': Estoque.abaixo_estoque_minimo(),
+            'lojas ativas': Loja.objects.filter(ativa=True),
+            'catálogo por categoria': Produto.objects.filter(categoria='Cat3').order_by('categoria', 'id'),
+        }
+        for nome, consulta in consultas.items():
+            with self.subTest(consulta=nome):
+                self.assertEqual(self.varreduras_completas(consulta), [])
+
+    def test_um_carrinho_ativo_por_usuario(self):
+        """Testa se o índice parcial impede um segundo carrinho ativo."""
+        from .models import Carrinho
+
+        Carrinho.objects.create(usuario=self.usuario, ativo=False)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Carrinho.objects.create(usuario=self.usuario)
+
+
+class EstoqueBaixoTest(FabricaTestCase):
+    """Testes para o relatório de estoque baixo com mínimos configuráveis."""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import EstoqueMinimo
+
+        self.usuario = User.objects.create_user(username="estoquista", password="senha-teste-123", is_staff=True)
+        centro, norte = Armazem.objects.create(nome="Centro"), Armazem.objects.create(nome="Norte")
+
+        self.agua = self.criar_produto("AGUA", {centro: 10, norte: 100})
+        self.suco = self.criar_produto("SUCO")
+        self.sal = self.criar_produto("SAL", {centro: 10}, categoria="Temperos")
+        self.cafe = self.criar_produto("CAFE", {centro: 100, norte: 20})
+        # Sal: mínimo da categoria abaixo do padrão; café: mínimo do produto acima do padrão
+        EstoqueMinimo.objects.create(categoria="Temperos", quantidade_minima=5)
+        EstoqueMinimo.objects.create(produto=self.cafe, quantidade_minima=150)
+
+    def test_relatorio_em_uma_consulta(self):
+        """Testa se faltas por armazém e por produto saem de uma única consulta, incluindo produtos sem estoque."""
+        from .reposicao import linhas_estoque_baixo, produtos_estoque_baixo
+
+        linhas = linhas_estoque_baixo().filter(id__in=[self.agua.id, self.suco.id, self.sal.id, self.cafe.id])
+        with self.assertNumQueries(1):
+            relatorio = list(produtos_estoque_baixo(linhas))
+
+        self.assertEqual([produto['codigo'] for produto in relatorio], ["AGUA", "CAFE", "SUCO"])
+        agua, cafe, suco = relatorio
+        self.assertEqual(
+            [(linha['estoque__armazem__nome'], linha['quantidade'], linha['falta']) for linha in agua['armazens']],
+            [("Centro", 10, 20)],
+        )
+        self.assertEqual([linha['falta'] for linha in cafe['armazens']], [50, 130])
+        self.assertEqual(cafe['falta'], 180)
+        self.assertEqual((suco['armazens'][0]['estoque__armazem__nome'], suco['falta']), (None, 30))
+
+    def test_exportacao_csv_e_filtro_do_estoque(self):
+        """Testa o CSV em streaming e o filtro 'apenas baixo' usando os mesmos mínimos."""
+        self.client.force_login(self.usuario)
+
+        resposta = self.client.get('/estoque-baixo/', {'formato': 'csv'})
+        self.assertTrue(resposta.streaming)
+        linhas = b''.join(resposta.streaming_content).decode().splitlines()
+        self.assertEqual(
+            linhas[0], "codigo,descricao,categoria,armazem,quantidade,minimo,falta,estoque_total,ponto_pedido,comprar"
+        )
+        self.assertIn("SUCO,Descrição SUCO,Bebidas,Nenhum,0,30,30,0,,", linhas)
+        self.assertIn("CAFE,Descrição CAFE,Bebidas,Norte,20,150,130,120,,", linhas)
+        self.assertFalse([linha for linha in linhas if linha.startswith("SAL,")])
+
+        resposta = self.client.get('/estoque-baixo/')
+        self.assertContains(resposta, "Descrição SUCO")
+        self.assertNotContains(resposta, "Descrição SAL")
+
+        resposta = self.client.get('/estoque/', {'apenas_baixo': '1'})
+        meus = {self.agua.id, self.sal.id, self.cafe.id}
+        baixos = {
+            (estoque.produto.codigo, estoque.quantidade)
+            for estoque in resposta.context['estoques'] if estoque.produto_id in meus
+        }
+        self.assertEqual(baixos, {("AGUA", 10), ("CAFE", 100), ("CAFE", 20)})
+        self.assertEqual(
+            set(Estoque.abaixo_estoque_minimo().filter(produto__in=meus).values_list('produto__codigo', 'quantidade')),
+            baixos,
+        )
+
+
+@override_settings(PRAZO_REPOSICAO_DIAS=7, COBERTURA_REPOSICAO_DIAS=14)
+class PrevisaoDemandaTest(FabricaTestCase):
+    """Testes para a previsão de demanda e o ponto de pedido."""
+
+    def setUp(self):
+        from datetime import timedelta
+        from django.contrib.auth.models import User
+        from django.utils import timezone
+        from .historico import inicio_do_dia
+        from .models import ItemPedido, Pedido
+
+        self.usuario = User.objects.create_user(username="comprador", password="senha-teste-123", is_staff=True)
+        self.produto = self.criar_produto(
+            "LEITE", {Armazem.objects.create(nome="Central"): 40}, nome="Leite", descricao="Leite integral",
+            categoria="Laticínios", preco_custo=Decimal('3.00'), preco=Decimal('5.00'), unidade_medida="litro"
+        )
+        self.ontem = timezone.localdate() - timedelta(days=1)
+        # A venda de 100 dias atrás fica fora do histórico de 30 dias; a de hoje ainda não fechou o dia
+        for dias_atras, unidades in [(100, 50), (3, 10), (1, 4), (0, 99)]:
+            pedido = Pedido.objects.create(usuario=self.usuario, tipo_entrega='RETIRADA', prazo_dias=0)
+            Pedido.objects.filter(id=pedido.id).update(
+                data_criacao=inicio_do_dia(timezone.localdate() - timedelta(days=dias_atras)) + timedelta(hours=12)
+            )
+            ItemPedido.objects.create(pedido=pedido, produto=self.produto, quantidade=unidades, preco_unitario=Decimal('5.00'))
+
+    def test_estatisticas_contam_dias_sem_venda(self):
+        """Testa média móvel, suavização exponencial e desvio com os dias sem venda como zero."""
+        from datetime import timedelta
+        from .previsao import estatisticas_serie
+
+        vendas = [(self.ontem - timedelta(days=2), 10), (self.ontem, 4)]
+        media, suavizada, desvio = estatisticas_serie(vendas, self.ontem, janela=28, alfa=0.5)
+        # 10, 0, 4 -> suavizada: 10 -> 5 -> 4.5; janela começa na primeira venda (3 dias)
+        self.assertAlmostEqual(media, 14 / 3)
+        self.assertAlmostEqual(suavizada, 4.5)
+        self.assertAlmostEqual(desvio, (116 / 3 - (14 / 3) ** 2) ** 0.5)
+
+    def test_comando_grava_previsao_usada_no_relatorio(self):
+        """Testa se o comando grava ponto de pedido e compra sugerida e se o relatório os usa."""
+        from io import StringIO
+        from django.core.management import call_command
+        from django.utils import timezone
+        from .models import PrevisaoDemanda
+        from .reposicao import linhas_estoque_baixo, produtos_estoque_baixo
+
+        sem_vendas = Produto.objects.exclude(id=self.produto.id).first()
+        PrevisaoDemanda.objects.create(
+            produto=sem_vendas, media_movel=1, demanda_suavizada=1, desvio_padrao=0, ponto_pedido=7,
+            estoque_alvo=21, quantidade_sugerida=21, calculado_em=timezone.now(),
+        )
+        call_command('prever_demanda', dias=30, alfa=0.5, batch_size=2, stdout=StringIO())
+
+        previsao = PrevisaoDemanda.objects.get(produto=self.produto)
+        self.assertAlmostEqual(previsao.demanda_suavizada, 4.5)
+        # 4,5/dia x 7 dias + 1,65 x desvio x raiz(7) = 49,4 -> 50; alvo = 50 + 4,5 x 14
+        self.assertEqual((previsao.ponto_pedido, previsao.estoque_alvo, previsao.quantidade_sugerida), (50, 113, 73))
+        self.assertFalse(PrevisaoDemanda.objects.filter(produto=sem_vendas).exists())
+
+        # Estoque acima do mínimo (40 >= 30), mas no ponto de pedido
+        relatorio = list(produtos_estoque_baixo(linhas_estoque_baixo().filter(id=self.produto.id)))
+        self.assertEqual(len(relatorio), 1)
+        self.assertEqual((relatorio[0]['ponto_pedido'], relatorio[0]['comprar'], relatorio[0]['falta']), (50, 73, 0))
+
+
+class ExportacaoCsvTest(FabricaTestCase):
+    """Testes para a exportação em CSV de pedidos, estoque e produtos."""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import ItemPedido, Pedido
+
+        self.admin = User.objects.create_superuser(username="exportador", password="senha-teste-123")
+        armazem = Armazem.objects.create(nome="Depósito Exportação")
+        self.cafe = self.criar_produto(
+            "EXP-CAFE", {armazem: 5}, nome="Café", descricao="Café exportado", categoria="Exportação",
+            preco_custo=Decimal('8.00'), preco=Decimal('12.50'), unidade_medida="pacote"
+        )
+        self.acucar = self.criar_produto(
+            "EXP-ACUCAR", {armazem: 500}, nome="Açúcar", descricao="Açúcar exportado", categoria="Exportação",
+            preco_custo=Decimal('3.00'), preco=Decimal('4.00'), unidade_medida="kg"
+        )
+
+        self.retirada = Pedido.objects.create(usuario=self.admin, tipo_entrega='RETIRADA', prazo_dias=0)
+        ItemPedido.objects.create(pedido=self.retirada, produto=self.cafe, quantidade=2, preco_unitario=Decimal('12.50'))
+        ItemPedido.objects.create(pedido=self.retirada, produto=self.acucar, quantidade=1, preco_unitario=Decimal('4.00'))
+        entrega = Pedido.objects.create(usuario=self.admin, tipo_entrega='DOMICILIO', prazo_dias=2, cidade="Recife")
+        ItemPedido.objects.create(pedido=entrega, produto=self.cafe, quantidade=1, preco_unitario=Decimal('12.50'))
+        self.client.force_login(self.admin)
+
+    def baixar(self, url, parametros):
+        import csv
+        resposta = self.client.get(url, {**parametros, 'formato': 'csv'})
+        self.assertTrue(resposta.streaming)
+        self.assertIn('attachment', resposta['Content-Disposition'])
+        # Todas as linhas saem de uma única consulta, lida em lotes
+        with self.assertNumQueries(1):
+            conteudo = b''.join(resposta.streaming_content).decode()
+        return list(csv.reader(conteudo.splitlines()))
+
+    def test_pedidos_com_itens_e_filtros_da_pagina(self):
+        """Testa se a exportação de pedidos traz uma linha por item e respeita os filtros."""
+        self.assertContains(self.client.get('/pedidos/', {'tipo_entrega': 'RETIRADA'}), "tipo_entrega=RETIRADA&amp;formato=csv")
+        linhas = self.baixar('/pedidos/', {'tipo_entrega': 'RETIRADA'})
+        self.assertEqual(linhas[0][:4], ['pedido', 'data', 'usuario', 'tipo_entrega'])
+        self.assertEqual(
+            sorted((linha[0], linha[9], linha[11], linha[12]) for linha in linhas[1:]),
+            [(str(self.retirada.id), 'EXP-ACUCAR', '1', '4.00'), (str(self.retirada.id), 'EXP-CAFE', '2', '12.50')],
+        )
+
+    def test_estoque_e_produtos_com_filtros_da_pagina(self):
+        """Testa se as exportações de estoque e produtos usam os mesmos filtros das listagens."""
+        linhas = self.baixar('/estoque/', {'busca_produto': 'EXP-', 'apenas_baixo': '1'})
+        self.assertEqual(linhas[0], ['codigo', 'produto', 'armazem', 'quantidade', 'minimo', 'reabastecido_em'])
+        self.assertEqual([linha[:5] for linha in linhas[1:]], [['EXP-CAFE', 'Café', 'Depósito Exportação', '5', '30']])
+
+        self.assertContains(self.client.get('/estoque/', {'apenas_baixo': '1'}), "apenas_baixo=1&amp;formato=csv")
+        self.assertContains(self.client.get('/produtos/'), "?formato=csv")
+        linhas = self.baixar('/produtos/', {'categoria': 'Exportação'})
+        self.assertEqual(
+            [(linha[0], linha[5], linha[7]) for linha in linhas[1:]],
+            [('EXP-ACUCAR', '4.00', '500'), ('EXP-CAFE', '12.50', '5')],
+        )
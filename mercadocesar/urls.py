@@ -1,7 +1,10 @@
 from django.urls import path
-from .views import (pagina_inicial, register, estoque_baixo, buscar_itens, cadastrar_cartao, 
+from .views import (pagina_inicial, register, estoque_baixo, buscar_itens, buscar_itens_api, autocompletar_busca,
+                    cadastrar_cartao, 
                     listar_cartoes, deletar_cartao, checkout, atualizar_quantidade_carrinho,
-                    remover_item_carrinho, processar_entrega_domicilio, processar_entrega_retirada, 
+                    remover_item_carrinho, carrinho_api, carrinho_api_adicionar, carrinho_api_item,
+                    carrinho_api_remover, carrinho_api_produto, carrinho_api_remover_produto,
+                    processar_entrega_domicilio, processar_entrega_retirada, 
                     finalizar_pedido, gerenciar_lojas, ativar_desativar_loja, visualizar_pedidos, 
                     gerenciar_produtos, adicionar_produto, editar_produto, deletar_produto, 
                     gerenciar_armazens, adicionar_armazem, editar_armazem, deletar_armazem, 
@@ -13,12 +16,21 @@ urlpatterns = [
     path('register/', register, name='register'),
     path('estoque-baixo/', estoque_baixo, name='estoque_baixo'),
     path('busca/', buscar_itens, name= 'busca'),
+    path('busca/api/', buscar_itens_api, name='busca_api'),
+    path('busca/sugestoes/', autocompletar_busca, name='busca_sugestoes'),
     path('cadastrar/', cadastrar_cartao, name='cadastrar_cartao'),
     path('cartoes/', listar_cartoes, name='listar_cartoes'),
     path('cartoes/deletar/<int:cartao_id>/', deletar_cartao, name='deletar_cartao'),
     path('checkout/', checkout, name='checkout'),
     path('carrinho/atualizar/<int:item_id>/', atualizar_quantidade_carrinho, name='atualizar_quantidade_carrinho'),
     path('carrinho/remover/<int:item_id>/', remover_item_carrinho, name='remover_item_carrinho'),
+    path('carrinho/api/', carrinho_api, name='carrinho_api'),
+    path('carrinho/api/adicionar/', carrinho_api_adicionar, name='carrinho_api_adicionar'),
+    path('carrinho/api/itens/<int:item_id>/', carrinho_api_item, name='carrinho_api_item'),
+    path('carrinho/api/itens/<int:item_id>/remover/', carrinho_api_remover, name='carrinho_api_remover'),
+    path('carrinho/api/produtos/<int:produto_id>/', carrinho_api_produto, name='carrinho_api_produto'),
+    path('carrinho/api/produtos/<int:produto_id>/remover/', carrinho_api_remover_produto,
+         name='carrinho_api_remover_produto'),
     path('checkout/domicilio/', processar_entrega_domicilio, name='processar_entrega_domicilio'),
     path('checkout/retirada/', processar_entrega_retirada, name='processar_entrega_retirada'),
     path('checkout/finalizar/', finalizar_pedido, name='finalizar_pedido'),
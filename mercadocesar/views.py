@@ -4,14 +4,31 @@ from django.shortcuts import render, redirect
 from django.db.models import Q
 from django.contrib import messages
 from decimal import Decimal
-from .models import Estoque, Produto, CartaoCredito, Loja, Pedido, Carrinho, ItemCarrinho
+import uuid
+from django.db import transaction
+from .models import Estoque, Produto, CartaoCredito, Loja, Pedido, Carrinho, ItemCarrinho, VendaProduto
+from .indice_busca import buscar_produtos
+from .busca_aproximada import sugerir_termo
+from .autocompletar import obter_indice_prefixos
+from .busca import TAMANHO_PAGINA_BUSCA, facetas_categorias, pagina_produtos, produto_para_dict
 from .validators import (validar_numero_cartao, validar_cvv, validar_validade, identificar_bandeira,
                           validar_cep, verificar_area_entrega, calcular_frete, calcular_prazo_entrega)
 
 
-def obter_carrinho_ativo(usuario):
-    """Retorna o carrinho ativo do usuário"""
-    return Carrinho.objects.filter(usuario=usuario, ativo=True).first()
+def obter_carrinho_ativo(usuario, revalidar=False):
+    """
+    Retorna o carrinho ativo do usuário.
+
+    Com revalidar=True os totais mantidos são conferidos contra os itens e os
+    preços atuais na mesma consulta (usado onde o valor é exibido para pagamento).
+    """
+    carrinhos = Carrinho.objects.filter(usuario=usuario, ativo=True)
+    if not revalidar:
+        return carrinhos.first()
+    carrinho = carrinhos.com_totais_atuais().order_by('id').first()
+    if carrinho is not None:
+        carrinho.revalidar_totais()
+    return carrinho
 
 
 class PedidoTemporario:
@@ -37,7 +54,7 @@ class PedidoTemporario:
     
     @property
     def itens(self):
-        return self._carrinho.itens if self._carrinho else []
+        return self._carrinho.itens.select_related('produto') if self._carrinho else []
     
     def calcular_subtotal_produtos(self):
         return self._carrinho.calcular_total() if self._carrinho else Decimal('0')
@@ -47,32 +64,64 @@ class PedidoTemporario:
         return Decimal(str(subtotal)) + self.custo_entrega
 
 
+# Chave e validade (em segundos) do cache da página inicial
+CHAVE_CACHE_PAGINA_INICIAL = 'pagina_inicial:destaques'
+TEMPO_CACHE_PAGINA_INICIAL = 60
+
+
+def montar_destaques_pagina_inicial():
+    """Produtos mais vendidos e lojas ativas exibidos na página inicial"""
+    # Buscar os 3 produtos mais pedidos na tabela de totais vendidos
+    produtos = list(
+        Produto.objects.filter(vendas__total_vendido__gt=0).order_by('-vendas__total_vendido', 'id')[:3]
+    )
+
+    # Se não houver produtos pedidos ainda, mostra os primeiros 3 produtos disponíveis
+    if not produtos:
+        produtos = list(Produto.objects.all()[:3])
+
+    lojas = Loja.objects.filter(ativa=True).values(
+        'nome', 'endereco', 'numero', 'bairro', 'cidade', 'estado', 'cep', 'prazo_retirada_dias'
+    )[:3]
+
+    return {
+        'produtos_destaque': [
+            {
+                'id': produto.id,
+                'nome': produto.nome,
+                'preco': produto.preco,
+                'imagem_url': produto.imagem.url if produto.imagem else None,
+            }
+            for produto in produtos
+        ],
+        'lojas': list(lojas),
+    }
+
+
+def registrar_vendas(pedido_id, vendas):
+    """Soma as vendas do pedido aos totais vendidos; roda depois do commit do pedido"""
+    import logging
+    # O pedido já está gravado: uma falha aqui não pode virar erro para o cliente
+    try:
+        VendaProduto.registrar(vendas)
+    except Exception:
+        logging.getLogger(__name__).exception(
+            "Falha ao registrar as vendas do pedido #%s nos totais vendidos", pedido_id
+        )
+
+
 @login_required
 def pagina_inicial(request):
     """Landing page com produtos em destaque e informações"""
-    from django.db.models import Sum, Count
-    
-    # Buscar os 3 produtos mais pedidos (baseado na quantidade total vendida)
-    produtos_mais_pedidos = Produto.objects.annotate(
-        total_vendido=Sum('itempedido__quantidade')
-    ).filter(
-        total_vendido__isnull=False  # Apenas produtos que já foram pedidos
-    ).order_by('-total_vendido')[:3]
-    
-    # Se não houver produtos pedidos ainda, mostra os primeiros 3 produtos disponíveis
-    if not produtos_mais_pedidos.exists():
-        produtos_destaque = Produto.objects.all()[:3]
-    else:
-        produtos_destaque = produtos_mais_pedidos
-    
-    # Buscar lojas ativas
-    lojas = Loja.objects.filter(ativa=True)[:3]
-    
-    contexto = {
-        'produtos_destaque': produtos_destaque,
-        'lojas': lojas,
-    }
-    
+    from .cache_compartilhado import obter_ou_calcular
+
+    # Recalculado quando produtos ou lojas são alterados; as vendas ficam no
+    # máximo TEMPO_CACHE_PAGINA_INICIAL segundos desatualizadas
+    contexto = obter_ou_calcular(
+        CHAVE_CACHE_PAGINA_INICIAL, montar_destaques_pagina_inicial, TEMPO_CACHE_PAGINA_INICIAL,
+        modelos=('Produto', 'Loja'),
+    )
+
     return render(request, 'home.html', contexto)
 
 
@@ -97,74 +146,92 @@ def register(request):
 
 @user_passes_test(lambda u: u.is_staff)
 def estoque_baixo(request):
-    # Pegar estoques com quantidade < 30
-    estoques = list(Estoque.abaixo_estoque_minimo())
-    
-    # Adicionar produtos que não têm nenhum registro de estoque (estoque total = 0)
-    from django.db.models import Sum
-    produtos_sem_estoque = Produto.objects.annotate(
-        total_estoque=Sum('estoque__quantidade')
-    ).filter(total_estoque__isnull=True)
-    
-    # Criar objetos fictícios de Estoque para produtos sem estoque
-    class EstoqueFicticio:
-        def __init__(self, produto):
-            self.produto = produto
-            self.quantidade = 0
-            self.armazem = type('obj', (object,), {'nome': 'Nenhum'})()
-    
-    for produto in produtos_sem_estoque:
-        estoques.append(EstoqueFicticio(produto))
-    
-    return render(request, 'estoque_baixo.html', {'estoques': estoques})
+    """Produtos abaixo do estoque mínimo, por armazém; ?formato=csv exporta o relatório"""
+    from django.conf import settings
+    from .exportacao import resposta_csv
+    from .reposicao import CABECALHO_CSV, linhas_csv_estoque_baixo, produtos_estoque_baixo
+
+    if request.GET.get('formato') == 'csv':
+        return resposta_csv('estoque_baixo.csv', CABECALHO_CSV, linhas_csv_estoque_baixo())
+
+    # Gerador: o template percorre o relatório sem montá-lo em uma lista
+    return render(request, 'estoque_baixo.html', {
+        'produtos': produtos_estoque_baixo(),
+        'minimo_padrao': settings.ESTOQUE_MINIMO_PADRAO,
+    })
 
-@login_required
 def buscar_itens(request):
+    from .carrinho import obter_carrinho
+
     if request.method == 'POST':
-        # Adicionar produto ao carrinho
+        # Adicionar produto ao carrinho (na sessão até o checkout)
         produto_id = request.POST.get('produto_id')
         if produto_id:
-            try:
-                produto = Produto.objects.get(id=produto_id)
-                carrinho, created = Carrinho.objects.get_or_create(usuario=request.user, ativo=True)
-                item, created = ItemCarrinho.objects.get_or_create(carrinho=carrinho, produto=produto)
-                
-                if not created:
-                    item.quantidade += 1
-                    item.save()
-                    messages.success(request, f"{produto.nome} - quantidade atualizada no carrinho")
-                else:
-                    messages.success(request, f"{produto.nome} adicionado ao carrinho")
-            except Produto.DoesNotExist:
+            produto = Produto.objects.only('nome', 'preco', 'total_estoque').filter(id=produto_id).first()
+            if produto is None:
                 messages.error(request, "Produto não encontrado")
+            elif obter_carrinho(request).adicionar(produto):
+                messages.success(request, f"{produto.nome} adicionado ao carrinho")
+            else:
+                messages.warning(request, f"{produto.nome}: estoque insuficiente para adicionar mais unidades")
         
         return redirect('busca')
     
-    todos_produtos = Produto.objects.all().order_by('categoria', 'id')
+    # Apenas a primeira página é renderizada; o restante vem da API de busca
+    todos_produtos, proximo_cursor = pagina_produtos()
 
-    produtos_destaque = []
-
-    categoria_vistas = set()
-
-    for produto in todos_produtos:
-        if produto.categoria not in categoria_vistas:
-            produtos_destaque.append(produto)
-            categoria_vistas.add(produto.categoria)
-
-    # Pegar carrinho atual
-    carrinho = obter_carrinho_ativo(request.user)
-    total_itens = sum(item.quantidade for item in carrinho.itens.all()) if carrinho else 0
+    # Carrinho em navegação vem da sessão, sem consulta
+    total_itens = obter_carrinho(request).total_itens()
 
     contexto = {
         'todos_produtos': todos_produtos,
-        'produtos_destaque': produtos_destaque,
-        'carrinho': carrinho,
+        'proximo_cursor': proximo_cursor,
+        # Chamada pelo template só quando a barra de categorias não está em cache
+        'categorias': facetas_categorias,
         'total_itens': total_itens
     }
     
     return render(request, 'buscar_itens.html', contexto)
 
 
+def buscar_itens_api(request):
+    """Busca paginada de produtos em JSON para a página de busca"""
+    from django.http import JsonResponse
+
+    termo = request.GET.get('q', '').strip()
+    categoria = request.GET.get('categoria', '').strip()
+    cursor = request.GET.get('cursor') or None
+
+    try:
+        limite = int(request.GET.get('limite', TAMANHO_PAGINA_BUSCA))
+    except ValueError:
+        limite = TAMANHO_PAGINA_BUSCA
+
+    produtos, proximo_cursor = pagina_produtos(termo, categoria, cursor, limite)
+
+    resposta = {
+        'produtos': [produto_para_dict(produto) for produto in produtos],
+        'proximo_cursor': proximo_cursor,
+    }
+    # Facetas só são necessárias ao carregar a primeira página
+    if not cursor:
+        resposta['categorias'] = facetas_categorias(termo)
+        # Sem resultados, sugere uma grafia próxima ("pesi" -> "pepsi")
+        if termo and not produtos:
+            resposta['sugestao'] = sugerir_termo(termo)
+
+    return JsonResponse(resposta)
+
+
+def autocompletar_busca(request):
+    """Sugestões para a barra de busca a partir do índice de prefixos em memória"""
+    from django.http import JsonResponse
+
+    termo = request.GET.get('q', '').strip()
+    sugestoes = obter_indice_prefixos().sugerir(termo) if termo else []
+    return JsonResponse({'sugestoes': sugestoes})
+
+
 @login_required
 def cadastrar_cartao(request):
     """View para cadastro de cartão de crédito"""
@@ -343,8 +410,11 @@ def checkout(request):
                     # Desativar carrinho atual (se existir)
                     Carrinho.objects.filter(usuario=request.user, ativo=True).update(ativo=False)
                     
-                    # Criar novo carrinho
+                    # Criar novo carrinho; o da sessão também é substituído
+                    from .carrinho import CHAVE_PERSISTIDO, CarrinhoSessao
                     novo_carrinho = Carrinho.objects.create(usuario=request.user, ativo=True)
+                    CarrinhoSessao(request.session).limpar()
+                    request.session[CHAVE_PERSISTIDO] = novo_carrinho.id
                     
                     # Recriar itens do carrinho baseado no pedido
                     itens_pedido = ItemPedido.objects.filter(pedido=pedido_original).select_related('produto')
@@ -358,6 +428,7 @@ def checkout(request):
                         )
                         itens_criados += 1
                     
+                    Carrinho.atualizar_totais([novo_carrinho.id])
                     logger.info(f"[Compra Rápida] Carrinho recriado com {itens_criados} itens")
                     logger.info(f"[Compra Rápida] Carrinho ID: {novo_carrinho.id}, Ativo: {novo_carrinho.ativo}")
                     
@@ -382,12 +453,19 @@ def checkout(request):
     import logging
     logger = logging.getLogger(__name__)
     
-    carrinho = obter_carrinho_ativo(request.user)
+    # O carrinho montado durante a navegação é gravado no banco aqui
+    from .carrinho import carregar_itens, persistir_carrinho
+    carrinho, ajustados = persistir_carrinho(request)
+    if ajustados:
+        messages.warning(request, "Alguns itens tiveram a quantidade ajustada ao estoque disponível.")
     logger.info(f"[Checkout GET] Usuário: {request.user.username}, Carrinho: {carrinho}")
     
+    # Totais conferidos contra os preços atuais e itens com produto e estoque livre em uma consulta
+    itens = []
     if carrinho:
-        itens_count = carrinho.itens.count()
-        logger.info(f"[Checkout GET] Carrinho ID {carrinho.id} tem {itens_count} itens")
+        carrinho = obter_carrinho_ativo(request.user, revalidar=True)
+        itens = list(carregar_itens(carrinho.itens.all()))
+        logger.info(f"[Checkout GET] Carrinho ID {carrinho.id} tem {len(itens)} itens")
     else:
         logger.info(f"[Checkout GET] Nenhum carrinho ativo encontrado")
     
@@ -397,12 +475,12 @@ def checkout(request):
     lojas = Loja.objects.filter(ativa=True)
     
     # Se carrinho vazio, deixar o template decidir (pode ser compra rápida via JS)
-    if not carrinho or not carrinho.itens.exists():
+    if not itens:
         logger.info(f"[Checkout GET] Renderizando com carrinho=None")
         return render(request, 'checkout.html', {'lojas': lojas, 'carrinho': None})
     
     logger.info(f"[Checkout GET] Renderizando com carrinho={carrinho.id}")
-    return render(request, 'checkout.html', {'lojas': lojas, 'carrinho': carrinho})
+    return render(request, 'checkout.html', {'lojas': lojas, 'carrinho': carrinho, 'itens': itens})
 
 
 @login_required
@@ -411,30 +489,28 @@ def atualizar_quantidade_carrinho(request, item_id):
     if request.method != 'POST':
         return redirect('checkout')
     
-    try:
-        item = ItemCarrinho.objects.get(id=item_id, carrinho__usuario=request.user, carrinho__ativo=True)
-        acao = request.POST.get('acao') 
-        
-        estoque_total = item.produto.estoque_total()
-        
-        if acao == 'aumentar':
-            if item.quantidade >= estoque_total:
-                messages.warning(request, f'Estoque insuficiente. Apenas {estoque_total} unidade(s) disponível(is).')
-            else:
-                item.quantidade += 1
-                item.save()
-        elif acao == 'diminuir':
-            if item.quantidade <= 1:
-                # Quantidade chegou a 0, remover item
-                produto_nome = item.produto.nome
-                item.delete()
-                messages.success(request, f'"{produto_nome}" removido do carrinho.')
-            else:
-                item.quantidade -= 1
-                item.save()
+    from .carrinho import decrementar_item, incrementar_item
     
-    except ItemCarrinho.DoesNotExist:
-        messages.error(request, 'Item não encontrado no carrinho.')
+    itens = ItemCarrinho.objects.filter(id=item_id, carrinho__usuario=request.user, carrinho__ativo=True)
+    acao = request.POST.get('acao') 
+    
+    if acao == 'aumentar':
+        # Um único UPDATE condicional; só lê o item se a alteração for recusada
+        if not incrementar_item(itens):
+            item = itens.select_related('produto').first()
+            if item is None:
+                messages.error(request, 'Item não encontrado no carrinho.')
+            else:
+                estoque_total = item.produto.estoque_disponivel(carrinho=item.carrinho_id)
+                messages.warning(request, f'Estoque insuficiente. Apenas {estoque_total} unidade(s) disponível(is).')
+    elif acao == 'diminuir':
+        produto_nome = itens.values_list('produto__nome', flat=True).first()
+        resultado = decrementar_item(itens)
+        if resultado is None:
+            messages.error(request, 'Item não encontrado no carrinho.')
+        elif resultado == 'removido':
+            # Quantidade chegou a 0, item removido
+            messages.success(request, f'"{produto_nome}" removido do carrinho.')
     
     return redirect('checkout')
 
@@ -445,28 +521,28 @@ def remover_item_carrinho(request, item_id):
     if request.method != 'POST':
         return redirect('checkout')
     
+    from .carrinho import decrementar_item
+    
+    itens = ItemCarrinho.objects.filter(id=item_id, carrinho__usuario=request.user, carrinho__ativo=True)
+    
     try:
-        item = ItemCarrinho.objects.get(id=item_id, carrinho__usuario=request.user, carrinho__ativo=True)
+        item = itens.select_related('produto').get()
         produto_nome = item.produto.nome
-        quantidade_atual = item.quantidade
         
         # Obter quantidade a remover (padrão é tudo)
-        quantidade_remover = int(request.POST.get('quantidade_remover', quantidade_atual))
+        quantidade_remover = int(request.POST.get('quantidade_remover', item.quantidade))
         
         # Validar quantidade
         if quantidade_remover <= 0:
             messages.error(request, 'Quantidade inválida.')
             return redirect('checkout')
         
-        if quantidade_remover >= quantidade_atual:
-            # Remover item completamente
-            item.delete()
+        resultado = decrementar_item(itens, quantidade_remover)
+        if resultado == 'removido':
             messages.success(request, f'"{produto_nome}" removido completamente do carrinho.')
-        else:
-            # Reduzir quantidade
-            item.quantidade -= quantidade_remover
-            item.save()
-            messages.success(request, f'{quantidade_remover} unidade(s) de "{produto_nome}" removida(s). Restam {item.quantidade} no carrinho.')
+        elif resultado == 'reduzido':
+            restante = itens.values_list('quantidade', flat=True).first()
+            messages.success(request, f'{quantidade_remover} unidade(s) de "{produto_nome}" removida(s). Restam {restante} no carrinho.')
     
     except ItemCarrinho.DoesNotExist:
         messages.error(request, 'Item não encontrado no carrinho.')
@@ -476,6 +552,218 @@ def remover_item_carrinho(request, item_id):
     return redirect('checkout')
 
 
+def resposta_carrinho(carrinho, item_id=None, status=200, **dados):
+    """
+    Resposta da API do carrinho: a linha alterada (ou None se foi removida) e os
+    totais, sem renderizar nenhuma página.
+    """
+    from django.http import JsonResponse
+    from .carrinho import carregar_itens, item_para_dict, resumo_carrinho
+
+    item = None
+    if item_id is not None and carrinho is not None:
+        item = carregar_itens(ItemCarrinho.objects.filter(id=item_id, carrinho=carrinho)).first()
+    resposta = {
+        'success': status == 200,
+        'item': item_para_dict(item) if item else None,
+        'removido': item_id is not None and item is None,
+        'carrinho': resumo_carrinho(carrinho),
+    }
+    resposta.update(dados)
+    return JsonResponse(resposta, status=status)
+
+
+def carrinho_api(request):
+    """Itens e totais do carrinho (da sessão ou do banco) em JSON"""
+    from django.http import JsonResponse
+    from .carrinho import obter_carrinho
+
+    carrinho = obter_carrinho(request)
+    return JsonResponse({'success': True, 'itens': carrinho.itens(), 'carrinho': carrinho.resumo()})
+
+
+def carrinho_api_adicionar(request):
+    """Adiciona uma unidade do produto ao carrinho (JSON)"""
+    from django.http import JsonResponse
+    from .carrinho import obter_carrinho
+
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Método não permitido'}, status=405)
+
+    produto_id = request.POST.get('produto_id', '')
+    produto = Produto.objects.only('nome', 'preco', 'total_estoque').filter(id=produto_id).first() if produto_id.isdigit() else None
+    if produto is None:
+        return JsonResponse({'success': False, 'error': 'Produto não encontrado'}, status=404)
+
+    carrinho = obter_carrinho(request)
+    adicionado = carrinho.adicionar(produto)
+    resposta = {'success': adicionado, 'item': carrinho.item(produto), 'removido': False, 'carrinho': carrinho.resumo()}
+    if adicionado:
+        resposta['message'] = f"{produto.nome} adicionado ao carrinho"
+    else:
+        resposta['error'] = f"{produto.nome}: estoque insuficiente para adicionar mais unidades"
+    return JsonResponse(resposta, status=200 if adicionado else 409)
+
+
+def resposta_carrinho_produto(carrinho, produto, status=200, **dados):
+    """Como resposta_carrinho, para a linha de um produto no carrinho da sessão ou do banco"""
+    from django.http import JsonResponse
+
+    item = carrinho.item(produto)
+    resposta = {'success': status == 200, 'item': item, 'removido': item is None, 'carrinho': carrinho.resumo()}
+    resposta.update(dados)
+    return JsonResponse(resposta, status=status)
+
+
+def carrinho_api_produto(request, produto_id):
+    """
+    Altera a quantidade de um produto do carrinho (JSON), também para visitantes.
+
+    Aceita 'acao' (aumentar/diminuir uma unidade) ou 'quantidade' (valor
+    absoluto; 0 remove o produto).
+    """
+    from django.http import JsonResponse
+    from .carrinho import obter_carrinho
+
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Método não permitido'}, status=405)
+
+    produto = Produto.objects.only('nome', 'preco', 'total_estoque').filter(id=produto_id).first()
+    carrinho = obter_carrinho(request)
+    if produto is None or carrinho.item(produto) is None:
+        return JsonResponse({'success': False, 'error': 'Item não encontrado no carrinho.'}, status=404)
+
+    acao = request.POST.get('acao')
+    if acao == 'aumentar':
+        alterado = carrinho.adicionar(produto)
+    elif acao == 'diminuir':
+        alterado = carrinho.remover(produto, 1) is not None
+    else:
+        try:
+            quantidade = int(request.POST.get('quantidade', ''))
+        except ValueError:
+            quantidade = -1
+        if quantidade < 0:
+            return resposta_carrinho_produto(carrinho, produto, status=400, error='Quantidade inválida.')
+        alterado = carrinho.definir_quantidade(produto, quantidade)
+
+    if alterado:
+        return resposta_carrinho_produto(carrinho, produto)
+    # Recusado por falta de estoque: a resposta traz a quantidade e o estoque atuais
+    return resposta_carrinho_produto(carrinho, produto, status=409, error='Estoque insuficiente.')
+
+
+def carrinho_api_remover_produto(request, produto_id):
+    """Remove 'quantidade_remover' unidades do produto, ou o produto inteiro (JSON), também para visitantes"""
+    from django.http import JsonResponse
+    from .carrinho import obter_carrinho
+
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Método não permitido'}, status=405)
+
+    produto = Produto.objects.only('nome', 'preco', 'total_estoque').filter(id=produto_id).first()
+    carrinho = obter_carrinho(request)
+    quantidade_remover = None
+    if request.POST.get('quantidade_remover'):
+        try:
+            quantidade_remover = int(request.POST['quantidade_remover'])
+        except ValueError:
+            quantidade_remover = 0
+        if quantidade_remover <= 0:
+            return JsonResponse({'success': False, 'error': 'Quantidade inválida.'}, status=400)
+
+    if produto is None or carrinho.remover(produto, quantidade_remover) is None:
+        return JsonResponse({'success': False, 'error': 'Item não encontrado no carrinho.'}, status=404)
+    return resposta_carrinho_produto(carrinho, produto)
+
+
+@login_required
+def carrinho_api_item(request, item_id):
+    """
+    Altera a quantidade de um item (JSON).
+
+    Aceita 'acao' (aumentar/diminuir uma unidade) ou 'quantidade' (valor
+    absoluto; 0 remove o item).
+    """
+    from django.http import JsonResponse
+    from .carrinho import decrementar_item, definir_quantidade, incrementar_item
+
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Método não permitido'}, status=405)
+
+    carrinho = obter_carrinho_ativo(request.user)
+    itens = ItemCarrinho.objects.filter(id=item_id, carrinho=carrinho)
+    acao = request.POST.get('acao')
+
+    if acao == 'aumentar':
+        alterado = incrementar_item(itens)
+    elif acao == 'diminuir':
+        alterado = decrementar_item(itens) is not None
+    else:
+        try:
+            quantidade = int(request.POST.get('quantidade', ''))
+        except ValueError:
+            quantidade = -1
+        if quantidade < 0:
+            return resposta_carrinho(carrinho, item_id, status=400, error='Quantidade inválida.')
+        alterado = definir_quantidade(itens, quantidade)
+
+    if alterado:
+        return resposta_carrinho(carrinho, item_id)
+    if carrinho is None or not itens.exists():
+        return JsonResponse({'success': False, 'error': 'Item não encontrado no carrinho.'}, status=404)
+    # Recusado por falta de estoque: a resposta traz a quantidade e o estoque atuais
+    return resposta_carrinho(carrinho, item_id, status=409, error='Estoque insuficiente.')
+
+
+@login_required
+def carrinho_api_remover(request, item_id):
+    """Remove 'quantidade_remover' unidades do item, ou o item inteiro (JSON)"""
+    from django.http import JsonResponse
+    from .carrinho import decrementar_item, definir_quantidade
+
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Método não permitido'}, status=405)
+
+    carrinho = obter_carrinho_ativo(request.user)
+    itens = ItemCarrinho.objects.filter(id=item_id, carrinho=carrinho)
+
+    if request.POST.get('quantidade_remover'):
+        try:
+            quantidade_remover = int(request.POST['quantidade_remover'])
+        except ValueError:
+            quantidade_remover = 0
+        if quantidade_remover <= 0:
+            return resposta_carrinho(carrinho, item_id, status=400, error='Quantidade inválida.')
+        alterado = decrementar_item(itens, quantidade_remover) is not None
+    else:
+        alterado = definir_quantidade(itens, 0)
+
+    if not alterado:
+        return JsonResponse({'success': False, 'error': 'Item não encontrado no carrinho.'}, status=404)
+    return resposta_carrinho(carrinho, item_id)
+
+
+def reservar_estoque_revisao(request, carrinho):
+    """
+    Reserva o estoque do carrinho ao exibir a revisão do pedido.
+
+    Retorna o horário de expiração, ou None (com as mensagens de erro já
+    registradas) se faltar estoque.
+    """
+    from .estoque import EstoqueInsuficiente, reservar_carrinho
+
+    quantidades = {}
+    for item in carrinho.itens.all():
+        quantidades[item.produto_id] = quantidades.get(item.produto_id, 0) + item.quantidade
+    try:
+        return reservar_carrinho(carrinho, quantidades)
+    except EstoqueInsuficiente as erro:
+        for mensagem in erro.mensagens():
+            messages.error(request, mensagem)
+        return None
+
+
 @login_required
 def processar_entrega_domicilio(request):
     """View para processar entrega em domicílio"""
@@ -537,10 +825,16 @@ def processar_entrega_domicilio(request):
         'estado': estado,
         'custo_entrega': str(custo_entrega),
         'prazo_dias': prazo_dias,
+        'chave_idempotencia': uuid.uuid4().hex,
     }
     
     # Buscar carrinho para mostrar na revisão
-    carrinho = obter_carrinho_ativo(request.user)
+    carrinho = obter_carrinho_ativo(request.user, revalidar=True)
+    
+    # Separar o estoque enquanto o cliente revisa o pedido
+    reserva_expira_em = reservar_estoque_revisao(request, carrinho) if carrinho else None
+    if carrinho and reserva_expira_em is None:
+        return redirect('checkout')
     
     # Buscar cartões do usuário
     cartoes = CartaoCredito.objects.filter(usuario=request.user)
@@ -550,7 +844,9 @@ def processar_entrega_domicilio(request):
     return render(request, 'confirmacao_pedido.html', {
         'pedido': pedido_temp, 
         'em_revisao': True,
-        'cartoes': cartoes
+        'cartoes': cartoes,
+        'reserva_expira_em': reserva_expira_em,
+        'chave_idempotencia': request.session['pedido_temp']['chave_idempotencia'],
     })
 
 
@@ -578,10 +874,16 @@ def processar_entrega_retirada(request):
         'loja_id': loja.id,
         'custo_entrega': '0',
         'prazo_dias': loja.prazo_retirada_dias,
+        'chave_idempotencia': uuid.uuid4().hex,
     }
     
     # Buscar carrinho para mostrar na revisão
-    carrinho = obter_carrinho_ativo(request.user)
+    carrinho = obter_carrinho_ativo(request.user, revalidar=True)
+    
+    # Separar o estoque enquanto o cliente revisa o pedido
+    reserva_expira_em = reservar_estoque_revisao(request, carrinho) if carrinho else None
+    if carrinho and reserva_expira_em is None:
+        return redirect('checkout')
     
     # Buscar cartões do usuário
     cartoes = CartaoCredito.objects.filter(usuario=request.user)
@@ -592,10 +894,27 @@ def processar_entrega_retirada(request):
         'pedido': pedido_temp, 
         'loja': loja, 
         'em_revisao': True,
-        'cartoes': cartoes
+        'cartoes': cartoes,
+        'reserva_expira_em': reserva_expira_em,
+        'chave_idempotencia': request.session['pedido_temp']['chave_idempotencia'],
     })
 
 
+def renderizar_pedido_confirmado(request, pedido_id):
+    """Página de confirmação de um pedido já criado, com itens e produtos em uma consulta"""
+    from django.db.models import Prefetch
+    from .models import ItemPedido
+    
+    pedido = Pedido.objects.select_related('cartao', 'loja').prefetch_related(
+        Prefetch('itens', queryset=ItemPedido.objects.select_related('produto'))
+    ).get(id=pedido_id)
+    
+    if pedido.loja:
+        return render(request, 'confirmacao_pedido.html', {'pedido': pedido, 'loja': pedido.loja})
+    else:
+        return render(request, 'confirmacao_pedido.html', {'pedido': pedido})
+
+
 @login_required
 def finalizar_pedido(request):
     """Finaliza o pedido após revisão"""
@@ -604,6 +923,15 @@ def finalizar_pedido(request):
     
     pedido_dados = request.session.get('pedido_temp')
     
+    # Envio repetido (duplo clique ou nova tentativa do cliente): devolve o pedido já criado
+    chave_idempotencia = request.POST.get('chave_idempotencia') or (pedido_dados or {}).get('chave_idempotencia')
+    if chave_idempotencia:
+        pedido_id = Pedido.objects.filter(
+            usuario=request.user, chave_idempotencia=chave_idempotencia
+        ).values_list('id', flat=True).first()
+        if pedido_id:
+            return renderizar_pedido_confirmado(request, pedido_id)
+    
     if not pedido_dados:
         messages.error(request, "Nenhum pedido para finalizar")
         return redirect('checkout')
@@ -624,103 +952,104 @@ def finalizar_pedido(request):
     # Buscar carrinho ativo
     carrinho = obter_carrinho_ativo(request.user)
     
-    if not carrinho or not carrinho.itens.exists():
+    # Uma única leitura dos itens do carrinho, já com os produtos
+    itens_carrinho = list(carrinho.itens.select_related('produto')) if carrinho else []
+    
+    if not itens_carrinho:
         messages.error(request, "Seu carrinho está vazio")
         return redirect('busca')
     
+    from django.db import IntegrityError
     from .models import ItemPedido
+    from .estoque import EstoqueInsuficiente, baixar_estoque
     
-    # Validar estoque disponível antes de criar o pedido
-    erros_estoque = []
-    for item in carrinho.itens.all():
-        estoque_disponivel = item.produto.estoque_total()
-        if estoque_disponivel < item.quantidade:
-            erros_estoque.append(
-                f"{item.produto.nome}: estoque insuficiente (disponível: {estoque_disponivel}, solicitado: {item.quantidade})"
-            )
-    
-    if erros_estoque:
-        for erro in erros_estoque:
-            messages.error(request, erro)
-        return redirect('checkout')
+    vendas = {}
+    for item_carrinho in itens_carrinho:
+        vendas[item_carrinho.produto_id] = vendas.get(item_carrinho.produto_id, 0) + item_carrinho.quantidade
+    # Mesmos preços copiados para os itens do pedido abaixo
+    subtotal_produtos = sum((item_carrinho.calcular_subtotal() for item_carrinho in itens_carrinho), Decimal('0'))
     
-    # Criar o pedido real
     if pedido_dados['tipo_entrega'] == 'DOMICILIO':
-        pedido = Pedido.objects.create(
-            usuario=request.user,
-            tipo_entrega='DOMICILIO',
-            cep=pedido_dados['cep'],
-            endereco=pedido_dados['endereco'],
-            numero=pedido_dados['numero'],
-            complemento=pedido_dados.get('complemento', ''),
-            bairro=pedido_dados['bairro'],
-            cidade=pedido_dados['cidade'],
-            estado=pedido_dados['estado'],
-            custo_entrega=Decimal(pedido_dados['custo_entrega']),
-            prazo_dias=pedido_dados['prazo_dias'],
-            cartao=cartao
-        )
         loja = None
-    else:  
+    else:
         loja = Loja.objects.get(id=pedido_dados['loja_id'])
-        pedido = Pedido.objects.create(
-            usuario=request.user,
-            tipo_entrega='RETIRADA',
-            loja=loja,
-            custo_entrega=Decimal(pedido_dados['custo_entrega']),
-            prazo_dias=pedido_dados['prazo_dias'],
-            cartao=cartao
-        )
-    
-    # Copiar itens do carrinho para o pedido
-    for item_carrinho in carrinho.itens.all():
-        ItemPedido.objects.create(
-            pedido=pedido,
-            produto=item_carrinho.produto,
-            quantidade=item_carrinho.quantidade,
-            preco_unitario=item_carrinho.produto.preco
-        )
     
-    # Reduzir estoque dos produtos
-    for item_carrinho in carrinho.itens.all():
-        quantidade_restante = item_carrinho.quantidade
-        
-        # Buscar estoques do produto ordenados por quantidade decrescente
-        # (prioriza armazéns com mais estoque)
-        estoques = Estoque.objects.filter(
-            produto=item_carrinho.produto, 
-            quantidade__gt=0
-        ).order_by('-quantidade')
-        
-        # Reduzir estoque de um ou mais armazéns conforme necessário
-        for estoque in estoques:
-            if quantidade_restante <= 0:
-                break
-            
-            if estoque.quantidade >= quantidade_restante:
-                # Este armazém tem estoque suficiente
-                estoque.quantidade -= quantidade_restante
-                quantidade_restante = 0
+    try:
+        with transaction.atomic():
+            # Criar o pedido real primeiro: um envio concorrente com a mesma chave
+            # esbarra na restrição única antes de tocar no estoque
+            if loja is None:
+                pedido = Pedido.objects.create(
+                    usuario=request.user,
+                    tipo_entrega='DOMICILIO',
+                    cep=pedido_dados['cep'],
+                    endereco=pedido_dados['endereco'],
+                    numero=pedido_dados['numero'],
+                    complemento=pedido_dados.get('complemento', ''),
+                    bairro=pedido_dados['bairro'],
+                    cidade=pedido_dados['cidade'],
+                    estado=pedido_dados['estado'],
+                    custo_entrega=Decimal(pedido_dados['custo_entrega']),
+                    prazo_dias=pedido_dados['prazo_dias'],
+                    cartao=cartao,
+                    chave_idempotencia=chave_idempotencia,
+                    subtotal_produtos=subtotal_produtos
+                )
             else:
-                # Este armazém não tem estoque suficiente, usar tudo
-                quantidade_restante -= estoque.quantidade
-                estoque.quantidade = 0
+                pedido = Pedido.objects.create(
+                    usuario=request.user,
+                    tipo_entrega='RETIRADA',
+                    loja=loja,
+                    custo_entrega=Decimal(pedido_dados['custo_entrega']),
+                    prazo_dias=pedido_dados['prazo_dias'],
+                    cartao=cartao,
+                    chave_idempotencia=chave_idempotencia,
+                    subtotal_produtos=subtotal_produtos
+                )
             
-            estoque.save()
-    
-    # Desativar o carrinho
-    carrinho.ativo = False
-    carrinho.save()
+            # Reduzir estoque dos produtos; confere a disponibilidade com as linhas travadas
+            baixar_estoque(vendas, cep_destino=loja.cep if loja else pedido_dados['cep'], carrinho=carrinho)
+            
+            # Copiar itens do carrinho para o pedido
+            ItemPedido.objects.bulk_create([
+                ItemPedido(
+                    pedido=pedido,
+                    produto=item_carrinho.produto,
+                    quantidade=item_carrinho.quantidade,
+                    preco_unitario=item_carrinho.produto.preco
+                )
+                for item_carrinho in itens_carrinho
+            ], batch_size=500)
+            
+            # Atualizar os totais vendidos (mais vendidos da página inicial) após o commit
+            transaction.on_commit(lambda: registrar_vendas(pedido.id, vendas))
+            
+            # Desativar o carrinho
+            carrinho.ativo = False
+            carrinho.save()
+    except EstoqueInsuficiente as erro:
+        for mensagem in erro.mensagens():
+            messages.error(request, mensagem)
+        return redirect('checkout')
+    except IntegrityError:
+        # Outro envio com a mesma chave terminou primeiro
+        pedido_id = Pedido.objects.filter(
+            usuario=request.user, chave_idempotencia=chave_idempotencia
+        ).values_list('id', flat=True).first()
+        if pedido_id is None:
+            # A chave não pertence a um pedido deste usuário
+            messages.error(request, "Não foi possível finalizar o pedido. Tente novamente.")
+            return redirect('checkout')
+        return renderizar_pedido_confirmado(request, pedido_id)
     
     # Limpar sessão
-    del request.session['pedido_temp']
+    from .carrinho import CHAVE_PERSISTIDO
+    request.session.pop('pedido_temp', None)
+    request.session.pop(CHAVE_PERSISTIDO, None)
     
     messages.success(request, f"Pedido #{pedido.id} confirmado com sucesso!")
     
-    if loja:
-        return render(request, 'confirmacao_pedido.html', {'pedido': pedido, 'loja': loja})
-    else:
-        return render(request, 'confirmacao_pedido.html', {'pedido': pedido})
+    return renderizar_pedido_confirmado(request, pedido.id)
 
 
 @user_passes_test(lambda u: u.is_superuser)
@@ -789,16 +1118,21 @@ def visualizar_pedidos(request):
     if tipo_entrega:
         pedidos = pedidos.filter(tipo_entrega=tipo_entrega)
     
-    if data_inicio:
-        pedidos = pedidos.filter(data_criacao__date__gte=data_inicio)
+    from .historico import contar_pedidos, filtrar_periodo, pagina_pedidos
+    pedidos = filtrar_periodo(pedidos, data_inicio, data_fim)
     
-    if data_fim:
-        pedidos = pedidos.filter(data_criacao__date__lte=data_fim)
+    if request.GET.get('formato') == 'csv':
+        from .exportacao import exportar_pedidos
+        return exportar_pedidos(pedidos)
     
-    pedidos = pedidos.order_by('-data_criacao')
+    # Uma página por vez, do mais recente para o mais antigo
+    total_pedidos, total_aproximado = contar_pedidos(pedidos)
+    pagina = pagina_pedidos(pedidos, request.GET.get('depois'), request.GET.get('antes'))
     
     context = {
-        'pedidos': pedidos,
+        'pedidos': pagina,
+        'total_pedidos': total_pedidos,
+        'total_aproximado': total_aproximado,
         'tipo_entrega_filtro': tipo_entrega,
         'data_inicio': data_inicio,
         'data_fim': data_fim,
@@ -878,15 +1212,16 @@ def gerenciar_produtos(request):
     categoria = request.GET.get('categoria', '')
     
     if busca:
-        produtos = produtos.filter(
-            Q(codigo__icontains=busca) | 
-            Q(nome__icontains=busca) | 
-            Q(descricao__icontains=busca)
-        )
+        # Filtra pelo índice de busca textual, mantendo a ordem por código
+        produtos = buscar_produtos(busca, produtos)
     
     if categoria:
         produtos = produtos.filter(categoria__icontains=categoria)
     
+    if request.GET.get('formato') == 'csv':
+        from .exportacao import exportar_produtos
+        return exportar_produtos(produtos)
+    
     categorias_disponiveis = Produto.objects.values_list('categoria', flat=True).distinct()
     
     context = {
@@ -942,6 +1277,7 @@ def gerenciar_armazens(request):
             try:
                 armazem.nome = request.POST.get('nome')
                 armazem.endereco = request.POST.get('endereco', '')
+                armazem.cep = request.POST.get('cep', '').strip()
                 armazem.save()
                 messages.success(request, f'Armazém "{armazem.nome}" atualizado com sucesso!')
                 return redirect('gerenciar_armazens')
@@ -955,6 +1291,7 @@ def gerenciar_armazens(request):
                 armazem = Armazem.objects.create(
                     nome=request.POST.get('nome'),
                     endereco=request.POST.get('endereco', ''),
+                    cep=request.POST.get('cep', '').strip(),
                 )
                 messages.success(request, f'Armazém "{armazem.nome}" cadastrado com sucesso!')
                 return redirect('gerenciar_armazens')
@@ -1013,40 +1350,30 @@ def gerenciar_estoque(request):
                 
                 # Se mudou o armazém
                 if novo_armazem_id != estoque.armazem.id:
+                    from .estoque import transferir_estoque
                     novo_armazem = Armazem.objects.get(id=novo_armazem_id)
                     produto = estoque.produto
                     armazem_antigo = estoque.armazem
                     
-                    # Verifica se já existe estoque do mesmo produto no novo armazém
-                    estoque_existente = Estoque.objects.filter(
-                        produto=produto,
-                        armazem=novo_armazem
-                    ).first()
-                    
-                    if estoque_existente:
-                        # Soma as quantidades
-                        estoque_existente.quantidade += nova_quantidade
-                        estoque_existente.save()
-                        # Remove o estoque antigo
+                    with transaction.atomic():
+                        # Ajusta a quantidade no armazém atual e transfere todas as unidades,
+                        # com as linhas travadas como na baixa de estoque
+                        if nova_quantidade != estoque.quantidade:
+                            estoque.definir_quantidade(nova_quantidade)
+                            estoque.save()
+                        transferir_estoque(produto.id, novo_armazem, nova_quantidade, origem=armazem_antigo)
+                        # O registro antigo fica vazio; remove como antes
                         estoque.delete()
-                        messages.success(
-                            request, 
-                            f'Estoque de "{produto.nome}" transferido de "{armazem_antigo.nome}" para "{novo_armazem.nome}". '
-                            f'Quantidade somada: {estoque_existente.quantidade} unidades no total.'
-                        )
-                    else:
-                        # Move para o novo armazém
-                        estoque.armazem = novo_armazem
-                        estoque.quantidade = nova_quantidade
-                        estoque.save()
-                        messages.success(
-                            request, 
-                            f'Estoque de "{produto.nome}" transferido de "{armazem_antigo.nome}" para "{novo_armazem.nome}" '
-                            f'com {nova_quantidade} unidades!'
-                        )
+                    
+                    total_destino = Estoque.objects.get(produto=produto, armazem=novo_armazem).quantidade
+                    messages.success(
+                        request, 
+                        f'Estoque de "{produto.nome}" transferido de "{armazem_antigo.nome}" para "{novo_armazem.nome}". '
+                        f'{total_destino} unidades no total no destino.'
+                    )
                 else:
                     # Apenas atualiza a quantidade
-                    estoque.quantidade = nova_quantidade
+                    estoque.definir_quantidade(nova_quantidade)
                     estoque.save()
                     messages.success(request, f'Estoque de "{estoque.produto.nome}" em "{estoque.armazem.nome}" atualizado para {estoque.quantidade} unidades!')
                 
@@ -1076,7 +1403,7 @@ def gerenciar_estoque(request):
                 
                 if not created:
                     # Se já existe, atualiza a quantidade
-                    estoque.quantidade = quantidade
+                    estoque.definir_quantidade(quantidade)
                     estoque.save()
                     messages.success(request, f'Estoque de "{produto.nome}" em "{armazem.nome}" atualizado para {quantidade} unidades!')
                 else:
@@ -1090,7 +1417,10 @@ def gerenciar_estoque(request):
         armazens = Armazem.objects.all().order_by('nome')
         return render(request, 'estoque.html', {'action': 'add', 'produtos': produtos, 'armazens': armazens})
     
-    estoques = Estoque.objects.all().select_related('produto', 'armazem').order_by('produto__codigo', 'armazem__nome')
+    from .models import EstoqueMinimo
+    estoques = Estoque.objects.all().select_related('produto', 'armazem').annotate(
+        minimo=EstoqueMinimo.para('produto', 'produto__categoria')
+    ).order_by('produto__codigo', 'armazem__nome')
     busca_produto = request.GET.get('busca_produto', '')
     armazem_id = request.GET.get('armazem', '')
     apenas_baixo = request.GET.get('apenas_baixo', '')
@@ -1105,7 +1435,12 @@ def gerenciar_estoque(request):
         estoques = estoques.filter(armazem_id=armazem_id)
     
     if apenas_baixo:
-        estoques = estoques.filter(quantidade__lt=30)
+        from django.db.models import F
+        estoques = estoques.filter(quantidade__lt=F('minimo'))
+    
+    if request.GET.get('formato') == 'csv':
+        from .exportacao import exportar_estoque
+        return exportar_estoque(estoques)
     
     armazens = Armazem.objects.all()
     
@@ -1157,8 +1492,8 @@ def pedidos_recentes(request):
     if usuario:
         pedidos = pedidos.filter(usuario__username__icontains=usuario)
     
-    if data_fim:
-        pedidos = pedidos.filter(data_criacao__date__lte=data_fim)
+    from .historico import contar_pedidos, filtrar_periodo, pagina_pedidos
+    pedidos = filtrar_periodo(pedidos, data_fim=data_fim)
     
     if tipo_entrega:
         pedidos = pedidos.filter(tipo_entrega=tipo_entrega)
@@ -1166,12 +1501,15 @@ def pedidos_recentes(request):
     if valor:
         pedidos = pedidos.filter(custo_entrega=valor)
 
-    # Ordenar por data de criação (mais recentes primeiro)
-    pedidos = pedidos.order_by('-data_criacao')
+    # Uma página por vez, do mais recente para o mais antigo
+    total_pedidos, total_aproximado = contar_pedidos(pedidos)
+    pagina = pagina_pedidos(pedidos, request.GET.get('depois'), request.GET.get('antes'))
 
     context = {
         'usuario': usuario,
-        'pedidos': pedidos,
+        'pedidos': pagina,
+        'total_pedidos': total_pedidos,
+        'total_aproximado': total_aproximado,
         'tipo_entrega': tipo_entrega,
         'valor': valor,
         'data_fim': data_fim
@@ -102,6 +102,95 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# CACHE_URL escolhe o backend:
+#   locmem://                 memória do processo (padrão em desenvolvimento)
+#   file:///caminho/da/pasta  arquivos em disco, compartilhado entre processos locais
+#   db://nome_da_tabela       tabela no banco (SQLite local ou PostgreSQL); requer createcachetable
+#   redis://host:6379/0       Redis ou compatível (padrão em produção via REDIS_URL)
+REDIS_URL = config('REDIS_URL', default='')
+CACHE_URL = config(
+    'CACHE_URL',
+    default=REDIS_URL or ('db://mercadocesar_cache' if DATABASE_URL else 'locmem://'),
+)
+
+# Prefixo por deploy: cada commit publicado no Render usa chaves novas
+CACHE_KEY_PREFIX = config(
+    'CACHE_KEY_PREFIX',
+    default='mercadocesar:' + config('RENDER_GIT_COMMIT', default='local')[:12],
+)
+
+esquema_cache, _, local_cache = CACHE_URL.partition('://')
+if esquema_cache in ('redis', 'rediss'):
+    cache_default = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+    }
+elif esquema_cache == 'file':
+    cache_default = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': local_cache or str(BASE_DIR / '.django_cache'),
+    }
+elif esquema_cache == 'db':
+    cache_default = {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': local_cache or 'mercadocesar_cache',
+    }
+elif esquema_cache == 'locmem':
+    cache_default = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': local_cache or 'mercadocesar',
+    }
+else:
+    raise ValueError(f'CACHE_URL com esquema não suportado: {CACHE_URL}')
+
+if esquema_cache in ('file', 'db', 'locmem'):
+    # Os backends locais descartam um terço das chaves ao passar de MAX_ENTRIES
+    # (padrão do Django: 300). O cache guarda um card por produto e versão, além
+    # das travas de recálculo e dos contadores de versão (cache_versoes), então
+    # o limite acompanha o catálogo para que descartes sejam raros. Um contador
+    # descartado só gera uma versão nova, nunca um fragmento antigo.
+    cache_default['OPTIONS'] = {
+        'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=50000, cast=int),
+        'CULL_FREQUENCY': config('CACHE_CULL_FREQUENCY', default=10, cast=int),
+    }
+
+cache_default.update({
+    'KEY_PREFIX': CACHE_KEY_PREFIX,
+    # Incrementar CACHE_VERSION descarta todas as chaves sem trocar o prefixo
+    'VERSION': config('CACHE_VERSION', default=1, cast=int),
+    'TIMEOUT': config('CACHE_TIMEOUT', default=300, cast=int),
+})
+
+CACHES = {
+    'default': cache_default
+}
+
+# O carrinho fica na sessão durante a navegação. Com Redis configurado,
+# 'django.contrib.sessions.backends.cached_db' evita uma leitura no banco por
+# requisição; 'signed_cookies' tira a sessão do banco por completo.
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.db')
+
+
+# Estratégia de alocação de estoque entre armazéns no checkout
+# (maior_estoque, menos_armazens, mais_proximo ou fifo; ver mercadocesar/alocacao.py)
+ESTRATEGIA_ALOCACAO_ESTOQUE = config('ESTRATEGIA_ALOCACAO_ESTOQUE', default='maior_estoque')
+
+# Unidades por armazém abaixo das quais um produto entra no relatório de estoque
+# baixo, quando não há mínimo cadastrado para o produto nem para a categoria
+ESTOQUE_MINIMO_PADRAO = config('ESTOQUE_MINIMO_PADRAO', default=30, cast=int)
+
+# Previsão de demanda (comando prever_demanda): dias até a reposição chegar e
+# dias de venda que cada compra sugerida deve cobrir além do ponto de pedido
+PRAZO_REPOSICAO_DIAS = config('PRAZO_REPOSICAO_DIAS', default=7, cast=int)
+COBERTURA_REPOSICAO_DIAS = config('COBERTURA_REPOSICAO_DIAS', default=14, cast=int)
+
+# Minutos que o estoque fica reservado para o carrinho após a revisão do pedido
+RESERVA_ESTOQUE_MINUTOS = config('RESERVA_ESTOQUE_MINUTOS', default=10, cast=int)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
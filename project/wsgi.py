@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
 application = get_wsgi_application()
+
+# Constrói os índices de busca em memória na subida, antes da primeira busca
+from mercadocesar.autocompletar import aquecer_indice_prefixos  # noqa: E402
+from mercadocesar.busca_aproximada import aquecer_indice_aproximado  # noqa: E402
+
+aquecer_indice_aproximado()
+aquecer_indice_prefixos()